@@ -7,5 +7,7 @@
 #
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
-from dimarray import DimArray,Dim
-from attrarray import AttrArray
+from dimarray import DimArray,Dim,concat
+from attrarray import AttrArray,h5load
+from lazy import LazyDimArray
+from shared import SharedArray
@@ -0,0 +1,292 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+"""
+Compiler for the filter strings used to select from DimArrays (e.g.,
+dat['time >= 0.5']).
+
+Each filter string is parsed once into a tree of vectorized numpy
+operations (no eval) and cached by the string and the dim names.
+"""
+
+import ast
+import operator
+import numpy as np
+
+# maximum number of compiled filter strings to keep
+_max_cache_size = 1000
+_cache = {}
+
+_compare_ops = {ast.Eq:operator.eq,
+                ast.NotEq:operator.ne,
+                ast.Lt:operator.lt,
+                ast.LtE:operator.le,
+                ast.Gt:operator.gt,
+                ast.GtE:operator.ge,
+                ast.In:lambda a,b: np.in1d(a,b),
+                ast.NotIn:lambda a,b: ~np.in1d(a,b)}
+
+_bin_ops = {ast.Add:operator.add,
+            ast.Sub:operator.sub,
+            ast.Mult:operator.mul,
+            ast.Div:operator.div,
+            ast.FloorDiv:operator.floordiv,
+            ast.Mod:operator.mod,
+            ast.Pow:operator.pow,
+            ast.BitAnd:operator.and_,
+            ast.BitOr:operator.or_,
+            ast.BitXor:operator.xor}
+
+_unary_ops = {ast.Invert:operator.invert,
+              ast.Not:np.logical_not,
+              ast.USub:operator.neg,
+              ast.UAdd:operator.pos}
+
+_bool_ops = {ast.And:np.logical_and,
+             ast.Or:np.logical_or}
+
+# numpy functions that can be called in filter strings
+_np_funcs = ['abs','absolute','fabs','round','around','floor','ceil',
+             'mod','fmod','isnan','isinf','isfinite','in1d','logical_and',
+             'logical_or','logical_not','logical_xor']
+
+_constants = {'True':True,'False':False,'None':None}
+
+# numpy constants that can be used in filter strings
+_np_constants = ['pi','e','inf','nan']
+
+
+def compile_query(filter_str, dim_names):
+    """
+    Compile a filter string for a DimArray with the dimensions
+    dim_names (a tuple).
+
+    Returns
+    -------
+    dim_ind : int
+        Index of the dimension the filter applies to.
+    query : function
+        query(dim_values,kwargs) returns the Boolean index for the
+        dimension; kwargs are the keyword arguments of the selection,
+        which can be referenced in the string (e.g., kwargs['t']).
+    is_eq : bool
+        Whether the filter string tests for equality.
+    bounds : function or None
+        For filters that only bound the range of the dimension (e.g.,
+        'time >= 0.5' or '0 <= time < 1'), bounds(kwargs) returns a
+        list of (is_lower,value,inclusive) tuples (or None if a bound
+        is not a scalar). None for all other filters.
+    """
+    key = (filter_str,dim_names)
+    compiled = _cache.get(key)
+    if compiled is None:
+        compiled = _compile(filter_str,dim_names)
+        if len(_cache) >= _max_cache_size:
+            _cache.clear()
+        _cache[key] = compiled
+    return compiled
+
+
+def _compile(filter_str, dim_names):
+    tree = ast.parse(filter_str.strip(),mode='eval').body
+
+    # figure out which dimension we're dealing with
+    used = set([node.id for node in ast.walk(tree)
+                if isinstance(node,ast.Name) and node.id in dim_names])
+    if len(used) == 0:
+        # XXX eventually this should be a custom exception
+        raise ValueError("The provided filter string did not specify "+
+                         "any valid dimensions: "+str(filter_str))
+    if len(used) > 1:
+        raise ValueError("The provided filter string must only refer to "+
+                         "one dimension: "+str(filter_str))
+    dim_name = used.pop()
+    return (list(dim_names).index(dim_name),
+            _compile_node(tree,dim_name,filter_str),
+            '==' in filter_str,
+            _compile_bounds(tree,dim_name,filter_str))
+
+
+# whether the dimension is bounded from below (when it is on the
+# left of the comparison) and whether the bound is inclusive
+_bound_ops = {ast.Lt:(False,False),
+              ast.LtE:(False,True),
+              ast.Gt:(True,False),
+              ast.GtE:(True,True)}
+
+
+def _compile_bounds(tree, dim_name, filter_str):
+    """
+    Return a function of kwargs that returns the bounds of a range
+    filter, or None if the filter is not a range filter.
+    """
+    if isinstance(tree,ast.BoolOp) and isinstance(tree.op,ast.And):
+        parts = tree.values
+    elif isinstance(tree,ast.BinOp) and isinstance(tree.op,ast.BitAnd):
+        parts = [tree.left,tree.right]
+    else:
+        parts = [tree]
+
+    bounds = []
+    for part in parts:
+        if part is not tree and isinstance(part,(ast.BoolOp,ast.BinOp)):
+            # nested conjunctions
+            sub = _compile_bounds(part,dim_name,filter_str)
+            if sub is None:
+                return None
+            bounds.append(sub)
+            continue
+        if (not isinstance(part,ast.Compare) or
+            not np.all([op.__class__ in _bound_ops for op in part.ops])):
+            return None
+        operands = [part.left]+part.comparators
+        for i,op in enumerate(part.ops):
+            left,right = operands[i],operands[i+1]
+            is_lower,inclusive = _bound_ops[op.__class__]
+            if _is_dim(left,dim_name) and not _uses_dim(right,dim_name):
+                value = right
+            elif _is_dim(right,dim_name) and not _uses_dim(left,dim_name):
+                value = left
+                is_lower = not is_lower
+            else:
+                return None
+            bounds.append(_make_bound(
+                    is_lower,_compile_node(value,dim_name,filter_str),
+                    inclusive))
+
+    def get_bounds(kwargs):
+        res = []
+        for b in bounds:
+            b = b(kwargs)
+            if b is None:
+                return None
+            res.extend(b)
+        return res
+    return get_bounds
+
+
+def _make_bound(is_lower, value, inclusive):
+    def bound(kwargs):
+        v = value(None,kwargs)
+        if (np.ndim(v) != 0 or
+            np.asarray(v).dtype.kind not in 'biuf'):
+            return None
+        return [(is_lower,v,inclusive)]
+    return bound
+
+
+def _is_dim(node, dim_name):
+    return isinstance(node,ast.Name) and node.id == dim_name
+
+
+def _uses_dim(node, dim_name):
+    return np.any([_is_dim(n,dim_name) for n in ast.walk(node)])
+
+
+def _compile_node(node, dim_name, filter_str):
+    """
+    Turn an ast node into a function of (dim_values,kwargs).
+    """
+    def comp(n):
+        return _compile_node(n,dim_name,filter_str)
+
+    if isinstance(node,ast.Name):
+        if node.id == dim_name:
+            return lambda dim,kwargs: dim
+        if node.id == 'kwargs':
+            return lambda dim,kwargs: kwargs
+        if node.id in _constants:
+            value = _constants[node.id]
+            return lambda dim,kwargs: value
+        raise ValueError("Unknown name '"+node.id+"' in filter string: "+
+                         str(filter_str))
+    elif isinstance(node,ast.Num):
+        value = node.n
+        return lambda dim,kwargs: value
+    elif isinstance(node,ast.Str):
+        value = node.s
+        return lambda dim,kwargs: value
+    elif isinstance(node,(ast.Tuple,ast.List)):
+        elts = [comp(n) for n in node.elts]
+        return lambda dim,kwargs: [e(dim,kwargs) for e in elts]
+    elif isinstance(node,ast.Compare):
+        left = comp(node.left)
+        ops = [_get_op(_compare_ops,op,filter_str) for op in node.ops]
+        comparators = [comp(n) for n in node.comparators]
+        if len(ops) == 1:
+            op = ops[0]
+            right = comparators[0]
+            return lambda dim,kwargs: op(left(dim,kwargs),right(dim,kwargs))
+        def chained(dim,kwargs):
+            # e.g., 0 <= time < 1
+            a = left(dim,kwargs)
+            res = True
+            for op,c in zip(ops,comparators):
+                b = c(dim,kwargs)
+                res = np.logical_and(res,op(a,b))
+                a = b
+            return res
+        return chained
+    elif isinstance(node,ast.BoolOp):
+        op = _get_op(_bool_ops,node.op,filter_str)
+        values = [comp(n) for n in node.values]
+        return lambda dim,kwargs: reduce(op,[v(dim,kwargs) for v in values])
+    elif isinstance(node,ast.BinOp):
+        op = _get_op(_bin_ops,node.op,filter_str)
+        left = comp(node.left)
+        right = comp(node.right)
+        return lambda dim,kwargs: op(left(dim,kwargs),right(dim,kwargs))
+    elif isinstance(node,ast.UnaryOp):
+        op = _get_op(_unary_ops,node.op,filter_str)
+        operand = comp(node.operand)
+        return lambda dim,kwargs: op(operand(dim,kwargs))
+    elif isinstance(node,ast.Subscript):
+        # field access (e.g., events['type']) or indexing (kwargs['t'])
+        value = comp(node.value)
+        index = _compile_slice(node.slice,comp,filter_str)
+        return lambda dim,kwargs: value(dim,kwargs)[index(dim,kwargs)]
+    elif (isinstance(node,ast.Attribute) and
+          isinstance(node.value,ast.Name) and
+          node.value.id in ('np','numpy') and node.attr in _np_constants):
+        value = getattr(np,node.attr)
+        return lambda dim,kwargs: value
+    elif isinstance(node,ast.Call):
+        func = node.func
+        if (not isinstance(func,ast.Attribute) or
+            not isinstance(func.value,ast.Name) or
+            not func.value.id in ('np','numpy') or
+            not func.attr in _np_funcs or
+            node.keywords or node.starargs or node.kwargs):
+            raise ValueError("Only calls of the numpy functions "+
+                             str(_np_funcs)+" with positional arguments "+
+                             "are supported in filter strings: "+
+                             str(filter_str))
+        func = getattr(np,func.attr)
+        args = [comp(n) for n in node.args]
+        return lambda dim,kwargs: func(*[a(dim,kwargs) for a in args])
+    raise ValueError("Unsupported expression ("+node.__class__.__name__+
+                     ") in filter string: "+str(filter_str))
+
+
+def _compile_slice(node, comp, filter_str):
+    if isinstance(node,ast.Index):
+        return comp(node.value)
+    elif isinstance(node,ast.Slice):
+        parts = [comp(n) if n is not None else (lambda dim,kwargs: None)
+                 for n in (node.lower,node.upper,node.step)]
+        return lambda dim,kwargs: slice(*[p(dim,kwargs) for p in parts])
+    raise ValueError("Unsupported index in filter string: "+str(filter_str))
+
+
+def _get_op(ops, op, filter_str):
+    try:
+        return ops[op.__class__]
+    except KeyError:
+        raise ValueError("Unsupported operator ("+op.__class__.__name__+
+                         ") in filter string: "+str(filter_str))
@@ -10,6 +10,7 @@
 import numpy as np
 import copy as copylib
 import os
+import cPickle as pickle
 
 try:
     import h5py
@@ -113,7 +114,10 @@ class AttrArray(np.ndarray):
     
     def __array_finalize__(self,obj):
         if not hasattr(self, '_attrs'):
-            self._attrs = copylib.deepcopy(getattr(obj, '_attrs', {}))
+            if isinstance(obj,AttrArray):
+                self._attrs = obj._copy_attrs()
+            else:
+                self._attrs = copylib.deepcopy(getattr(obj, '_attrs', {}))
         # Set all attributes:
         self._set_all_attr()
         # Ensure that the required attributes are present:
@@ -166,6 +170,28 @@ class AttrArray(np.ndarray):
             del self._attrs[name]
         return ret
 
+    def _copy_attrs(self):
+        """
+        Return a copy of the attributes for a new array (e.g., a view
+        or the result of a ufunc) derived from this one.
+        """
+        return copylib.deepcopy(self._attrs)
+
+    @classmethod
+    def _from_trusted(cls, data, attrs):
+        """
+        Return the ndarray data as an instance of cls with the
+        attributes in attrs (which, e.g., for DimArrays must include
+        dims that match the data). The attributes are used as they
+        are, without copying or checking them, so this is only meant
+        for internal use.
+        """
+        result = np.asarray(data).view(AttrArray)
+        result.__class__ = cls
+        result.__dict__.update(attrs)
+        result.__dict__['_attrs'] = attrs
+        return result
+
     def _set_all_attr(self):
         """
         Set all attributes in self._attr
@@ -231,6 +257,25 @@ class AttrArray(np.ndarray):
     def h5save(self, filename, group=None, mode='w', **kwargs):
         """
         Save the data and attributes out to an HDF5 file.
+
+        The data are written to a (by default chunked) dataset and the
+        attributes alongside them, so that the array can be loaded
+        back, also lazily, with h5load. Attributes that are AttrArrays
+        (or arrays of them, such as the dims of a DimArray) are saved
+        as subgroups; attributes that HDF5 cannot store are pickled.
+
+        Parameters
+        ----------
+        filename : {str,h5py.File}
+            Name of the file or an open h5py.File.
+        group : {str},optional
+            Path of the group to save to (created if necessary).
+            Defaults to the root of the file.
+        mode : {str},optional
+            Mode used to open the file if a filename is given.
+        **kwargs
+            Passed to h5py's create_dataset for the data (e.g.,
+            compression='gzip' or chunks=(1,1,1000)).
         """
         if not HAS_H5PY:
             raise RuntimeError("You must have h5py installed to save to hdf5.")
@@ -243,22 +288,54 @@ class AttrArray(np.ndarray):
             # open the file based on the filename
             f = h5py.File(filename, mode)
 
-        # process the group
-        grp = f
-        if not group is None:
-            # see if already exists
-            grp_name = ''
-            for name in os.path.split(group):
-                grp_name = '/'.join([grp_name,name])
-                if grp_name in f:
-                    grp = f[grp_name]
-                else:
-                    grp = grp.create_group(name)
-
-        # grp now has the group where we're going to put the new group
-        # for this AttrArray
-        
-        pass
+        try:
+            # process the group
+            grp = f
+            if not group is None:
+                grp = f.require_group(group)
+
+            # grp now has the group where we're going to put the data
+            # and attributes for this AttrArray
+            self._h5write(grp, **kwargs)
+        finally:
+            if not f is filename:
+                f.close()
+
+    def _h5write(self, grp, **kwargs):
+        """
+        Write the data and attributes to the h5py group grp.
+        """
+        grp.attrs['_module'] = self.__class__.__module__
+        grp.attrs['_class'] = self.__class__.__name__
+
+        data = self.view(np.ndarray)
+        if _h5_storable(data.dtype):
+            if data.size > 0 and data.ndim > 0:
+                kwargs.setdefault('chunks', True)
+            grp.create_dataset('data', data=data, **kwargs)
+        else:
+            # e.g., records with object fields
+            _h5_pickle(grp, 'pickled_data', data)
+
+        attr_grp = grp.create_group('attrs')
+        pickled = {}
+        for name,value in self._attrs.iteritems():
+            if isinstance(value, AttrArray):
+                value._h5write(attr_grp.create_group(name))
+            elif (isinstance(value, np.ndarray) and value.dtype == object and
+                  value.ndim == 1 and len(value) > 0 and
+                  np.all([isinstance(v, AttrArray) for v in value])):
+                # an array of AttrArrays (e.g., dims)
+                sub = attr_grp.create_group(name)
+                sub.attrs['_length'] = len(value)
+                for i,v in enumerate(value):
+                    v._h5write(sub.create_group(str(i)))
+            elif _h5_simple(value):
+                attr_grp.attrs[name] = value
+            else:
+                pickled[name] = value
+        if pickled:
+            _h5_pickle(attr_grp, '_pickled', pickled)
 
     def nanvar(a, axis=None, ddof=0):
         """
@@ -507,3 +584,133 @@ class AttrArray(np.ndarray):
         
         return(np.mean(a,axis)/factor)
 
+
+######################
+# HDF5 input/output
+######################
+
+def _h5_storable(dtype):
+    """
+    Whether h5py can store data of the dtype.
+    """
+    if dtype.fields is None:
+        return dtype.kind in 'biufcS'
+    return np.all([_h5_storable(dtype.fields[name][0])
+                   for name in dtype.names])
+
+def _h5_simple(value):
+    """
+    Whether value can be stored as an HDF5 attribute.
+    """
+    if isinstance(value, (str, bool, int, long, float, np.number, np.bool_)):
+        return True
+    return (isinstance(value, np.ndarray) and value.size > 0 and
+            value.dtype.fields is None and value.dtype.kind in 'biufS')
+
+def _h5_pickle(grp, name, value):
+    grp.create_dataset(name, data=np.frombuffer(
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL), dtype=np.uint8))
+
+def _h5_unpickle(dset):
+    return pickle.loads(dset[...].tostring())
+
+def _h5_class(grp):
+    """
+    Return the AttrArray (sub)class an array was saved from.
+    """
+    module = __import__(grp.attrs['_module'], fromlist=['__name__'])
+    cls = getattr(module, grp.attrs['_class'])
+    if not (isinstance(cls, type) and issubclass(cls, AttrArray)):
+        raise ValueError("Group "+grp.name+" does not contain an AttrArray.")
+    return cls
+
+def _h5read_attrs(grp):
+    """
+    Read the attributes written by AttrArray._h5write from grp.
+    """
+    attr_grp = grp['attrs']
+    attrs = {}
+    for name,value in attr_grp.attrs.iteritems():
+        attrs[name] = value
+    for name,item in attr_grp.iteritems():
+        if name == '_pickled':
+            attrs.update(_h5_unpickle(item))
+        elif '_length' in item.attrs:
+            value = np.empty(item.attrs['_length'], dtype=object)
+            for i in range(len(value)):
+                value[i] = _h5read(item[str(i)])
+            attrs[name] = value
+        else:
+            attrs[name] = _h5read(item)
+    return attrs
+
+def _h5read(grp):
+    """
+    Read an AttrArray written by AttrArray._h5write from grp.
+    """
+    cls = _h5_class(grp)
+    if 'data' in grp:
+        data = grp['data'][...]
+    else:
+        data = _h5_unpickle(grp['pickled_data'])
+    result = cls._from_trusted(data, _h5read_attrs(grp))
+    # the file may have been changed since it was written
+    result._chk_req_attr()
+    if hasattr(result, '_chk_dims'):
+        result._chk_dims()
+    return result
+
+def h5load(filename, group=None, lazy=False):
+    """
+    Load an AttrArray (or a subclass, such as a DimArray or
+    TimeSeries) saved with the h5save method.
+
+    Parameters
+    ----------
+    filename : {str,h5py.File}
+        Name of the file or an open h5py.File.
+    group : {str},optional
+        Path of the group the array was saved to.
+    lazy : {bool},optional
+        If True, only the attributes (and dims) are loaded and a
+        LazyDimArray is returned that reads the data from the file
+        when they are selected. The file stays open until the
+        LazyDimArray is closed. Only supported for DimArrays.
+
+    Returns
+    -------
+    The loaded array (or a LazyDimArray).
+    """
+    if not HAS_H5PY:
+        raise RuntimeError("You must have h5py installed to load from hdf5.")
+
+    if isinstance(filename, h5py.File):
+        f = filename
+    else:
+        f = h5py.File(filename, 'r')
+
+    try:
+        grp = f
+        if not group is None:
+            grp = f[group]
+        if lazy:
+            from lazy import LazyDimArray
+            cls = _h5_class(grp)
+            if not 'dims' in grp['attrs']:
+                raise ValueError("Lazy loading is only supported for "+
+                                 "DimArrays.")
+            if not 'data' in grp:
+                raise ValueError("Data of this type cannot be loaded lazily.")
+            result = LazyDimArray(grp['data'], cls, _h5read_attrs(grp),
+                                  storage=None if f is filename else f)
+        else:
+            result = _h5read(grp)
+    except:
+        if not f is filename:
+            f.close()
+        raise
+
+    if not lazy and not f is filename:
+        f.close()
+    return result
+
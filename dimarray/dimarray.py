@@ -12,6 +12,7 @@ import copy as copylib
 import re
 
 from attrarray import AttrArray
+from _query import compile_query
 
 ###############################
 # New dimensioned array class
@@ -91,6 +92,52 @@ class Dim(AttrArray):
         # convert to Dim and return:
         return dim.view(cls)
 
+    def __setitem__(self, index, obj):
+        # the values may no longer be sorted
+        self.__dict__.pop('_sorted',None)
+        AttrArray.__setitem__(self, index, obj)
+
+    def __setslice__(self, i, j, obj):
+        self.__dict__.pop('_sorted',None)
+        AttrArray.__setslice__(self, i, j, obj)
+
+    def _is_sorted(self):
+        """
+        Return whether the (numeric) values are monotonically
+        increasing, in which case range selections can be done with
+        searchsorted. The result is cached on the instance; changes
+        through item assignment reset it, but changes through views
+        or in-place arithmetic are not detected.
+        """
+        try:
+            return self.__dict__['_sorted']
+        except KeyError:
+            pass
+        dat = self.view(np.ndarray)
+        is_sorted = (dat.dtype.kind in 'biuf' and
+                     bool(np.all(dat[1:] >= dat[:-1])))
+        # bypass AttrArray.__setattr__ so this is not an attribute
+        # that gets copied to other instances
+        np.ndarray.__setattr__(self,'_sorted',is_sorted)
+        return is_sorted
+
+    def _range_slice(self, bounds):
+        """
+        Return the slice of a sorted Dim with the values within
+        bounds, a list of (is_lower,value,inclusive) tuples.
+        """
+        dat = self.view(np.ndarray)
+        start = 0
+        stop = len(dat)
+        for is_lower,value,inclusive in bounds:
+            if is_lower:
+                side = 'left' if inclusive else 'right'
+                start = max(start,dat.searchsorted(value,side))
+            else:
+                side = 'right' if inclusive else 'left'
+                stop = min(stop,dat.searchsorted(value,side))
+        return slice(start,max(start,stop))
+
 class DimIndex(tuple):
     """
     Tuple representing a fancy index of a Dim along with its siblings.
@@ -249,6 +296,10 @@ class DimSelect(Dim):
         return DimIndex(np.ix_(*ind),ind)
 
 
+# signatures (see DimArray._chk_dims) of dims known to be valid
+_valid_dims = set()
+_max_valid_dims = 10000
+
 class DimArray(AttrArray):
     """
     DimArray(data, dims=None, dtype=None, copy=False, **kwargs)
@@ -265,6 +316,12 @@ class DimArray(AttrArray):
     beyond normal ndarrays.  These include the ability to refer to
     dimensions by name and to select subsets of the data based on
     complex queries using the dimension names.
+
+    In arithmetic between DimArrays with different dimensions (e.g.,
+    subtracting a baseline without the time dimension), the operands
+    are aligned by dimension name: dimensions missing from one operand
+    are broadcast without copying its data, and dimensions only found
+    in the second operand are appended to those of the first.
     
     Parameters
     ----------
@@ -415,11 +472,69 @@ class DimArray(AttrArray):
         # ensure that the dims attribute is valid:
         self._chk_dims()
 
+    def _copy_attrs(self):
+        """
+        Return a copy of the attributes for a new array derived from
+        this one. The Dim instances are shared rather than deep-copied
+        (only the array holding them is copied), which also lets the
+        new array reuse the cached validation of the dims. This is
+        meant for views and the results of ufuncs and reductions;
+        copy() deep-copies the dims.
+        """
+        attrs = self._attrs.copy()
+        dims = attrs.pop('dims',None)
+        attrs = copylib.deepcopy(attrs)
+        if dims is not None:
+            attrs['dims'] = dims.copy()
+        return attrs
+
+    def _deepcopy_dims(self, memo=None):
+        """
+        Replace the (shared) Dim instances with deep copies, so that
+        changing the dims of a copy leaves the original alone.
+        """
+        dims = self._attrs.get('dims')
+        if dims is None:
+            return
+        dims = dims.copy()
+        for i,dim in enumerate(dims):
+            dims[i] = copylib.deepcopy(dim,memo)
+        self._attrs['dims'] = dims
+        self.__dict__['dims'] = dims
+
+    def copy(self, order='C'):
+        """
+        Return a copy of the array (including independent copies of
+        the dims).
+        """
+        ret = np.ndarray.copy(self,order)
+        ret._deepcopy_dims()
+        return ret
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        ret = np.ndarray.__deepcopy__(self,memo)
+        ret._deepcopy_dims(memo)
+        return ret
+
     def _chk_dims(self):
         """
         Ensure that the dims attribute is a list of Dim instances that
         match the array shape.
         """
+        # the checks only depend on the shape and the class, length,
+        # and name of each dim, so combinations that passed before
+        # need not be checked again
+        try:
+            key = (self.shape,tuple([(d.__class__,len(d),d.name)
+                                     for d in self.dims]))
+            if key in _valid_dims:
+                return
+        except (AttributeError,TypeError):
+            key = None
+
         # loop over the dims and make sure they are valid
         for i,d in enumerate(self.dims):
             # make sure it's a dim
@@ -456,13 +571,22 @@ class DimArray(AttrArray):
                                  "and cannot begin with a number\nnames: "+
                                  str(self.dim_names))        
 
+        if key is not None:
+            if len(_valid_dims) >= _max_valid_dims:
+                _valid_dims.clear()
+            _valid_dims.add(key)
+
     def _select_ind(self, *args, **kwargs):
         """
         Returns a tuple of index arrays for the selected conditions
-        and an array of Boolean index arrays.
+        and a list of Boolean index arrays (or slices for range
+        selections on sorted dims). If all selections are ranges on
+        sorted dims, the index is a tuple of slices, so that the
+        selection returns a view rather than a copy.
         """
-        # get starting indicies
-        ind = [np.ones(dim.shape, dtype=np.bool) for dim in self.dims]
+        # get starting indicies (slices until a Boolean index is
+        # needed for a dim)
+        ind = [slice(None)]*len(self.dims)
 
         # set to not remove any dimensions
         remove_dim = np.zeros(len(self.dims), dtype=np.bool)
@@ -474,61 +598,70 @@ class DimArray(AttrArray):
                 raise TypeError('All args must be strings, ' + 
                                 'but you passed: ' + str(type(arg)))
 
-            # process the arg string
-            filterStr = arg
-
-            # figure out which dimension we're dealing with
-            found_dim = False
-            for d,k in enumerate(self.dim_names):
-                # RE makes sure to not replace substrings
-                if re.search(r'\b'+k+r'\b',filterStr) is not None:
-                    # this is our dimension
-                    found_dim = True
-
-                    # replace the string to access the dimension like:
-                    # self['dim1']
-                    filterStr = re.sub(r'\b'+k+r'\b','np.asarray(self["'+k+'"])',filterStr)
-
-                    # get the new index
-                    newind = eval(filterStr)
-                    
-                    # apply it to the proper dimension index
-                    ind[d] = ind[d] & newind
-
-                    # see if we should remove the dim to emulate
-                    # picking a specific index (e.g., x[10] same as
-                    # x["time==4"])
-                    # we normally require each value in a dim is unique,
-                    # but a dim could be a list of events that you probe,
-                    # which could have multiple values after an equality test,
-                    # so we only remove a dimension if there is only one index left
-                    if re.search('==',filterStr) and newind.sum()==1:
-                        # we are using equality, so remove dim
-                        remove_dim[d] = True
-
-                    # break this loop to continue the next
-                    break
-                    
-            # if we get to here, the provided string did not specify
-            # any dimensions
-            if not found_dim:
-                # XXX eventually this should be a custom exception
-                raise ValueError("The provided filter string did not specify "+
-                                 "any valid dimensions: "+str(filterStr))
-            
+            # get the (cached) compiled filter for the dimension
+            # it refers to
+            d,query,is_eq,bounds = compile_query(arg,tuple(self.dim_names))
+            dim = self.dims[d]
+
+            # range selections on sorted dims are resolved to slices
+            if (bounds is not None and isinstance(ind[d],slice) and
+                dim._is_sorted()):
+                bounds = bounds(kwargs)
+                if bounds is not None:
+                    start,stop,step = ind[d].indices(len(dim))
+                    newsl = dim._range_slice(bounds)
+                    ind[d] = slice(max(start,newsl.start),
+                                   max(max(start,newsl.start),
+                                       min(stop,newsl.stop)))
+                    continue
+
+            # get the new index
+            newind = query(np.asarray(dim),kwargs)
+
+            # apply it to the proper dimension index
+            ind[d] = self._bool_ind(ind[d],len(dim)) & newind
+
+            # see if we should remove the dim to emulate
+            # picking a specific index (e.g., x[10] same as
+            # x["time==4"])
+            # we normally require each value in a dim is unique,
+            # but a dim could be a list of events that you probe,
+            # which could have multiple values after an equality test,
+            # so we only remove a dimension if there is only one index left
+            if is_eq and newind.sum()==1:
+                # we are using equality, so remove dim
+                remove_dim[d] = True
+
         # loop over the kwargs (the other way to filter)
         for key,value in kwargs.iteritems():
             if key in self.dim_names:
                 # get the proper dimension to cull
                 d = self.dim_names.index(key)
                 # treat as boolean index
-                ind[d] = ind[d] & value
+                ind[d] = self._bool_ind(ind[d],len(self.dims[d])) & value
 
-        # create the final master index from the list of filtered indices
-        m_ind = np.ix_(*ind)
+        if np.all([isinstance(i,slice) for i in ind]):
+            # only slices, so we get a view
+            m_ind = tuple(ind)
+        else:
+            # create the final master index from the list of filtered indices
+            m_ind = np.ix_(*[self._bool_ind(i,len(dim))
+                             for i,dim in zip(ind,self.dims)])
 
         return m_ind,ind,remove_dim
 
+    @staticmethod
+    def _bool_ind(ind, n):
+        """
+        Return ind (a slice or Boolean index) as a Boolean index for
+        n values.
+        """
+        if not isinstance(ind,slice):
+            return ind
+        bool_ind = np.zeros(n, dtype=np.bool)
+        bool_ind[ind] = True
+        return bool_ind
+
     def __setitem__(self, index, obj):
         # process whether we using fancy string-based indices
         if isinstance(index,str):
@@ -785,22 +918,35 @@ class DimArray(AttrArray):
         indices at which to split the data into bins is
         specified. See make_bins method.
         """
-        # Determine which function to use for splitting:
-        if error_on_nonexact:
-            split = np.split
+        # Determine the bin edges as numpy.[array_]split would:
+        n = self.shape[dim]
+        if np.ndim(bins) == 0:
+            nbins = int(bins)
+            if nbins <= 0:
+                raise ValueError('number sections must be larger than 0.')
+            if error_on_nonexact and n % nbins:
+                raise ValueError(
+                    'array split does not result in an equal division')
+            sizes = np.zeros(nbins, dtype=np.int)+n//nbins
+            sizes[:n % nbins] += 1
+            stops = np.cumsum(sizes)
+            starts = stops-sizes
         else:
-            split = np.array_split
+            edges = np.clip(np.asarray(bins, dtype=np.int), 0, n)
+            starts = np.r_[0, edges]
+            stops = np.maximum(np.r_[edges, n], starts)
 
         # Create the new dimension:
-        split_dim = split(self.dims[dim],bins)
+        dim_dat = self.dims[dim]
         if bin_labels == 'function':
-            new_dim_dat = np.array([function(x,**kwargs) for x in split_dim])
+            new_dim_dat = np.array([function(dim_dat[start:stop],**kwargs)
+                                    for start,stop in zip(starts,stops)])
             new_dim = Dim(new_dim_dat,self.dim_names[dim])
         elif bin_labels == 'sequential':
-            new_dim = Dim(np.arange(len(split_dim)),
+            new_dim = Dim(np.arange(len(starts)),
                           self.dim_names[dim])
         elif ((len(np.atleast_1d(bin_labels).shape) == 1) and
-              (len(np.atleast_1d(bin_labels)) == bins)):
+              (len(np.atleast_1d(bin_labels)) == len(starts))):
             new_dim = Dim(np.atleast_1d(bin_labels),
                           self.dim_names[dim])
         else:
@@ -811,20 +957,11 @@ class DimArray(AttrArray):
                              str(bin_labels))
 
         # Create the new data:
-        split_dat = split(self.view(AttrArray),bins,axis=dim)
-        new_dat = np.array([function(x,axis=dim,**kwargs) for x in split_dat])
-        
-        # Now the dimensions of the array need be re-arranged in the correct
-        # order:
-        dim_order = np.arange(len(new_dat.shape))
-        dim_order[dim] = 0
-        dim_order[0:dim] = np.arange(1,dim+1)
-        dim_order[dim+1:len(new_dat.shape)] = np.arange(dim+1,
-                                                        len(new_dat.shape))
-        new_dat = new_dat.transpose(dim_order)
-        
+        new_dat = _reduce_bins(self.view(np.ndarray),dim,starts,stops,
+                               function,**kwargs)
+
         # Create and return new DimArray object:
-        new_dims = copylib.deepcopy(self.dims)
+        new_dims = self.dims.copy()
         new_dims[dim] = new_dim
         new_attrs = self._attrs.copy()
         new_attrs['dims'] = new_dims
@@ -836,20 +973,33 @@ class DimArray(AttrArray):
         Internal method for making bins when the bins are specified as
         a list of intervals. See make_bins method.
         """
+        dim_dat = self.dims[dim]
+        mins = np.array([x[0] for x in bins])
+        maxs = np.array([x[1] for x in bins])
+        if dim_dat._is_sorted():
+            # each bin is a range of the dim
+            dat = dim_dat.view(np.ndarray)
+            starts = np.searchsorted(dat,mins,side='left')
+            stops = np.maximum(np.searchsorted(dat,maxs,side='left'),starts)
+            dimbin_indx = None
+            bin_vals = [dim_dat[start:stop]
+                        for start,stop in zip(starts,stops)]
+        else:
+            dimbin_indx = ((dim_dat[np.newaxis,:]>=mins[:,np.newaxis]) &
+                           (dim_dat[np.newaxis,:]<maxs[:,np.newaxis]))
+            dimbin_indx = np.asarray(dimbin_indx)
+            bin_vals = [dim_dat[indx] for indx in dimbin_indx]
+
         # Create the new dimension:
-        dimbin_indx = np.array([((self.dims[dim]>=x[0]) &
-                                 (self.dims[dim]<x[1])) for x in bins])
         if np.shape(bins[-1])[-1] == 3:
             new_dim_dat = np.array([x[2] for x in bins])
         elif bin_labels == 'function':
-            new_dim_dat = np.array([function(x,**kwargs) for x in
-                                    [self.dims[dim][indx] for indx in
-                                     dimbin_indx]])
+            new_dim_dat = np.array([function(x,**kwargs) for x in bin_vals])
         elif bin_labels == 'sequential':
-            new_dim_dat = np.arange(len(dimbin_indx))
+            new_dim_dat = np.arange(len(bins))
         elif ((len(np.atleast_1d(bin_labels).shape) == 1) and
-              (len(np.atleast_1d(bin_labels)) == bins)):
-            new_dim_dat = np.altleast_1d(bin_labels)
+              (len(np.atleast_1d(bin_labels)) == len(bins))):
+            new_dim_dat = np.atleast_1d(bin_labels)
         else:
             raise ValueError("Invalid value for bin_labels. Allowed values " +
                              "are 'function','sequential', or a 1-D " +
@@ -860,37 +1010,20 @@ class DimArray(AttrArray):
         new_dim = Dim(data=new_dim_dat,name=self.dim_names[dim])
         
         # Create the new data:
-        # We need to transpose the data array so that dim is the first
-        # dimension. We store the new order of dimensions in totrans:
-        totrans = range(len(self.shape))
-        totrans[0] = dim
-        totrans[dim] = 0
-        
-        # Now we are ready to do the transpose:
-        tmpdata = self.copy()
-        tmpdata = np.transpose(tmpdata.view(np.ndarray),totrans)
-        
-        # Now loop through each bin applying the function and concatenate the
-        # data:
-        new_dat = None
-        for b,bin in enumerate(bins):
-            bindata = function(tmpdata[dimbin_indx[b]],axis=0,**kwargs)
-            if new_dat is None:
-                new_dat = bindata[np.newaxis,:]
-            else:
-                new_dat = np.r_[new_dat,bindata[np.newaxis,:]]
-        
-        # transpose back:
-        new_dat = new_dat.transpose(totrans)
+        if dimbin_indx is None:
+            new_dat = _reduce_bins(self.view(np.ndarray),dim,starts,stops,
+                                   function,**kwargs)
+        else:
+            new_dat = _reduce_bins(self.view(np.ndarray),dim,None,None,
+                                   function,masks=dimbin_indx,**kwargs)
         
         # Create and return new DimArray object:
-        new_dims = copylib.deepcopy(self.dims)
+        new_dims = self.dims.copy()
         new_dims[dim] = new_dim
         new_attrs = self._attrs.copy()
         new_attrs['dims'] = new_dims
         return self.__class__(new_dat,**new_attrs)
 
-
     def make_bins(self,axis,bins,function,bin_labels='function',
                   error_on_nonexact=True,**kwargs):
         """
@@ -999,6 +1132,185 @@ class DimArray(AttrArray):
                              "container of min and max values and (optionally)" +
                              " a label for each bin. Provided bins: "+str(bins))
 
+    def groupby(self, axis, key=None, stat='mean', ddof=0, name=None):
+        """
+        Return the data aggregated over the groups of entries along
+        axis that have the same key (e.g., the mean per condition).
+
+        All groups are aggregated at once: the data are sorted by
+        group along axis (no copy is made if they are sorted already)
+        and each group is reduced with grouped reductions.
+
+        Parameters
+        ----------
+        axis : {int,str}
+            The dimension to group. Can be name or number.
+        key : {None,str,array_like},optional
+            The group of each entry along axis: None groups by the
+            values of the dimension, a string by a field of a
+            dimension of records (e.g., the 'type' of events), and an
+            array_like gives the key for each entry.
+        stat : {'mean','sum','var','std','count',sequence},optional
+            The statistic to compute for each group, or a sequence of
+            statistics, which are computed together.
+        ddof : {int},optional
+            Delta degrees of freedom for the variance and standard
+            deviation.
+        name : {str},optional
+            Name of the new group dimension. Defaults to the name of
+            the field for string keys and to the name of the grouped
+            dimension otherwise.
+
+        Returns
+        -------
+        grouped : DimArray
+            A new DimArray in which the dimension axis is replaced by
+            the group dimension with the (sorted) unique keys. For
+            'count', a 1-D DimArray with the number of entries per
+            group. A tuple of results if stat is a sequence.
+
+        Examples
+        --------
+        >>> import numpy as np
+        >>> import dimarray as da
+        >>> events = np.rec.fromarrays([['a','b','a']],names='type')
+        >>> data = da.DimArray(np.arange(6).reshape(3,2),
+        ...                    [da.Dim(events,'events'),
+        ...                     da.Dim(np.arange(2),'time')])
+        >>> data.groupby('events','type')
+        DimArray([[ 2.,  3.],
+               [ 2.,  3.]])
+        >>> data.groupby('events','type').dims[0]
+        Dim(['a', 'b'], dtype='|S1')
+        >>> data.groupby('events','type','count')
+        DimArray([2, 1])
+        """
+        axis = self.get_axis(axis)
+        dim = self.dims[axis]
+        if key is None:
+            keys = np.asarray(dim)
+        elif isinstance(key,str):
+            keys = np.asarray(dim)[key]
+            if name is None:
+                name = key
+        else:
+            keys = np.asarray(key)
+        if name is None:
+            name = self.dim_names[axis]
+        if keys.ndim != 1 or len(keys) != self.shape[axis]:
+            raise ValueError("The key must provide one value for each "+
+                             "entry along the grouped dimension. Length "+
+                             "of the dimension: "+str(self.shape[axis])+
+                             "\nProvided key: "+str(key))
+        stats = [stat] if isinstance(stat,str) else list(stat)
+        for st in stats:
+            if st not in ('mean','sum','var','std','count'):
+                raise ValueError("Invalid stat. Allowed values are 'mean', "+
+                                 "'sum', 'var', 'std', and 'count'. "+
+                                 "Provided stat: "+str(st))
+
+        # find the groups with a single (stable) sort of the keys
+        if len(keys) > 1 and np.any(keys[1:] < keys[:-1]):
+            order = np.argsort(keys,kind='mergesort')
+            keys = keys[order]
+        else:
+            order = None
+        new_group = np.ones(len(keys),dtype=np.bool)
+        new_group[1:] = keys[1:] != keys[:-1]
+        starts = np.flatnonzero(new_group)
+        stops = np.r_[starts[1:],len(keys)]
+        counts = stops-starts
+        group_dim = Dim(keys[starts],name)
+
+        res = {}
+        if len(set(stats)-set(['count'])) > 0:
+            # sort the data by group
+            data = self.view(np.ndarray)
+            if order is not None:
+                data = data.take(order,axis=axis)
+            cnt = counts.reshape((-1,)+(1,)*(data.ndim-axis-1))
+            res['sum'] = _reduce_bins(data,axis,starts,stops,np.sum)
+            dtype = res['sum'].dtype
+            if dtype.kind not in 'fc':
+                dtype = np.dtype(np.float64)
+            res['mean'] = np.true_divide(res['sum'],cnt,dtype=dtype)
+            if 'var' in stats or 'std' in stats:
+                # sum of the squared deviations from the group means
+                dev = data-np.repeat(res['mean'],counts,axis=axis)
+                dev = np.multiply(dev,np.conj(dev),out=dev).real
+                res['var'] = np.true_divide(
+                    _reduce_bins(dev,axis,starts,stops,np.sum),cnt-ddof)
+                res['std'] = np.sqrt(res['var'])
+
+        # create the new DimArrays
+        new_dims = self.dims.copy()
+        new_dims[axis] = group_dim
+        new_attrs = self._attrs.copy()
+        new_attrs['dims'] = new_dims
+        cls = self._grouped_class(axis)
+        ret = []
+        for st in stats:
+            if st == 'count':
+                ret.append(DimArray(counts,[group_dim]))
+            else:
+                ret.append(cls(res[st],**new_attrs))
+        if isinstance(stat,str):
+            return ret[0]
+        return tuple(ret)
+
+    def _align(self, other):
+        """
+        Return views of the data of self and of the DimArray other
+        that broadcast against each other with the dimensions matched
+        by name, along with the dims of the result (the dims of self
+        followed by those only found in other). Dimensions with the
+        same name must have the same values unless one of them has
+        length 1 (and is broadcast).
+        """
+        names = self.dim_names
+        other_names = other.dim_names
+        extra = [name for name in other_names if name not in names]
+        all_names = names+extra
+        dims = np.empty(len(all_names),dtype=object)
+        dims[:len(names)] = list(self.dims)
+        for i,name in enumerate(extra):
+            dims[len(names)+i] = other.dims[other_names.index(name)]
+        for i,name in enumerate(names):
+            if name not in other_names:
+                continue
+            dim = other.dims[other_names.index(name)]
+            if dim is dims[i] or len(dim) == 1:
+                continue
+            if len(dim) == len(dims[i]):
+                if not np.array_equal(np.asarray(dim),np.asarray(dims[i])):
+                    raise ValueError("The values of dimension '"+name+
+                                     "' do not match.")
+                continue
+            if len(dims[i]) == 1:
+                # broadcast self along this dim
+                dims[i] = dim
+                continue
+            raise ValueError("The lengths of dimension '"+name+"' do not "+
+                             "match: "+str(len(dims[i]))+" and "+
+                             str(len(dim)))
+        # the data of self only gain trailing axes, those of other are
+        # transposed to the order of the result and missing axes are
+        # inserted (both without copying)
+        data = self.view(np.ndarray)[(Ellipsis,)+(np.newaxis,)*len(extra)]
+        other_data = other.view(np.ndarray).transpose(
+            [other_names.index(name) for name in all_names
+             if name in other_names])
+        other_data = other_data[tuple([slice(None) if name in other_names
+                                       else np.newaxis
+                                       for name in all_names])]
+        return data,other_data,dims
+
+    def _grouped_class(self, axis):
+        """
+        Return the class of the result of grouping along axis.
+        """
+        return self.__class__
+
     def extend(self, data, axis=0):
         """
         Extend a DimArray along a specified axis.
@@ -1028,38 +1340,7 @@ class DimArray(AttrArray):
             data = [data]
         else:
             data = list(data)
-
-        # make sure we have an axis number:
-        axis = self.get_axis(axis)
-
-        # make sure all dim_names match:
-        dim_names_deviations = [np.sum(d.dim_names!=self.dim_names) for d in data]
-        if np.sum(dim_names_deviations)>0:
-            raise ValueError('Names of the dimensions do not match!')
-                
-        # make sure all dims except for the extended one match:
-        dim_deviations = [np.sum(d.dims!=self.dims) for d in data]
-        if np.sum(dim_deviations)>1:
-            raise ValueError('Dimensions do not match!')
-                
-        # add the current DimArray to the beginning of list:
-        data.insert(0,self)
-
-        # list of dims to be concatenated:
-        conc_dims = [d.dims[axis] for d in data]
-
-        # convert all items to AttrArray view (necessary for call to
-        # np.concatenate which transposes the arrays using the numpy
-        # functions rather than the DimArray functions):
-        data = [d.view(AttrArray) for d in data]
-        #dim_names = [d.name for dat in data for d in dat.dims]
-        
-        new_dat = np.concatenate(data,axis=axis)
-        new_dims = copylib.deepcopy(self.dims)
-        new_dims[axis] = Dim(np.concatenate(conc_dims),self.dim_names[axis])
-        new_attrs = self._attrs.copy()
-        new_attrs['dims'] = new_dims
-        return self.__class__(new_dat,**new_attrs)
+        return concat([self]+data,axis=axis)
 
         # # create new array:
         # result = np.concatenate(data,axis=axis).view(AttrArray)
@@ -1141,7 +1422,8 @@ class DimArray(AttrArray):
         else:
             # pop the dim
             ret.dims = ret.dims[np.arange(len(ret.dims))!=axis]
-            return ret.view(self.__class__)
+            # the remaining dims still match, so no need to check them
+            return self.__class__._from_trusted(ret,ret._attrs)
     
     
     def all(self, axis=None, out=None):
@@ -1345,6 +1627,188 @@ class DimArray(AttrArray):
                                        out=out, ddof=ddof)
         return self._ret_func(ret,axis)
 
+
+# grouped reductions for the bins of make_bins: the ufunc whose
+# reduceat sums/reduces each bin and whether to divide by the bin size
+_bin_ufuncs = {np.mean:(np.add,True),
+               np.sum:(np.add,False),
+               np.add.reduce:(np.add,False),
+               np.min:(np.minimum,False),
+               np.amin:(np.minimum,False),
+               np.minimum.reduce:(np.minimum,False),
+               np.max:(np.maximum,False),
+               np.amax:(np.maximum,False),
+               np.maximum.reduce:(np.maximum,False)}
+
+def _reduce_bins(data, axis, starts, stops, function, masks=None, **kwargs):
+    """
+    Apply function (which takes an axis argument) to each bin of data
+    along axis and return the results (with the bins along axis).
+
+    The bins are the ranges from starts to stops (exclusive) or, if
+    masks is given, the Boolean indices in masks. For the mean, sum,
+    min, and max of non-empty, non-overlapping ranges, all bins are
+    computed at once with the reduceat method of the corresponding
+    ufunc; other functions are called once per bin and their results
+    are written into a preallocated output.
+    """
+    if masks is None:
+        nbins = len(starts)
+        get_bin = lambda b: data[(slice(None),)*axis+
+                                 (slice(starts[b],stops[b]),)]
+    else:
+        nbins = len(masks)
+        get_bin = lambda b: data.compress(masks[b],axis=axis)
+
+    try:
+        ufunc,divide = _bin_ufuncs.get(function,(None,None))
+    except TypeError:
+        # unhashable function
+        ufunc = None
+    if (ufunc is not None and masks is None and not kwargs and nbins > 0 and
+        np.all(stops > starts) and np.all(starts[1:] >= stops[:-1])):
+        # reduce each bin (and the gaps between them, which are
+        # dropped afterwards) with one reduceat call
+        ind = np.empty(2*nbins,dtype=np.intp)
+        ind[0::2] = starts
+        ind[1::2] = stops
+        if ind[-1] == data.shape[axis]:
+            ind = ind[:-1]
+        dtype = None
+        if ufunc is np.add:
+            # accumulate as numpy.sum and numpy.mean do
+            if divide and data.dtype.kind in 'biu':
+                dtype = np.float64
+            else:
+                dtype = np.sum(np.zeros(1,dtype=data.dtype)).dtype
+        new_dat = ufunc.reduceat(data,ind,axis=axis,dtype=dtype)
+        new_dat = new_dat[(slice(None),)*axis+(slice(None,None,2),)]
+        if divide:
+            counts = (stops-starts).reshape((-1,)+(1,)*(data.ndim-axis-1))
+            new_dat = np.true_divide(new_dat,counts,out=new_dat)
+        return new_dat
+
+    # call the function for each bin
+    new_dat = None
+    for b in range(nbins):
+        bindata = np.asarray(function(get_bin(b),axis=axis,**kwargs))
+        if new_dat is None:
+            shape = list(bindata.shape)
+            shape.insert(axis,nbins)
+            new_dat = np.empty(shape,dtype=bindata.dtype)
+        new_dat[(slice(None),)*axis+(b,)] = bindata
+    if new_dat is None:
+        shape = list(data.shape)
+        shape[axis] = 0
+        new_dat = np.empty(shape,dtype=data.dtype)
+    return new_dat
+
+def concat(arrays, axis=0):
+    """
+    Join a sequence of DimArrays along an existing dimension.
+
+    The output is allocated once and every array is copied into its
+    part of it, so joining n arrays at once is much faster than
+    extending a DimArray n times.
+
+    Parameters
+    ----------
+    arrays : sequence of {DimArray} objects
+        The DimArrays must have the same dimensions, except for the
+        dimension corresponding to `axis`.
+    axis : {int,str},optional
+        The axis along which the DimArray objects will be joined.
+
+    Returns
+    -------
+    result : DimArray
+        A new DimArray instance of the same class as the first array.
+
+    Notes
+    -----
+    Only the attributes of the first array are preserved (with the
+    exception of the joined dimension). The other Dim instances are
+    shared with the first array rather than copied.
+    """
+    arrays = list(arrays)
+    if len(arrays) == 0:
+        raise ValueError('Need at least one DimArray to concatenate!')
+    first = arrays[0]
+    axis = first.get_axis(axis)
+    dim_names = first.dim_names
+
+    # make sure all dims except for the joined one match:
+    for dat in arrays[1:]:
+        if dat.dim_names != dim_names:
+            raise ValueError('Names of the dimensions do not match!')
+        for i,dim in enumerate(dat.dims):
+            if i == axis or dim is first.dims[i]:
+                continue
+            if (len(dim) != len(first.dims[i]) or
+                not np.all(np.asarray(dim) == np.asarray(first.dims[i]))):
+                raise ValueError('Dimensions do not match!')
+
+    # copy all data into the output:
+    shape = list(first.shape)
+    shape[axis] = np.sum([dat.shape[axis] for dat in arrays])
+    new_dat = np.empty(shape,dtype=np.result_type(*[dat.dtype
+                                                     for dat in arrays]))
+    ind = [slice(None)]*len(shape)
+    start = 0
+    for dat in arrays:
+        ind[axis] = slice(start,start+dat.shape[axis])
+        new_dat[tuple(ind)] = dat.view(np.ndarray)
+        start += dat.shape[axis]
+
+    new_dims = first.dims.copy()
+    new_dims[axis] = Dim(np.concatenate([dat.dims[axis] for dat in arrays]),
+                         dim_names[axis])
+    new_attrs = first._attrs.copy()
+    new_attrs['dims'] = new_dims
+    return first.__class__._from_trusted(new_dat,new_attrs)
+
+def _named_op(name):
+    """
+    Return the arithmetic method name of DimArray, which aligns the
+    operands by dimension name if both are DimArrays with different
+    dimensions that share at least one name (operands without common
+    dimension names are combined by position as for ndarrays).
+    """
+    nd_op = getattr(np.ndarray,name)
+    inplace = name.startswith('__i')
+    reflected = name.startswith('__r')
+    def op(self, other):
+        if (not isinstance(other,DimArray) or
+            other.dim_names == self.dim_names or
+            not set(other.dim_names) & set(self.dim_names)):
+            return nd_op(self,other)
+        if reflected:
+            # other is the left operand and gives the dimension order
+            other_data,data,dims = other._align(self)
+        else:
+            data,other_data,dims = self._align(other)
+        if inplace:
+            if len(dims) > self.ndim:
+                raise ValueError("Dimensions of the second operand that "+
+                                 "are missing from the first cannot be "+
+                                 "added in place: "+
+                                 str([dim.name for dim in dims[self.ndim:]]))
+            return nd_op(self,other_data)
+        ret = nd_op(data,other_data)
+        if ret is NotImplemented:
+            return ret
+        attrs = self._copy_attrs()
+        attrs['dims'] = dims
+        return self.__class__._from_trusted(ret,attrs)
+    op.__name__ = name
+    op.__doc__ = nd_op.__doc__
+    return op
+
+for _name in ['add','sub','mul','div','truediv','floordiv','mod','pow']:
+    for _prefix in ['__','__i','__r']:
+        setattr(DimArray,_prefix+_name+'__',_named_op(_prefix+_name+'__'))
+del _name,_prefix
+
 # set the doc strings
 
 # Methods that return DimArrays and take an axis argument:
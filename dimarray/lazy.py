@@ -0,0 +1,450 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+class LazyDimArray(object):
+    """
+    LazyDimArray(data, cls, attrs, storage=None)
+
+    A DimArray whose data stay in storage (e.g., an HDF5 dataset or
+    a memory-mapped file) until a part of them is needed, so that it
+    can describe arrays that are larger than memory.
+
+    The dims and other attributes are kept in memory, so selections
+    work as for a DimArray (with filter strings, the select method,
+    or integer, slice, and index array indices), but only the
+    bounding box of the selection is read from storage (as a single
+    hyperslab, or one per run of selected rows for sparse selections
+    along the first axis) before the selection is applied in memory.
+    Reductions along a named axis (e.g., mean('events')) and make_bins
+    run chunk by chunk over the storage and return ordinary in-memory
+    DimArrays.
+
+    LazyDimArrays are usually obtained with h5load(filename,
+    lazy=True) or LazyDimArray.from_memmap.
+
+    Parameters
+    ----------
+    data : {array_like}
+        The stored data (e.g., an h5py Dataset or np.memmap). Must
+        support the shape and dtype attributes and indexing with a
+        tuple of slices.
+    cls : {class}
+        The DimArray (sub)class of the selected data.
+    attrs : {dict}
+        Attributes of the array, including the dims.
+    storage : {object},optional
+        Object to close along with the LazyDimArray (e.g., the h5py
+        File holding the data).
+    """
+    # maximum number of bytes read per chunk in reductions and make_bins
+    chunk_bytes = 64*1024**2
+
+    def __init__(self, data, cls, attrs, storage=None):
+        self._data = data
+        self._cls = cls
+        self._attrs = attrs
+        self._storage = storage
+        # zero-strided array for computing the selections
+        template = as_strided(np.zeros(1, dtype=np.int8), shape=data.shape,
+                              strides=(0,)*len(data.shape))
+        self._template = cls._from_trusted(template, attrs)
+        # check the dims and attributes once up front
+        self._template._chk_dims()
+        self._template._chk_req_attr()
+
+    @classmethod
+    def from_memmap(cls, filename, dims, dtype=np.float64, mode='r',
+                    offset=0, dimarray_cls=None, **kwargs):
+        """
+        Return a LazyDimArray for the data in a raw binary file (in
+        C order), which is memory-mapped rather than read.
+
+        Parameters
+        ----------
+        filename : {str}
+            Name of the file.
+        dims : {list}
+            The Dim instances of the data, which determine the shape.
+        dtype : {numpy.dtype},optional
+            Data type of the file.
+        mode : {str},optional
+            Mode of the memory map (see numpy.memmap).
+        offset : {int},optional
+            Offset of the data in the file in bytes.
+        dimarray_cls : {class},optional
+            The DimArray (sub)class of the selected data (DimArray by
+            default).
+        **kwargs
+            Other attributes of the array (e.g., tdim and samplerate
+            for a TimeSeries).
+        """
+        if dimarray_cls is None:
+            from dimarray import DimArray
+            dimarray_cls = DimArray
+        shape = tuple([len(dim) for dim in dims])
+        data = np.memmap(filename, dtype=dtype, mode=mode, offset=offset,
+                         shape=shape)
+        dims_arr = np.empty(len(dims), dtype=object)
+        dims_arr[:] = dims
+        attrs = dict(kwargs)
+        attrs['dims'] = dims_arr
+        return cls(data, dimarray_cls, attrs)
+
+    def __getattr__(self, name):
+        # attributes of the array (e.g., samplerate)
+        attrs = self.__dict__.get('_attrs', {})
+        if name in attrs:
+            return attrs[name]
+        raise AttributeError("'LazyDimArray' object has no attribute '"+
+                             name+"'")
+
+    def __repr__(self):
+        return 'LazyDimArray(%s, shape=%s, dtype=%s, dims=%s)' % (
+            self._cls.__name__, str(self.shape), str(self.dtype),
+            str(self.dim_names))
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def shape(self):
+        return tuple(self._data.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def dims(self):
+        return self._attrs['dims']
+
+    @property
+    def dim_names(self):
+        return self._template.dim_names
+
+    def get_axis(self, axis):
+        """
+        Get the axis number for a dimension name (see
+        DimArray.get_axis).
+        """
+        return self._template.get_axis(axis)
+
+    def close(self):
+        """
+        Close the storage of the data (e.g., the HDF5 file).
+        """
+        if self._storage is not None:
+            self._storage.close()
+            self._storage = None
+
+    def _read(self, spec):
+        """
+        Read the data given by a list with a slice (with step 1) for
+        each dim and return them as a DimArray with the matching
+        dims. For the first dim, the spec can also be a sorted array
+        of the rows to read.
+        """
+        spec = tuple(spec)
+        attrs = self._attrs.copy()
+        dims = self.dims.copy()
+        for d,sl in enumerate(spec):
+            if not isinstance(sl, slice) or sl != slice(None):
+                dims[d] = dims[d][sl]
+        attrs['dims'] = dims
+        shape = [len(dim) for dim in dims]
+        if np.prod(shape) == 0:
+            # nothing to read
+            data = np.empty(shape, dtype=self.dtype)
+        elif isinstance(spec[0], slice):
+            data = np.asarray(self._data[spec])
+        else:
+            # read each run of consecutive rows
+            rows = spec[0]
+            data = np.empty(shape, dtype=self.dtype)
+            breaks = np.flatnonzero(np.diff(rows) != 1)+1
+            starts = np.r_[0, breaks]
+            stops = np.r_[breaks, len(rows)]
+            for start,stop in zip(starts, stops):
+                data[start:stop] = self._data[
+                    (slice(rows[start], rows[stop-1]+1),)+spec[1:]]
+        return self._cls._from_trusted(data, attrs)
+
+    @staticmethod
+    def _spec(ind, d=None):
+        """
+        Return the part of dim d to read for a slice (with step 1) or
+        a Boolean index: the slice spanning the index or, for sparse
+        indices along the first dim, the selected rows.
+        """
+        if isinstance(ind, slice):
+            return ind
+        nz = np.flatnonzero(ind)
+        if len(nz) == 0:
+            return slice(0, 0)
+        if d == 0 and 2*len(nz) < nz[-1]-nz[0]+1:
+            return nz
+        return slice(nz[0], nz[-1]+1)
+
+    def _chunk_tiles(self, axis):
+        """
+        Return a list of (axis,size) tuples with the axes to split
+        into chunks for processing along axis, and the number of
+        entries per chunk. The axes are split in order (so that the
+        reads stay contiguous) until a chunk holds at most about
+        chunk_bytes bytes (an empty list if the data fit at once, or
+        None if there is no other axis to split).
+        """
+        others = [d for d in range(self.ndim) if d != axis]
+        if len(others) == 0:
+            return None
+        tiles = []
+        nbytes = self.dtype.itemsize*np.prod(self.shape)
+        for d in others:
+            if nbytes <= self.chunk_bytes:
+                break
+            # bytes per entry along d
+            nbytes = nbytes/max(self.shape[d], 1)
+            size = max(1, int(self.chunk_bytes//max(nbytes, 1)))
+            tiles.append((d, size))
+            nbytes *= min(size, self.shape[d])
+        return tiles
+
+    def iterchunks(self, axis=0, size=None):
+        """
+        Iterate over the data in chunks along axis.
+
+        Parameters
+        ----------
+        axis : {int,str},optional
+            The axis to split.
+        size : {int},optional
+            Number of entries along axis per chunk. By default, chunks
+            hold about chunk_bytes bytes.
+
+        Returns
+        -------
+        Generator of DimArrays.
+        """
+        axis = self.get_axis(axis)
+        if size is None:
+            nbytes = self.dtype.itemsize*np.prod(self.shape)/max(
+                self.shape[axis], 1)
+            size = max(1, int(self.chunk_bytes//max(nbytes, 1)))
+        spec = [slice(None)]*self.ndim
+        for start in range(0, self.shape[axis], size):
+            spec[axis] = slice(start, min(start+size, self.shape[axis]))
+            yield self._read(spec)
+
+    def _apply_chunked(self, axis, method, *args, **kwargs):
+        """
+        Call the DimArray method (which processes the data along
+        axis, keeping the other dims) on chunks split along the other
+        axes and join the results.
+        """
+        axis = self.get_axis(axis)
+        tiles = self._chunk_tiles(axis)
+        if tiles is None:
+            return getattr(self.load(), method)(axis, *args, **kwargs)
+        return self._apply_tiles([slice(None)]*self.ndim, tiles, axis,
+                                 method, args, kwargs)
+
+    def _apply_tiles(self, spec, tiles, axis, method, args, kwargs):
+        """
+        Apply the method to the part of the data given by spec, split
+        along the axes in tiles (see _chunk_tiles).
+        """
+        if len(tiles) == 0:
+            return getattr(self._read(spec), method)(axis, *args, **kwargs)
+        chunk_axis,size = tiles[0]
+        res = []
+        spec = list(spec)
+        for start in range(0, self.shape[chunk_axis], size):
+            spec[chunk_axis] = slice(start, min(start+size,
+                                                self.shape[chunk_axis]))
+            res.append(self._apply_tiles(spec, tiles[1:], axis, method,
+                                         args, kwargs))
+        if len(res) == 1:
+            return res[0]
+        from dimarray import concat
+        name = self.dim_names[chunk_axis]
+        ret = concat(res, axis=name)
+        # keep the original dim (with its attributes)
+        ret.dims[ret.dim_names.index(name)] = self.dims[chunk_axis]
+        return ret
+
+    def _reduce(self, method, axis, **kwargs):
+        if axis is None:
+            raise ValueError("Reductions of LazyDimArrays need an axis.")
+        return self._apply_chunked(axis, method, **kwargs)
+
+    def mean(self, axis, dtype=None):
+        """
+        Return the mean along axis (a name or number) as a DimArray.
+        """
+        return self._reduce('mean', axis, dtype=dtype)
+
+    def sum(self, axis, dtype=None):
+        """
+        Return the sum along axis (a name or number) as a DimArray.
+        """
+        return self._reduce('sum', axis, dtype=dtype)
+
+    def var(self, axis, dtype=None, ddof=0):
+        """
+        Return the variance along axis (a name or number) as a
+        DimArray.
+        """
+        return self._reduce('var', axis, dtype=dtype, ddof=ddof)
+
+    def std(self, axis, dtype=None, ddof=0):
+        """
+        Return the standard deviation along axis (a name or number)
+        as a DimArray.
+        """
+        return self._reduce('std', axis, dtype=dtype, ddof=ddof)
+
+    def min(self, axis):
+        """
+        Return the minimum along axis (a name or number) as a
+        DimArray.
+        """
+        return self._reduce('min', axis)
+
+    def max(self, axis):
+        """
+        Return the maximum along axis (a name or number) as a
+        DimArray.
+        """
+        return self._reduce('max', axis)
+
+    def make_bins(self, axis, bins, function, bin_labels='function',
+                  error_on_nonexact=True, **kwargs):
+        """
+        Return the data with the dimension axis binned as specified
+        (see DimArray.make_bins), computed chunk by chunk, as a
+        DimArray.
+        """
+        return self._apply_chunked(axis, 'make_bins', bins, function,
+                                   bin_labels=bin_labels,
+                                   error_on_nonexact=error_on_nonexact,
+                                   **kwargs)
+
+    def _norm_index(self, index):
+        """
+        Split an integer, slice, or index array index into the
+        bounding box to read and the index relative to it.
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+        # expand the Ellipsis
+        if np.any([ind is Ellipsis for ind in index]):
+            i = [ind is Ellipsis for ind in index].index(True)
+            index = (index[:i]+(slice(None),)*(self.ndim-len(index)+1)+
+                     index[i+1:])
+        if len(index) > self.ndim:
+            raise IndexError("Too many indices for a LazyDimArray.")
+        index = index+(slice(None),)*(self.ndim-len(index))
+
+        bbox = []
+        rel = []
+        for d,(n,ind) in enumerate(zip(self.shape, index)):
+            if ind is None:
+                raise IndexError("New axes are not supported for "+
+                                 "LazyDimArrays.")
+            if isinstance(ind, (int, long, np.integer)):
+                i = ind+n if ind < 0 else ind
+                if i < 0 or i >= n:
+                    raise IndexError("Index out of bounds.")
+                bbox.append(slice(i, i+1))
+                rel.append(0)
+            elif isinstance(ind, slice):
+                start,stop,step = ind.indices(n)
+                if step > 0:
+                    bbox.append(slice(start, max(start, stop)))
+                    rel.append(slice(None, None, step))
+                else:
+                    # read the span in ascending order
+                    ind = np.arange(start, stop, step)
+                    if len(ind) == 0:
+                        bbox.append(slice(0, 0))
+                        rel.append(slice(None))
+                    else:
+                        bbox.append(slice(ind[-1], ind[0]+1))
+                        rel.append(slice(None, None, step))
+            else:
+                ind = np.asarray(ind)
+                if ind.ndim != 1:
+                    raise IndexError("Only 1-D index arrays are supported "+
+                                     "for LazyDimArrays.")
+                if ind.dtype == np.bool:
+                    sl = self._spec(ind, d)
+                    bbox.append(sl)
+                    rel.append(ind[sl])
+                else:
+                    ind = np.where(ind < 0, ind+n, ind)
+                    rows = np.unique(ind)
+                    if len(ind) == 0:
+                        bbox.append(slice(0, 0))
+                        rel.append(ind)
+                    elif d == 0 and 2*len(rows) < rows[-1]-rows[0]+1:
+                        # only read the rows that are needed
+                        bbox.append(rows)
+                        rel.append(np.searchsorted(rows, ind))
+                    else:
+                        bbox.append(slice(rows[0], rows[-1]+1))
+                        rel.append(ind-rows[0])
+        return bbox,tuple(rel)
+
+    def __getitem__(self, index):
+        if isinstance(index, str):
+            if index in self.dim_names:
+                # return the dim (as a DimSelect)
+                return self._template[index]
+            args = (index,)
+        elif (isinstance(index, tuple) and
+              np.any([isinstance(ind, str) for ind in index])):
+            args = index
+        else:
+            bbox,rel = self._norm_index(index)
+            return self._read(bbox)[rel]
+
+        # read the box around the selection and apply the filter
+        # strings to it, which selects the same data
+        m_ind,ind,remove_dim = self._template._select_ind(*args)
+        return self._read([self._spec(i, d)
+                           for d,i in enumerate(ind)])[index]
+
+    def select(self, *args, **kwargs):
+        """
+        Return a DimArray with the selected data (see
+        DimArray.select). Only the data spanned by the selection are
+        read from storage.
+        """
+        m_ind,ind,remove_dim = self._template._select_ind(*args, **kwargs)
+        bbox = [self._spec(i, d) for d,i in enumerate(ind)]
+        # crop the Boolean indices to what is read
+        for key in kwargs:
+            if key in self.dim_names:
+                d = self.dim_names.index(key)
+                kwargs[key] = np.asarray(kwargs[key])[bbox[d]]
+        return self._read(bbox).select(*args, **kwargs)
+
+    def load(self):
+        """
+        Read all the data and return them as a DimArray.
+        """
+        return self._read([slice(None)]*self.ndim)
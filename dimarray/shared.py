@@ -0,0 +1,140 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import tempfile
+import numpy as np
+
+
+def _shm_dir():
+    """
+    Return the directory for shared memory files (/dev/shm if
+    available, so that the data never touch the disk).
+    """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class SharedArray(object):
+    """
+    SharedArray(shape, dtype=np.float64, cls=None, attrs=None)
+
+    Handle to an array in shared memory that can be sent to worker
+    processes (e.g., through multiprocessing.Pool.apply_async)
+    without sending the data along.
+
+    Pickling a SharedArray only pickles the name of the shared memory
+    file, the shape and dtype, and the class and attributes (e.g.,
+    the dims of a DimArray). Each process maps the data with the array
+    method without copying them, so workers can read their part of a
+    shared input and write their results directly into a shared
+    output.
+
+    The process that creates a SharedArray owns the file and removes
+    it with unlink (or when the handle is garbage collected). Arrays
+    that are already mapped stay valid after the file is removed.
+
+    Parameters
+    ----------
+    shape : {tuple}
+        Shape of the array.
+    dtype : {numpy.dtype},optional
+        Data type of the array.
+    cls : {class},optional
+        AttrArray (sub)class returned by the array method (a plain
+        ndarray by default).
+    attrs : {dict},optional
+        Attributes of the AttrArray (e.g., including the dims).
+
+    Examples
+    --------
+    >>> shared = SharedArray.from_array(ts)
+    >>> res = pool.apply_async(func, (shared,))
+    >>> # in func: ts = shared.array()
+    """
+    def __init__(self, shape, dtype=np.float64, cls=None, attrs=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.cls = cls
+        self.attrs = attrs
+        self._mm = None
+        fd,self.filename = tempfile.mkstemp(prefix='ptsa_shm_',
+                                            suffix='.dat', dir=_shm_dir())
+        try:
+            os.ftruncate(fd, max(self.nbytes, 1))
+        finally:
+            os.close(fd)
+        self._owner = True
+
+    @classmethod
+    def from_array(cls, arr):
+        """
+        Return a SharedArray with a copy of the data and the class
+        and attributes of arr (an ndarray or AttrArray).
+        """
+        attrs = getattr(arr, '_attrs', None)
+        shared = cls(arr.shape, arr.dtype,
+                     arr.__class__ if attrs is not None else None,
+                     attrs.copy() if attrs is not None else None)
+        shared._map()[...] = arr
+        return shared
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape))*self.dtype.itemsize
+
+    def __getstate__(self):
+        # only send the handle (the receiver does not own the file)
+        state = self.__dict__.copy()
+        state['_mm'] = None
+        state['_owner'] = False
+        return state
+
+    def __repr__(self):
+        return 'SharedArray(%s, shape=%s, dtype=%s)' % (
+            self.filename, str(self.shape), str(self.dtype))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+    def __del__(self):
+        if getattr(self, '_owner', False):
+            self.unlink()
+
+    def _map(self):
+        if self._mm is None:
+            if self.nbytes == 0:
+                self._mm = np.zeros(self.shape, dtype=self.dtype)
+            else:
+                self._mm = np.memmap(self.filename, dtype=self.dtype,
+                                     mode='r+', shape=self.shape)
+        return self._mm
+
+    def array(self):
+        """
+        Return the data mapped into this process (without copying),
+        as an instance of the original class with its attributes.
+        Changes to the data are seen by all processes.
+        """
+        data = self._map().view(np.ndarray)
+        if self.cls is None:
+            return data
+        return self.cls._from_trusted(data, self.attrs.copy())
+
+    def unlink(self):
+        """
+        Remove the shared memory file. Arrays that are already mapped
+        stay valid.
+        """
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
@@ -0,0 +1,70 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+"""
+Micro-benchmark of common operations on small DimArrays.
+
+Run with: python dimarray/tests/bench_dimarray.py
+
+Each operation is timed with the fast path (shared Dim instances and
+cached dim validation) and with the full path (deep copies of the
+dims and a full validation for every new array).
+"""
+
+import timeit
+import numpy as np
+
+from dimarray import AttrArray, DimArray, Dim
+import dimarray.dimarray
+
+
+class _NoCache(set):
+    """Validation cache that never hits."""
+    def __contains__(self, key):
+        return False
+
+
+def _ops():
+    dat = DimArray(np.random.rand(4,10,20),
+                   [Dim(np.arange(4),'channels'),Dim(np.arange(10),'events'),
+                    Dim(np.arange(20)*.01,'time')])
+    return [('construct',lambda: DimArray(np.ones((4,10,20)),dat.dims)),
+            ('index',lambda: dat[1]),
+            ('slice',lambda: dat[:,2:5]),
+            ('ufunc',lambda: dat+1),
+            ('mean',lambda: dat.mean('time')),
+            ('select',lambda: dat['time>=0.05'])]
+
+
+def _time(number):
+    return [(name,timeit.timeit(op,number=number)/number*1e6)
+            for name,op in _ops()]
+
+
+def run(number=2000):
+    fast = _time(number)
+    # temporarily switch to the full path
+    copy_attrs = DimArray._copy_attrs
+    valid_dims = dimarray.dimarray._valid_dims
+    DimArray._copy_attrs = AttrArray._copy_attrs
+    dimarray.dimarray._valid_dims = _NoCache()
+    try:
+        full = _time(number)
+    finally:
+        DimArray._copy_attrs = copy_attrs
+        dimarray.dimarray._valid_dims = valid_dims
+
+    print '%-10s %12s %12s %8s' % ('operation','full (us)','fast (us)',
+                                   'speedup')
+    for (name,f),(name,t) in zip(full,fast):
+        print '%-10s %12.1f %12.1f %7.1fx' % (name,f,t,f/t)
+
+
+if __name__ == '__main__':
+    run()
@@ -11,8 +11,12 @@ import numpy as np
 from numpy.testing import TestCase,\
      assert_array_equal, assert_array_almost_equal
 
-from dimarray import AttrArray
+from dimarray import AttrArray, h5load
+from dimarray.attrarray import HAS_H5PY
 
+import os
+import shutil
+import tempfile
 import cPickle as pickle
 
 class test_AttrArray(TestCase):
@@ -124,6 +128,26 @@ class test_AttrArray(TestCase):
         # make sure has required attr
         self.assertTrue(hasattr(dat2,'_required_attrs'))
 
+    def test_h5save(self):
+        if not HAS_H5PY:
+            return
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir,'dat.h5')
+            dat = AttrArray(np.random.rand(5,6),name='randvals',
+                            scale=np.array([1.,2.]),other=(1,'a'))
+            dat.h5save(fname)
+            dat2 = h5load(fname)
+            self.assertTrue(isinstance(dat2,AttrArray))
+            assert_array_equal(dat2,dat)
+            self.assertEquals(dat2.name,'randvals')
+            assert_array_equal(dat2.scale,dat.scale)
+            self.assertEquals(dat2.other,(1,'a'))
+            # lazy loading needs dims
+            self.assertRaises(ValueError,h5load,fname,lazy=True)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_nanstd(self):
         arr = np.random.rand(10,10,10)
         dat = AttrArray(arr,name='randvals')
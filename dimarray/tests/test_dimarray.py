@@ -12,10 +12,15 @@ from numpy.testing import TestCase,\
      assert_array_equal, assert_array_almost_equal
 from numpy.random import random_sample as rnd
 
-from dimarray import DimArray, Dim
-from dimarray import AttrArray
+from dimarray import DimArray, Dim, concat
+from dimarray import AttrArray, h5load, LazyDimArray
+from dimarray.attrarray import HAS_H5PY
 
+import os
+import shutil
+import tempfile
 import cPickle as pickle
+import copy as copylib
 
 # Dim class
 class test_Dim(TestCase):
@@ -401,6 +406,227 @@ class test_DimArray(TestCase):
         self.assertEquals(dat.select(dim2=dat['dim2']>1,
                                      dim3=dat['dim3']>3).shape,(1,1,2))
 
+    def test_select_strings(self):
+        events = np.rec.fromarrays([['a','b','a','c'],[1,2,3,4]],
+                                   names='type,num')
+        dat = DimArray(np.arange(20).reshape(4,5),
+                       [Dim(events,'events'),Dim(np.arange(5)*.5,'time')])
+        assert_array_equal(dat['time >= 1'],dat[:,2:])
+        assert_array_equal(dat['0.5 <= time < 1.5'],dat[:,1:3])
+        assert_array_equal(dat['(time < 0.5) | (time > 1.5)'],
+                           np.asarray(dat)[:,[0,4]])
+        assert_array_equal(dat['~(time > 1.5) & (time > 0)'],dat[:,1:4])
+        assert_array_equal(dat["events['type'] == 'a'"],dat[[0,2]])
+        assert_array_equal(dat["events['num'] in [2,4]"],dat[[1,3]])
+        assert_array_equal(dat.select('time > kwargs["t"]',t=1.2),
+                           dat[:,3:])
+        assert_array_equal(dat['np.abs(time - 1) < 0.6'],dat[:,1:4])
+        # equality that leaves one value removes the dimension
+        self.assertEquals(dat['time == 1'].dim_names,['events'])
+        self.assertEquals(dat["events['type'] == 'a'"].dim_names,
+                          ['events','time'])
+        # the filters are compiled once
+        from dimarray._query import compile_query
+        self.assertTrue(compile_query('time >= 1',('events','time')) is
+                        compile_query('time >= 1',('events','time')))
+        # strings that are not (supported) queries
+        self.assertRaises(ValueError,dat.__getitem__,'foo > 1')
+        self.assertRaises(ValueError,dat.__getitem__,'time > events')
+        self.assertRaises(ValueError,dat.__getitem__,
+                          "time > __import__('os').getpid()")
+        self.assertRaises(ValueError,dat.__getitem__,'time > self.size')
+        self.assertRaises(SyntaxError,dat.__getitem__,'time >')
+
+    def test_select_ranges(self):
+        arr = np.arange(60).reshape(3,4,5)
+        dat = DimArray(arr,[Dim([3,1,2],'one'),Dim(np.arange(4),'two'),
+                            Dim(np.arange(5)*.5,'three')])
+        # ranges on sorted dims select views
+        sel = dat['three >= 0.5','three < 2','two > 0']
+        assert_array_equal(sel,arr[:,1:,1:4])
+        assert_array_equal(sel.dims[2],[.5,1.,1.5])
+        self.assertTrue(np.may_share_memory(sel,dat))
+        sel = dat.select('(three > 0.2) & (three <= kwargs["t"])','two>=0',
+                         t=1)
+        assert_array_equal(sel,arr[...,1:3])
+        self.assertTrue(np.may_share_memory(sel,dat))
+        self.assertTrue(np.may_share_memory(dat.select('two < 2',t=1),dat))
+        assert_array_equal(dat['three > 9'].shape,(3,4,0))
+        # unsorted dims and other filters fall back to Boolean indices
+        sel = dat['one > 1','three < 1']
+        assert_array_equal(sel,arr[[0,2],:,:2])
+        self.assertFalse(np.may_share_memory(sel,dat))
+        assert_array_equal(dat['(three < 0.5) | (three > 1.5)'],
+                           arr[...,[0,4]])
+        # assignment through a range selection
+        dat['two > 2'] = -1
+        assert_array_equal(dat[:,3],-np.ones((3,5)))
+        # sortedness is rechecked after changes to a dim
+        dim = dat.dims[1]
+        self.assertTrue(dim._is_sorted())
+        dim[0] = 10
+        self.assertFalse(dim._is_sorted())
+        assert_array_equal(dat['two > 2'],np.asarray(dat)[:,[0,3]])
+        self.assertFalse('_sorted' in dim._attrs)
+
+    def test_derived_dims(self):
+        dat = DimArray(np.random.rand(3,4),
+                       [Dim(np.arange(3),'one'),Dim(np.arange(4),'two')])
+        # views, ufuncs and reductions share the unchanged Dim instances
+        # but not the array holding them
+        for res in [dat[1:],dat+1]:
+            self.assertTrue(res.dims[1] is dat.dims[1])
+            self.assertFalse(res.dims is dat.dims)
+        # copies are independent
+        for res in [dat.copy(),copylib.copy(dat),copylib.deepcopy(dat)]:
+            self.assertTrue(isinstance(res,DimArray))
+            assert_array_equal(res.dims[0],dat.dims[0])
+            res.dims[0][0] = 99
+            res.dims[1] = Dim(np.arange(4)+1,'two')
+            assert_array_equal(dat.dims[0],np.arange(3))
+            assert_array_equal(dat.dims[1],np.arange(4))
+        res = dat.mean('one')
+        assert_array_equal(res.dims[0],dat.dims[1])
+        self.assertEquals(res.dim_names,['two'])
+        res.dims[0] = Dim(np.arange(4)+1,'two')
+        assert_array_equal(dat.dims[1],np.arange(4))
+        # validation still catches invalid dims of the same shape
+        self.assertRaises(AttributeError,DimArray,np.random.rand(3,4),
+                          [Dim(np.arange(3),'one'),Dim(np.arange(4),'one')])
+        self.assertRaises(AttributeError,DimArray,np.random.rand(3,4),
+                          [Dim(np.arange(3),'one'),Dim(np.arange(4),'a-b')])
+        self.assertRaises(AttributeError,DimArray,np.random.rand(3,4),
+                          [Dim(np.arange(3),'one'),np.arange(4)])
+
+    def test_h5(self):
+        if not HAS_H5PY:
+            return
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir,'dat.h5')
+            events = np.rec.fromarrays([np.arange(4),['a','b','c','d']],
+                                       names='num,item')
+            dat = DimArray(np.random.rand(4,3,50),
+                           [Dim(events,'events'),
+                            Dim(np.array(['x','y','z']),'chan'),
+                            Dim(np.linspace(0,1,50),'time',units='s')],
+                           misc={'a':[1,2]},note='test')
+            dat.h5save(fname,group='/a/b',compression='gzip')
+            dat2 = h5load(fname,group='/a/b')
+            self.assertTrue(isinstance(dat2,DimArray))
+            assert_array_equal(dat2,dat)
+            self.assertEquals(dat2.dim_names,dat.dim_names)
+            for d,d2 in zip(dat.dims,dat2.dims):
+                assert_array_equal(np.asarray(d2),np.asarray(d))
+            self.assertEquals(dat2.dims[2].units,'s')
+            self.assertEquals(dat2.misc,{'a':[1,2]})
+            self.assertEquals(dat2.note,'test')
+
+            # lazy loading reads the same selections
+            lazy = h5load(fname,group='/a/b',lazy=True)
+            self.assertTrue(isinstance(lazy,LazyDimArray))
+            self.assertEquals(lazy.shape,dat.shape)
+            self.assertEquals(lazy.dim_names,dat.dim_names)
+            for index in [1,(slice(1,3),2),(Ellipsis,slice(None,None,-3)),
+                          (np.array([3,0]),slice(None),slice(10,20)),
+                          (np.array([True,False,True,True]),),
+                          ('time>=.5',),("chan=='y'",'time<.2'),
+                          ("events['item']=='c'",)]:
+                res = lazy[index]
+                exp = dat[index]
+                assert_array_equal(res,exp)
+                self.assertEquals(type(res),type(exp))
+                if isinstance(exp,DimArray):
+                    self.assertEquals(res.dim_names,exp.dim_names)
+                    for d,d2 in zip(exp.dims,res.dims):
+                        assert_array_equal(np.asarray(d2),np.asarray(d))
+            res = lazy.select('time<.5',chan=np.array([True,False,True]))
+            assert_array_equal(res,dat.select(
+                    'time<.5',chan=np.array([True,False,True])))
+            self.assertEquals(lazy['time>2'].shape,(4,3,0))
+            assert_array_equal(lazy.load(),dat)
+            self.assertEquals(lazy.note,'test')
+            lazy.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_lazy(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir,'dat.bin')
+            dims = [Dim(np.arange(20),'events'),
+                    Dim(np.array(['x','y','z']),'chan'),
+                    Dim(np.arange(40)/10.,'time',units='s')]
+            arr = np.random.rand(20,3,40)
+            arr.tofile(fname)
+            dat = DimArray(arr,dims)
+            lazy = LazyDimArray.from_memmap(fname,dims)
+            # process in small chunks
+            lazy.chunk_bytes = 2*3*40*8
+            self.assertEquals(len(list(lazy.iterchunks('events'))),10)
+            for axis in ['events','chan','time',0]:
+                for method in ['mean','sum','var','min','max']:
+                    res = getattr(lazy,method)(axis)
+                    exp = getattr(dat,method)(axis)
+                    self.assertTrue(isinstance(res,DimArray))
+                    assert_array_almost_equal(res,exp)
+                    self.assertEquals(res.dim_names,exp.dim_names)
+            self.assertEquals(lazy.mean('chan').dims[0] is dims[0],True)
+            self.assertEquals(lazy.mean('events').dims[1].units,'s')
+            assert_array_almost_equal(lazy.std('events',ddof=1),
+                                      dat.std('events',ddof=1))
+            self.assertRaises(ValueError,lazy.mean,None)
+            res = lazy.make_bins('time',4,np.mean)
+            exp = dat.make_bins('time',4,np.mean)
+            assert_array_almost_equal(res,exp)
+            assert_array_almost_equal(np.asarray(res.dims[2]),
+                                      np.asarray(exp.dims[2]))
+            # sparse selections along the first axis
+            for index in [np.array([15,2,3,3]),
+                          (np.arange(20)%7==0,1)]:
+                assert_array_equal(lazy[index],dat[index])
+            assert_array_equal(lazy['events<3','time>3'],
+                               dat['events<3','time>3'])
+            sel = np.arange(20)%5==0
+            assert_array_equal(lazy.select(events=sel),dat.select(events=sel))
+            # other DimArray classes and attributes
+            class MyDimArray(DimArray):
+                pass
+            lazy = LazyDimArray.from_memmap(fname,dims,
+                                            dimarray_cls=MyDimArray,note='a')
+            self.assertTrue(isinstance(lazy.mean('time'),MyDimArray))
+            self.assertEquals(lazy[0].note,'a')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_lazy_short_axis(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir,'dat.bin')
+            dims = [Dim(np.arange(10),'events'),Dim(['x','y'],'chan'),
+                    Dim(np.arange(6),'freqs'),Dim(np.arange(40),'time')]
+            arr = np.random.rand(10,2,6,40)
+            arr.tofile(fname)
+            dat = DimArray(arr,dims)
+            lazy = LazyDimArray.from_memmap(fname,dims)
+            # less than one entry of the short chan axis per chunk
+            lazy.chunk_bytes = 10*2*40*8
+            read = lazy._read
+            sizes = []
+            def _read(spec):
+                res = read(spec)
+                sizes.append(res.nbytes)
+                return res
+            lazy._read = _read
+            for axis in ['events','time']:
+                res = lazy.mean(axis)
+                assert_array_almost_equal(res,dat.mean(axis))
+                self.assertEquals(res.dim_names,dat.mean(axis).dim_names)
+            self.assertTrue(len(sizes) > 2)
+            self.assertTrue(max(sizes) <= lazy.chunk_bytes)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_find(self):
         # check indexing with a tuple of arrays and with 1-level dimensions:
         dim1=Dim(['dim'],'dim1')
@@ -509,6 +735,40 @@ class test_DimArray(TestCase):
         dat1dat2 = dat1.extend(dat2,'three')
         arr1arr2 = np.concatenate([arr1,arr2],2)
         assert_array_equal(dat1dat2,arr1arr2)
+        assert_array_equal(dat1dat2.dims[2],np.arange(8))
+        self.assertEquals(dat1dat2.test,'tst')
+        # extend with several arrays at once
+        dat3 = dat1.extend([dat2,dat1],2)
+        assert_array_equal(dat3,np.concatenate([arr1,arr2,arr1],2))
+        assert_array_equal(dat3.dims[2],np.r_[0:8,0:4])
+        # mismatching dims
+        self.assertRaises(ValueError,dat1.extend,dat2,'one')
+        self.assertRaises(ValueError,dat1.extend,dat2.T,'three')
+
+    def test_concat(self):
+        """Test the concat function"""
+        dims = [Dim(np.arange(3),name='one'),Dim(np.arange(4),name='two')]
+        dats = [DimArray(np.ones((3,4))*i,dims=dims,test='tst')
+                for i in range(5)]
+        dat = concat(dats,'one')
+        self.assertTrue(isinstance(dat,DimArray))
+        self.assertEquals(dat.shape,(15,4))
+        assert_array_equal(dat,np.repeat(np.arange(5),3)[:,None]*np.ones(4))
+        assert_array_equal(dat.dims[0],np.tile(np.arange(3),5))
+        self.assertEquals(dat.dim_names,['one','two'])
+        self.assertEquals(dat.test,'tst')
+        # the unchanged dims are shared, not copied
+        self.assertTrue(dat.dims[1] is dats[0].dims[1])
+        self.assertFalse(dat.dims is dats[0].dims)
+        # the result behaves like any other DimArray
+        assert_array_equal(dat.mean('one'),np.ones(4)*2)
+        assert_array_equal(dat['two>1'].shape,(15,2))
+        # the dtype is promoted as needed
+        dats[0] = DimArray(np.zeros((3,4),dtype=np.int8),dims=dims)
+        self.assertEquals(concat(dats,1).dtype,np.float64)
+        self.assertRaises(ValueError,concat,[])
+        self.assertRaises(ValueError,concat,
+                          [dats[0],DimArray(np.ones((3,4)))])
         
         # # test making bins on all dimensions:
         # test1a = dat.make_bins('one',2,np.mean)
@@ -764,8 +1024,125 @@ class test_DimArray(TestCase):
         for d,dn in enumerate(dat.dim_names):
             self.assertEquals(test5a.dim_names[d],dn)
             self.assertEquals(test5b.dim_names[d],dn)
+
+        # grouped reductions match applying the function to each bin
+        arr = np.random.rand(3,20,2).astype(np.float32)
+        two = np.arange(20)*2.
+        dat = DimArray(arr,dims=[Dim(np.arange(3),name='one'),
+                                 Dim(two,name='two'),
+                                 Dim(np.arange(2),name='three')])
+        bins = [[0,10],[14,20],[20,40]]
+        for func in [np.mean,np.sum,np.min,np.max,np.median]:
+            res = dat.make_bins('two',bins,func)
+            self.assertEquals(res.dtype,func(arr,axis=1).dtype)
+            for b,(lo,hi) in enumerate(bins):
+                assert_array_almost_equal(
+                    res[:,b],func(arr[:,(two>=lo)&(two<hi)],axis=1),
+                    decimal=5)
+            res = dat.make_bins('two',4,func)
+            assert_array_almost_equal(
+                res,np.array([func(x,axis=1)
+                              for x in np.split(arr,4,axis=1)]
+                             ).transpose([1,0,2]),decimal=5)
+        # unsorted dims and integer data
+        dat = DimArray(np.arange(20).reshape(2,10),
+                       dims=[Dim(np.arange(2),name='one'),
+                             Dim(np.arange(10)[::-1],name='two')])
+        res = dat.make_bins('two',[[0,3],[3,10]],np.sum)
+        assert_array_equal(res,[[7+8+9,sum(range(7))],
+                                [17+18+19,sum(range(10,17))]])
+        assert_array_equal(dat.make_bins('two',[5],np.sum),
+                           [[10,35],[60,85]])
         
             
+    def test_groupby(self):
+        types = np.array(['b','a','c','a','b','a','a'])
+        events = np.rec.fromarrays([types,np.arange(7)],names='type,num')
+        arr = np.random.rand(7,3,5)
+        dat = DimArray(arr,[Dim(events,'events'),Dim(np.arange(3),'chan'),
+                            Dim(np.arange(5),'time')],note='x')
+        mean,sm,var,std,count = dat.groupby('events','type',
+                                            ['mean','sum','var','std',
+                                             'count'],ddof=1)
+        self.assertEquals(mean.dim_names,['type','chan','time'])
+        self.assertEquals(mean.note,'x')
+        assert_array_equal(np.asarray(mean.dims[0]),['a','b','c'])
+        assert_array_equal(count,[4,2,1])
+        self.assertEquals(count.dim_names,['type'])
+        for g,t in enumerate(['a','b','c']):
+            assert_array_almost_equal(mean[g],arr[types==t].mean(0))
+            assert_array_almost_equal(sm[g],arr[types==t].sum(0))
+            assert_array_almost_equal(var[g],arr[types==t].var(0,ddof=1))
+            assert_array_almost_equal(std[g],arr[types==t].std(0,ddof=1))
+        # other axes and keys
+        res = dat.groupby('time',np.array([0,0,1,1,1]),'sum',name='tbin')
+        self.assertEquals(res.dim_names,['events','chan','tbin'])
+        assert_array_almost_equal(res[:,:,0],arr[:,:,:2].sum(2))
+        assert_array_almost_equal(res[:,:,1],arr[:,:,2:].sum(2))
+        res = dat.groupby(1)
+        assert_array_equal(res,arr)
+        # integer data are averaged as floats
+        res = DimArray(np.arange(4),[Dim([1,2,1,2],'x')]).groupby('x')
+        assert_array_equal(res,[1.,2.])
+        self.assertRaises(ValueError,dat.groupby,'events',[1,2])
+        self.assertRaises(ValueError,dat.groupby,'events','type','median')
+
+    def test_named_arithmetic(self):
+        arr = np.random.rand(2,3,4)
+        dat = DimArray(arr,[Dim(np.arange(2),'a'),Dim(np.arange(3),'b'),
+                            Dim(np.arange(4),'c')],note='x')
+        # missing dims are broadcast by name
+        res = dat-dat.mean('b')
+        self.assertEquals(res.dim_names,['a','b','c'])
+        self.assertEquals(res.note,'x')
+        assert_array_almost_equal(res,arr-arr.mean(1)[:,np.newaxis,:])
+        res = dat/dat.mean('a').mean('c')
+        assert_array_almost_equal(
+            res,arr/arr.mean(0).mean(1)[np.newaxis,:,np.newaxis])
+        # other dim orders and extra dims
+        other = DimArray(np.random.rand(5,4),[Dim(np.arange(5),'d'),
+                                              dat.dims[2]])
+        res = dat*other
+        self.assertEquals(res.dim_names,['a','b','c','d'])
+        assert_array_almost_equal(res,arr[...,np.newaxis]*
+                                  other.view(np.ndarray).T)
+        self.assertRaises(ValueError,dat.__iadd__,other)
+        # in place
+        dat2 = dat.copy()
+        dat2 -= dat.mean('c')
+        assert_array_almost_equal(dat2,arr-arr.mean(2)[:,:,np.newaxis])
+        # unchanged for matching dims, scalars and ndarrays
+        assert_array_almost_equal(dat+dat,2*arr)
+        assert_array_almost_equal(dat**2,arr**2)
+        assert_array_almost_equal(dat+arr[0],arr+arr[0])
+        self.assertRaises(ValueError,dat.__add__,
+                          DimArray(np.ones(3),[Dim(np.arange(3),'c')]))
+        # dims with the same name must have the same values
+        self.assertRaises(ValueError,dat.__add__,
+                          DimArray(np.ones(4),[Dim(np.arange(4)+1,'c')]))
+        # reflected operators align by name in the order of the left
+        # operand
+        res = other.swapaxes(0,1).__rsub__(dat)
+        self.assertEquals(res.dim_names,['a','b','c','d'])
+        assert_array_almost_equal(res,arr[...,np.newaxis]-
+                                  other.view(np.ndarray).T)
+        res = dat.__rsub__(other)
+        self.assertEquals(res.dim_names,['d','c','a','b'])
+        assert_array_almost_equal(
+            res,other.view(np.ndarray)[...,np.newaxis,np.newaxis]-
+            arr.transpose(2,0,1))
+        # without common names, the dims are matched by position
+        res = dat[0]+DimArray(np.ones((3,4)),[Dim(np.arange(3),'x'),
+                                              Dim(np.arange(4),'y')])
+        self.assertEquals(res.shape,(3,4))
+        self.assertEquals(res.dim_names,['b','c'])
+        assert_array_almost_equal(res,arr[0]+1)
+        # the result does not share mutable attributes
+        dat = DimArray(arr,dat.dims,tags=['x'])
+        res = dat-dat.mean('b')
+        res.tags.append('y')
+        self.assertEquals(dat.tags,['x'])
+
     def test_funcs(self):
         """Test the numpy functions"""
         # make ndarray an Dimaray with identical data
@@ -0,0 +1,67 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import multiprocessing as mp
+import cPickle as pickle
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal
+
+from dimarray import DimArray, Dim, SharedArray
+
+
+def _double_row(src, dst, i):
+    dst.array()[i] = 2*src.array()[i]
+    return src.array().dim_names
+
+
+class test_SharedArray(TestCase):
+    def setUp(self):
+        self.dat = DimArray(np.random.rand(3,1000),
+                            [Dim(np.arange(3),'chan'),
+                             Dim(np.arange(1000)*.1,'time')],note='x')
+
+    def test_array(self):
+        shared = SharedArray.from_array(self.dat)
+        arr = shared.array()
+        self.assertTrue(isinstance(arr,DimArray))
+        assert_array_equal(arr,self.dat)
+        self.assertEquals(arr.dim_names,['chan','time'])
+        self.assertEquals(arr.note,'x')
+        # the pickled handle does not contain the data
+        s = pickle.dumps(shared,pickle.HIGHEST_PROTOCOL)
+        self.assertTrue(len(s) < self.dat.nbytes/2)
+        other = pickle.loads(s)
+        other.array()[0] = 0
+        assert_array_equal(arr[0],0)
+        # only the owner removes the file
+        del other
+        self.assertTrue(os.path.exists(shared.filename))
+        shared.unlink()
+        self.assertFalse(os.path.exists(shared.filename))
+        # mapped arrays stay valid
+        assert_array_equal(arr[1],self.dat[1])
+        # plain arrays
+        with SharedArray((2,2),np.int16) as shared:
+            self.assertEquals(shared.array().dtype,np.int16)
+            assert_array_equal(shared.array(),0)
+
+    def test_workers(self):
+        src = SharedArray.from_array(self.dat)
+        dst = SharedArray(self.dat.shape)
+        po = mp.Pool(2)
+        res = [po.apply_async(_double_row,(src,dst,i)) for i in range(3)]
+        po.close()
+        names = [r.get() for r in res]
+        po.join()
+        self.assertEquals(names[0],['chan','time'])
+        assert_array_equal(dst.array(),2*self.dat)
+        src.unlink()
+        dst.unlink()
@@ -0,0 +1,139 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+"""
+Phase synchrony and coherence between all pairs of channels (e.g.,
+from the phase and power returned by ptsa.wavelet.phase_pow_multi).
+"""
+
+import numpy as np
+
+from ptsa.data import TimeSeries, Dim, DimArray
+
+_measures = ('plv','coherence','imag_coherence')
+
+
+def connectivity(phase, power=None, measures='plv',
+                 channel_dim='channels', over_dim='events',
+                 chunk_bytes=64*1024**2):
+    """
+    Calculate the phase locking value (PLV), coherence, and imaginary
+    coherence for all pairs of channels.
+
+    The phases (and amplitudes) are turned into complex vectors along
+    over_dim, and the cross spectra of all pairs of channels are
+    computed at once with batched matrix products. All other
+    dimensions (e.g., frequencies and time) are processed in chunks
+    of about chunk_bytes.
+
+    Parameters
+    ----------
+    phase : {DimArray}
+        The phase (e.g., from phase_pow_multi).
+    power : {DimArray},optional
+        The power with the same dimensions as phase (e.g., from
+        phase_pow_multi). Needed to weight the coherences by the
+        amplitudes; without it, they only depend on the phase.
+    measures : {string, list of strings},optional
+        'plv', 'coherence', and/or 'imag_coherence'.
+    channel_dim : {string},optional
+        Name of the channel dimension.
+    over_dim : {string},optional
+        Name of the dimension to average over (e.g., 'events' for
+        the synchrony across trials at each time, or 'time').
+    chunk_bytes : {int},optional
+        Approximate size (in bytes) of the complex vectors and cross
+        spectra held at once.
+
+    Returns
+    -------
+    A DimArray (a TimeSeries if phase is a TimeSeries and the time
+    dimension remains) with the dimensions channel_i and channel_j
+    first, followed by the remaining dimensions of phase, or a dict of
+    them by measure if measures is a list.
+
+    Notes
+    -----
+    For the complex vectors z_i of channels i and j with the cross
+    spectrum S_ij = mean(z_i*conj(z_j)) over over_dim, the PLV is
+    abs(S_ij) with unit vectors, the coherence is
+    abs(S_ij)/sqrt(S_ii*S_jj), and the imaginary coherence is
+    imag(S_ij)/sqrt(S_ii*S_jj) (signed).
+    """
+    if not isinstance(phase,DimArray):
+        raise ValueError("phase must be a DimArray (e.g., the output of "+
+                         "phase_pow_multi for a TimeSeries).")
+    if power is not None and power.shape != phase.shape:
+        raise ValueError("power must have the same shape as phase: "+
+                         str(power.shape))
+    return_dict = not isinstance(measures,basestring)
+    if not return_dict:
+        measures = [measures]
+    for measure in measures:
+        if measure not in _measures:
+            raise ValueError("Unknown measure (must be one of "+
+                             str(_measures)+"): "+str(measure))
+
+    ch_axis = phase.get_axis(channel_dim)
+    over_axis = phase.get_axis(over_dim)
+    if ch_axis == over_axis:
+        raise ValueError("channel_dim and over_dim must differ.")
+    rest = [i for i in range(phase.ndim) if i not in (ch_axis,over_axis)]
+    order = rest+[ch_axis,over_axis]
+    # (rest,channels,over) with the rest flattened:
+    ph = np.asarray(phase).transpose(order)
+    rshape = ph.shape[:-2]
+    nchan,nover = ph.shape[-2:]
+    ph = ph.reshape((-1,nchan,nover))
+    amp = None
+    if power is not None:
+        amp = np.asarray(power).transpose(order).reshape(ph.shape)
+    ctype = np.result_type(ph.dtype,np.complex64)
+
+    res = dict([(measure,np.empty((len(ph),nchan,nchan),
+                                  np.zeros(0,ctype).real.dtype))
+                for measure in measures])
+    # the complex vectors and cross spectra (twice with amplitudes):
+    row_bytes = 2*np.dtype(ctype).itemsize*nchan*(nover+nchan)
+    step = int(max(1,chunk_bytes//row_bytes))
+    for r0 in range(0,len(ph),step):
+        r1 = min(r0+step,len(ph))
+        z = np.exp(1j*ph[r0:r1]).astype(ctype)
+        if 'plv' in measures or amp is None:
+            cross = np.matmul(z,z.conj().swapaxes(1,2))
+            if 'plv' in measures:
+                res['plv'][r0:r1] = np.abs(cross)/nover
+        if 'coherence' in measures or 'imag_coherence' in measures:
+            if amp is not None:
+                z *= np.sqrt(amp[r0:r1])
+                cross = np.matmul(z,z.conj().swapaxes(1,2))
+            auto = np.diagonal(cross,axis1=1,axis2=2).real
+            norm = np.sqrt(auto[:,:,np.newaxis]*auto[:,np.newaxis,:])
+            if 'coherence' in measures:
+                res['coherence'][r0:r1] = np.abs(cross)/norm
+            if 'imag_coherence' in measures:
+                res['imag_coherence'][r0:r1] = cross.imag/norm
+        del z,cross
+
+    ch_values = np.asarray(phase.dims[ch_axis])
+    dims = [Dim(ch_values,'channel_i'),Dim(ch_values,'channel_j')]
+    dims.extend([phase.dims[i] for i in rest])
+    tdim = getattr(phase,'tdim',None)
+    keep_time = (isinstance(phase,TimeSeries) and
+                 tdim in [phase.dims[i].name for i in rest])
+    for measure in measures:
+        r = res[measure].reshape(rshape+(nchan,nchan))
+        r = np.moveaxis(r,[-2,-1],[0,1])
+        if keep_time:
+            res[measure] = TimeSeries(r,tdim,phase.samplerate,dims=dims)
+        else:
+            res[measure] = DimArray(r,dims=dims)
+    if return_dict:
+        return res
+    return res[measures[0]]
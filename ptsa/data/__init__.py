@@ -11,6 +11,7 @@ from dimarray import Dim,DimArray,AttrArray
 from timeseries import TimeSeries
 
 from basewrapper import BaseWrapper
+from epochcache import EpochCache
 from arraywrapper import ArrayWrapper
 #from edfwrapper import EdfWrapper
 
@@ -18,6 +18,8 @@ class ArrayWrapper(BaseWrapper):
     Interface to data stored in a numpy ndarray where the first
     dimension is the channel and the second dimension is samples.
     """
+    _supports_raw = True
+
     def __init__(self,data,samplerate,annotations=None):
         """Initialize the interface to the data.  You must specify the
         data and the samplerate."""
@@ -39,12 +41,17 @@ class ArrayWrapper(BaseWrapper):
     def _get_annotations(self):
         return self._annotations
 
-    def _load_data(self,channels,event_offsets,dur_samp,offset_samp):
+    def _load_data(self,channels,event_offsets,dur_samp,offset_samp,
+                   raw=False):
         """        
         """
         # allocate for data
-	eventdata = np.empty((len(channels),len(event_offsets),dur_samp),
-                             dtype=self._data.dtype)*np.nan
+        if raw:
+            eventdata = np.empty((len(channels),len(event_offsets),dur_samp),
+                                 dtype=self._data.dtype)
+        else:
+            eventdata = np.empty((len(channels),len(event_offsets),dur_samp),
+                                 dtype=self._data.dtype)*np.nan
 
 	# loop over events
 	for e,evOffset in enumerate(event_offsets):
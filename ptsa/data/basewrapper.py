@@ -10,9 +10,13 @@
 # local imports
 #from events import Events,TsEvents
 from timeseries import TimeSeries,Dim
+from ptsa.filt import BlockFilter, butter_design
 
 # global imports
+import uuid
+import hashlib
 import numpy as np
+from numpy.lib import recfunctions
 
 class BaseWrapper(object):
     """
@@ -21,6 +25,13 @@ class BaseWrapper(object):
     annotations, and channel information.  The annotations and channel
     information will typically be recarrays.
     """
+    # whether _load_data can return the data unscaled in the dtype
+    # in which they are stored
+    _supports_raw = False
+
+    # optional EpochCache for the data returned by get_event_data
+    # (set it on BaseWrapper to share one cache among all wrappers)
+    epoch_cache = None
 
     # required methods that the child class must define.
     def _get_samplerate(self,channel=None):
@@ -111,7 +122,8 @@ class BaseWrapper(object):
     def _load_data(self,channels,event_offsets,dur_samp,offset_samp):
         """
         Method for loading data that each child wrapper class must
-        implement.
+        implement. Wrappers that set _supports_raw must also accept a
+        raw keyword argument (see below).
 
         Parameters
         ----------
@@ -126,6 +138,9 @@ class BaseWrapper(object):
         offset_samp : {int}
             Offset (in samples) from the event onset from where to
             extract the duration of the event.
+        raw : {bool},optional
+            If True, return the data in the dtype in which they are
+            stored and without applying any scaling.
 
         Returns
         -------
@@ -135,6 +150,64 @@ class BaseWrapper(object):
         """
         raise NotImplementedError
 
+    def _load(self,channels,event_offsets,dur_samp,offset_samp,raw=False):
+        """
+        Call _load_data, only passing on raw if it is requested.
+        """
+        if not raw:
+            return self._load_data(channels,event_offsets,dur_samp,offset_samp)
+        if not self._supports_raw:
+            raise NotImplementedError(self.__class__.__name__+
+                                      ' does not support loading raw data.')
+        return self._load_data(channels,event_offsets,dur_samp,offset_samp,
+                               raw=True)
+
+    def _get_scaling(self, channels):
+        """
+        Returns the gain and offset that convert the raw (stored)
+        data of each channel into its actual values, i.e., data =
+        raw*gain + offset.
+
+        Parameters
+        ----------
+        channels : {array_like}
+            Indices of the channels.
+
+        Returns
+        -------
+        gain, offset : {ndarray}
+            Arrays with the gain and the offset for each channel.
+        """
+        return (np.ones(len(channels),dtype=np.float64),
+                np.zeros(len(channels),dtype=np.float64))
+
+    def _get_channel_dim(self, channels, raw=False):
+        """
+        Return the channels Dim for the specified channel indices. For
+        raw data, gain and offset fields are added to the channel
+        info so that the scaling follows any selection of channels.
+        """
+        chan_info = self.channels[channels]
+        if raw:
+            gain,offset = self._get_scaling(channels)
+            if chan_info.dtype.names is None:
+                chan_info = np.rec.fromarrays([chan_info],names='channel')
+            chan_info = recfunctions.append_fields(
+                chan_info,('gain','offset'),(gain,offset),
+                usemask=False,asrecarray=True)
+        return Dim(chan_info,'channels')
+
+    def _get_cache_id(self):
+        """
+        Returns an identifier of the data source for the epoch
+        cache. By default every wrapper instance is distinct; wrappers
+        of files return the file and its modification time so that
+        cached epochs can be shared between instances and sessions.
+        """
+        if not hasattr(self,'_cache_token'):
+            self._cache_token = uuid.uuid4().hex
+        return (self.__class__.__name__,self._cache_token)
+
     def append_data(self, data):
         """
         """
@@ -151,7 +224,7 @@ class BaseWrapper(object):
                        filt_freq=None,filt_type='stop',filt_order=4,
                        keep_buffer=False,
                        loop_axis=None,num_mp_procs=0,eoffset='eoffset',
-                       eoffset_in_time=True):
+                       eoffset_in_time=True,raw=False):
         """
         Return an TimeSeries containing data for the specified channel
         in the form [events,duration].
@@ -186,6 +259,13 @@ class BaseWrapper(object):
         eoffset_in_time: {boolean},optional        
             If True, the unit of the event offsets is taken to be
             time (unit of the data), otherwise samples.
+        raw: {boolean},optional
+            If True, return the data in the dtype in which they are
+            stored (e.g., int16) without applying the channel scaling.
+            The gain and offset of each channel are added to the
+            channels dim and the scaling is applied lazily (see
+            TimeSeries.scaled), at the latest by filtering or
+            resampling.
         """
 
         # translate back to dur and offset
@@ -261,8 +341,27 @@ class BaseWrapper(object):
         channels = np.atleast_1d(channels)
         channels.sort()
 
+        # see if we already have these epochs
+        cache = self.epoch_cache
+        if cache is not None:
+            if filt_freq is not None:
+                filt_freq = np.asarray(filt_freq).tolist()
+            cache_key = cache.make_key(
+                self._get_cache_id(),channels.tolist(),len(event_offsets),
+                hashlib.sha1(np.ascontiguousarray(
+                    event_offsets,dtype=np.int64)).hexdigest(),
+                dur_samp,offset_samp,buf,keep_buffer,filt_freq,filt_type,
+                filt_order,resampled_rate,raw)
+            eventdata = cache.get(cache_key)
+            if eventdata is not None:
+                # use the events that were passed in
+                eventdata.dims[eventdata.get_axis('events')] = Dim(events,
+                                                                   'events')
+                return eventdata
+
         # load the timeseries (this must be implemented by subclasses)
-        eventdata = self._load_data(channels,event_offsets,dur_samp,offset_samp)
+        eventdata = self._load(channels,event_offsets,dur_samp,offset_samp,
+                               raw=raw)
 
         # calc the time range
         # get the samplesize
@@ -271,12 +370,14 @@ class BaseWrapper(object):
         time_range = np.linspace(samp_start,samp_end,dur_samp)
 
         # make it a timeseries
-        dims = [Dim(self.channels[channels],'channels'),  # can index into channels
+        dims = [self._get_channel_dim(channels,raw),  # can index into channels
                 Dim(events,'events'),
                 Dim(time_range,'time')]
         eventdata = TimeSeries(np.asarray(eventdata),
                                'time',
                                self.samplerate,dims=dims)
+        if raw:
+            eventdata.scaling_dim = 'channels'
 
 	# filter if desired
 	if not(filt_freq is None):
@@ -298,17 +399,24 @@ class BaseWrapper(object):
 	    # remove the buffer
             eventdata = eventdata.remove_buffer(buf)
 
+        if cache is not None:
+            cache.put(cache_key,eventdata)
+
         # return the timeseries
         return eventdata
 
-    def get_all_data(self, channels=None):
+    def get_all_data(self, channels=None, raw=False):
         """
         Return a TimeSeries containing all the data.
+
+        If raw is True, the data are returned in the dtype in which
+        they are stored without applying the channel scaling (see
+        get_event_data).
         """
         if channels is None:
             channels = np.arange(self.nchannels)
         dur_samp = self.nsamples
-        data = self._load_data(channels,[0],dur_samp,0)
+        data = self._load(channels,[0],dur_samp,0,raw=raw)
         # remove events dimension
         data = data[:,0,:]
 
@@ -322,14 +430,106 @@ class BaseWrapper(object):
         time_range = np.linspace(samp_start,samp_end,dur_samp)
 
 	# make it a timeseries
-        dims = [Dim(self.channels[channels],'channels'),
+        dims = [self._get_channel_dim(channels,raw),
                 Dim(time_range,'time')]
         data = TimeSeries(np.asarray(data),
                           'time',
                           self.samplerate,dims=dims)
+        if raw:
+            data.scaling_dim = 'channels'
 
         return data
     
+    def filtered_to_hdf5(self, filepath, freq_range, filt_type='stop',
+                         order=4, channels=None, block_dur=60.,
+                         zero_phase=True, **kwargs):
+        """
+        Filter all the data with a Butterworth filter (as
+        TimeSeries.filtered) block by block and write them to an HDF5
+        file, so that whole sessions can be filtered without loading
+        them into memory (see ptsa.filt.BlockFilter).
+
+        Parameters
+        ----------
+        filepath : {str}
+            HDF5 file to write the filtered data to.
+        freq_range : {array_like}
+            The range of frequencies to filter.
+        filt_type = {scipy.signal.band_dict.keys()},optional
+            Filter type.
+        order = {int},optional
+            The order of the filter.
+        channels : {array_like},optional
+            Indices of the channels to filter (all by default).
+        block_dur : {float},optional
+            Duration of the blocks that are loaded at once (in time
+            unit of the data).
+        zero_phase : {bool},optional
+            Whether to filter forward and backward (like filtfilt).
+        **kwargs
+            Passed on to HDF5Wrapper (e.g., dataset_name, file_dtype,
+            or compression). The channel info of the filtered
+            channels is copied unless channel_info is given. For an
+            integer file_dtype without a gain, the data are filtered
+            twice: first to find the gain for the range of the whole
+            recording.
+
+        Returns
+        -------
+        wrapper : {HDF5Wrapper}
+            Wrapper for the filtered data.
+        """
+        from hdf5wrapper import HDF5Wrapper
+
+        if channels is None:
+            channels = np.arange(self.nchannels)
+        channels = np.atleast_1d(channels)
+        if not 'channel_info' in kwargs:
+            kwargs['channel_info'] = self.channels[channels]
+
+        # design the filter as buttfilt does
+        samplerate = self.samplerate
+        b,a = butter_design(order,freq_range,samplerate,filt_type)
+        bf = BlockFilter(b,a,axis=-1,zero_phase=zero_phase)
+
+        nsamples = self.nsamples
+        block_samp = max(int(np.round(block_dur*samplerate)),1)
+        starts = range(0,nsamples,block_samp)
+
+        def filtered_blocks():
+            bf.reset()
+            for start in starts+[None]:
+                if start is not None:
+                    nsamp = min(block_samp,nsamples-start)
+                    block = self._load(channels,[start],nsamp,0)[:,0,:]
+                    data = bf.filter(block)
+                else:
+                    # the rest of a zero-phase filter
+                    data = bf.finish()
+                if data is not None and data.shape[-1] > 0:
+                    yield data
+
+        file_dtype = kwargs.get('file_dtype')
+        if (file_dtype is not None and np.dtype(file_dtype).kind in 'iu' and
+            kwargs.get('gain') is None and kwargs.get('apply_gain',True)):
+            # the gain must fit the range of the whole recording (not
+            # just the first block), which takes a first pass:
+            maxval = 0.
+            for data in filtered_blocks():
+                maxval = max(maxval,np.abs(data).max())
+            if maxval > 0:
+                kwargs['gain'] = (maxval*(1.+kwargs.get('gain_buffer',.005))/
+                                  np.iinfo(file_dtype).max)
+
+        wrapper = None
+        for data in filtered_blocks():
+            if wrapper is None:
+                wrapper = HDF5Wrapper(filepath,data=data,
+                                      samplerate=samplerate,**kwargs)
+            else:
+                wrapper.append_data(data)
+        return wrapper
+
     # class properties
     samplerate = property(lambda self: self._get_samplerate())
     nsamples = property(lambda self: self._get_nsamples())
@@ -12,6 +12,7 @@ from basewrapper import BaseWrapper
 
 # global imports
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import os.path
 from ConfigParser import SafeConfigParser
 import io
@@ -20,6 +21,8 @@ class BVWrapper(BaseWrapper):
     """
     Interface to data stored in a BrainVision Data Format.
     """
+    _supports_raw = True
+
     def __init__(self, filepath):
         """
         Initialize the interface to the data.
@@ -118,6 +121,10 @@ class BVWrapper(BaseWrapper):
                        mode='r')
         self._nsamples = mm.shape[0]/self._nchannels
 
+        # the memmap used for loading is opened on first use and
+        # then kept for the lifetime of the wrapper
+        self._mm = None
+
 
     def _get_nchannels(self):
         return self._nchannels
@@ -131,6 +138,10 @@ class BVWrapper(BaseWrapper):
     def _get_samplerate(self, channel=None):
         return self._samplerate
 
+    def _get_scaling(self, channels):
+        return (self._channel_info['scale'][channels],
+                np.zeros(len(channels)))
+
     def _get_annotations(self):
         # read in from annotations file (must strip off first lines)
         cp = SafeConfigParser()
@@ -169,32 +180,68 @@ class BVWrapper(BaseWrapper):
         # sort by index and return
         return annotations[np.argsort(index)]
     
-    def _load_data(self,channels,event_offsets,dur_samp,offset_samp):
-        """        
-        """
-        # allocate for data
-	eventdata = np.empty((len(channels),len(event_offsets),dur_samp),
-                             dtype=np.float64)*np.nan
-
-        # Memmap to the file
-        mm = np.memmap(self._data_file,dtype=self._dtype,
-                       mode='r',shape=(self._nsamples,self._nchannels))
-        
-	# loop over events
-        for e,ev_offset in enumerate(event_offsets):
-            # set the range
-            ssamp = offset_samp+ev_offset
-
-            if (ssamp + dur_samp - 1) > self._nsamples:
-                raise IOError('Event with offset '+str(ev_offset)+
-                              ' is outside the bounds of the data.')
-
-            # only pick the channels of interest and scale
-            dat = np.multiply(mm[ssamp:ssamp+dur_samp,channels],
-                              self._channel_info['scale'][channels])
-                              #self._channel_scale[channels])
-            eventdata[:,e,:] = dat.T
-
-        return eventdata    
+    def _get_cache_id(self):
+        return (self.__class__.__name__,os.path.abspath(self.filepath),
+                os.path.getmtime(self._data_file))
 
+    def _get_memmap(self):
+        """
+        Return the (samples, channels) memmap into the data file,
+        opening it the first time it is needed.
+        """
+        if self._mm is None:
+            self._mm = np.memmap(self._data_file,dtype=self._dtype,
+                                 mode='r',shape=(self._nsamples,self._nchannels))
+        return self._mm
+
+    def __getstate__(self):
+        # the memmap is reopened on demand after unpickling
+        state = self.__dict__.copy()
+        state['_mm'] = None
+        return state
+
+    def _load_data(self,channels,event_offsets,dur_samp,offset_samp,
+                   raw=False):
+        """
+        Gather the data for all events through a single strided view
+        of the data file, so that the samples are only copied once.
 
+        If raw is True, the data are returned in the binary format of
+        the file (int16 or float32) without applying the channel
+        scales (see _get_scaling).
+        """
+        # make sure we have arrays
+        channels = np.atleast_1d(channels)
+        event_offsets = np.atleast_1d(event_offsets)
+        ssamps = event_offsets + offset_samp
+
+        # check the ranges
+        if dur_samp > self._nsamples:
+            raise IOError('Requested duration of '+str(dur_samp)+
+                          ' samples exceeds the length of the data.')
+        bad_evs = (ssamps < 0) | (ssamps + dur_samp > self._nsamples)
+        if np.any(bad_evs):
+            raise IOError('Event with offset '+str(event_offsets[bad_evs][0])+
+                          ' is outside the bounds of the data.')
+
+        # view the file as every window of dur_samp samples (this
+        # does not read anything from disk)
+        mm = self._get_memmap()
+        windows = as_strided(mm,
+                             shape=(self._nsamples-dur_samp+1,
+                                    dur_samp,self._nchannels),
+                             strides=(mm.strides[0],)+mm.strides)
+
+        # pick out the events and channels of interest in one go,
+        # giving [events,channels,duration], and view as
+        # [channels,events,duration]
+        eventdata = windows[ssamps[:,np.newaxis],:,
+                            channels].transpose(1,0,2)
+
+        if not raw:
+            # scale while converting to float64
+            eventdata = np.multiply(
+                eventdata,
+                self._channel_info['scale'][channels][:,np.newaxis,np.newaxis])
+
+        return eventdata
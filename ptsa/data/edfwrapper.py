@@ -21,6 +21,10 @@ class EdfWrapper(BaseWrapper):
     Interface to data stored in a EDF file and related formats (such
     as BDF).
     """
+    # the EDF library always returns physical values, so raw data
+    # are the same as the scaled data
+    _supports_raw = True
+
     def __init__(self, filepath):
         """
         Initialize the interface to the data.
@@ -71,7 +75,12 @@ class EdfWrapper(BaseWrapper):
     def _get_annotations(self):
         return read_annotations(self.filepath)
 
-    def _load_data(self,channels,event_offsets,dur_samp,offset_samp):
+    def _get_cache_id(self):
+        return (self.__class__.__name__,os.path.abspath(self.filepath),
+                os.path.getmtime(self.filepath))
+
+    def _load_data(self,channels,event_offsets,dur_samp,offset_samp,
+                   raw=False):
         """        
         """
         # allocate for data
@@ -0,0 +1,204 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+# global imports
+import os
+import hashlib
+import tempfile
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+
+class EpochCache(object):
+    """
+    Least-recently-used cache for the epochs returned by
+    BaseWrapper.get_event_data.
+
+    The cache is opt-in: assign an instance to the epoch_cache
+    attribute of a wrapper (or of BaseWrapper to share one cache
+    among all wrappers). Epochs are identified by the wrapper, the
+    channels, the event offsets, the duration and offset in samples,
+    the buffer, and the filter and resample settings, so repeated
+    calls that only differ in the events' other fields are served
+    from memory.
+
+    Parameters
+    ----------
+    max_bytes : {int},optional
+        Maximum number of bytes of data to keep in memory.
+    cache_dir : {str},optional
+        If given, epochs evicted from memory are written to this
+        directory and loaded back on the next request. Files that
+        are already present (e.g., from an earlier session) are
+        reused.
+    max_disk_bytes : {int},optional
+        Maximum number of bytes to keep in cache_dir (unlimited by
+        default).
+    """
+    def __init__(self, max_bytes=256*1024**2, cache_dir=None,
+                 max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._init_state()
+
+    def _init_state(self):
+        self._lock = threading.RLock()
+        self._mem = OrderedDict()
+        self._disk = OrderedDict()
+        self.nbytes = 0
+        self.disk_nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.cache_dir is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # pick up files from earlier sessions (oldest first)
+            files = [f for f in os.listdir(self.cache_dir)
+                     if f.endswith('.pkl')]
+            files.sort(key=lambda f:
+                       os.path.getmtime(os.path.join(self.cache_dir,f)))
+            for f in files:
+                size = os.path.getsize(os.path.join(self.cache_dir,f))
+                self._disk[f[:-4]] = size
+                self.disk_nbytes += size
+
+    def __getstate__(self):
+        # the cached data are not sent along (e.g., to other processes)
+        return {'max_bytes':self.max_bytes,'cache_dir':self.cache_dir,
+                'max_disk_bytes':self.max_disk_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def __len__(self):
+        return len(self._mem)
+
+    def __repr__(self):
+        return ('EpochCache(%d epochs, %d bytes in memory, %d on disk; '+
+                '%d hits, %d misses)') % (len(self._mem),self.nbytes,
+                                          len(self._disk),self.hits,
+                                          self.misses)
+
+    @staticmethod
+    def make_key(*args):
+        """
+        Return the digest of the (reproducible) repr of the arguments,
+        which can also be used as the file name on disk.
+        """
+        return hashlib.sha1(repr(args)).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir,key+'.pkl')
+
+    def get(self, key):
+        """
+        Return a copy of the cached epochs for the key (or None if
+        they are not in the cache).
+        """
+        with self._lock:
+            if key in self._mem:
+                data = self._mem.pop(key)
+                self._mem[key] = data
+                self.hits += 1
+                return data.copy()
+            if key in self._disk:
+                try:
+                    data = pickle.load(open(self._filename(key),'rb'))
+                except (IOError,EOFError,pickle.UnpicklingError):
+                    # the file was removed or is corrupt
+                    self.disk_nbytes -= self._disk.pop(key)
+                else:
+                    self.disk_hits += 1
+                    self.hits += 1
+                    self._store(key,data)
+                    return data.copy()
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        """
+        Add a copy of data (a TimeSeries) to the cache.
+        """
+        with self._lock:
+            self._store(key,data.copy())
+
+    def _store(self, key, data):
+        if key in self._mem:
+            self.nbytes -= self._mem.pop(key).nbytes
+        if data.nbytes > self.max_bytes:
+            # too large to keep in memory
+            self._spill(key,data)
+            return
+        self._mem[key] = data
+        self.nbytes += data.nbytes
+        # evict the least recently used epochs
+        while self.nbytes > self.max_bytes:
+            old_key,old_data = self._mem.popitem(last=False)
+            self.nbytes -= old_data.nbytes
+            self._spill(old_key,old_data)
+
+    def _spill(self, key, data):
+        if self.cache_dir is None or key in self._disk:
+            return
+        # write to a temporary file first so that an interrupted
+        # write never leaves a partial file behind
+        fd,tmpname = tempfile.mkstemp(dir=self.cache_dir,suffix='.tmp')
+        with os.fdopen(fd,'wb') as f:
+            pickle.dump(data,f,pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname,self._filename(key))
+        size = os.path.getsize(self._filename(key))
+        self._disk[key] = size
+        self.disk_nbytes += size
+        while (self.max_disk_bytes is not None and
+               self.disk_nbytes > self.max_disk_bytes):
+            old_key,old_size = self._disk.popitem(last=False)
+            self.disk_nbytes -= old_size
+            if os.path.exists(self._filename(old_key)):
+                os.remove(self._filename(old_key))
+
+    def clear(self, disk=False):
+        """
+        Remove all epochs from memory (and, if disk is True, from the
+        cache directory) and reset the statistics.
+        """
+        with self._lock:
+            if disk and self.cache_dir is not None:
+                for key in self._disk:
+                    if os.path.exists(self._filename(key)):
+                        os.remove(self._filename(key))
+            else:
+                # keep what is in memory available on disk
+                for key,data in self._mem.items():
+                    self._spill(key,data)
+            self._mem.clear()
+            self.nbytes = 0
+            if disk:
+                self._disk.clear()
+                self.disk_nbytes = 0
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        """
+        Return a dict with the hit/miss statistics and the size of
+        the cache.
+        """
+        with self._lock:
+            total = self.hits+self.misses
+            return {'hits':self.hits,
+                    'disk_hits':self.disk_hits,
+                    'misses':self.misses,
+                    'hit_rate':float(self.hits)/total if total else 0.,
+                    'epochs':len(self._mem),
+                    'nbytes':self.nbytes,
+                    'disk_epochs':len(self._disk),
+                    'disk_nbytes':self.disk_nbytes}
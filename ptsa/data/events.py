@@ -9,6 +9,9 @@
 
 # global imports
 import numpy as np
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 from timeseries import TimeSeries,Dim
 
 #import pdb
@@ -121,7 +124,7 @@ class Events(np.recarray):
                  filt_freq=None,filt_type='stop',filt_order=4,
                  keep_buffer=False,esrc='esrc',eoffset='eoffset',
                  loop_axis=None,num_mp_procs=0,
-                 eoffset_in_time=True):
+                 eoffset_in_time=True,num_threads=None):
         """
         Return the requested range of data for each event by using the
         proper data retrieval mechanism for each event.
@@ -158,10 +161,14 @@ class Events(np.recarray):
         eoffset_in_time: {boolean},optional        
             If True, the unit of the event offsets is taken to be
             time (unit of the data), otherwise samples.
+        num_threads: {int},optional
+            Number of threads for loading the data of different
+            sources concurrently (defaults to the number of CPUs).
         
         Returns
         -------
-        A TimeSeries instance with dimensions (channels,events,time).
+        A TimeSeries instance with dimensions (channels,events,time)
+        with the events in their original order.
         """
         
         # check for necessary fields
@@ -169,58 +176,91 @@ class Events(np.recarray):
                 eoffset in self.dtype.names):
             raise ValueError(esrc+' and '+eoffset+' must be valid fieldnames '+
                              'specifying source and offset for the data.')
-        
-	# get ready to load dat
-	eventdata = []
-        events = []
-        
+
+        events = np.atleast_1d(self).view(self.__class__)
+
         # speed up by getting unique event sources first
-        usources = np.unique(self[esrc])
+        usources = np.unique(events[esrc])
+        # the indices of the events of each source
+        src_inds = [np.flatnonzero(events[esrc]==src) for src in usources]
 
-        # loop over unique sources
-        eventdata = None
-        for src in usources:
-            # get the eventOffsets from that source
-            ind = np.atleast_1d(self[esrc]==src)
-            
-            if len(ind) == 1:
-                event_offsets=self[eoffset]
-                events.append(self)
-            else:
-                event_offsets = self[ind][eoffset]
-                events.append(self[ind])
-
-            #print "Loading %d events from %s" % (ind.sum(),src)
-            # get the timeseries for those events
-            newdat = src.get_event_data(channels,
-                                        event_offsets,
-                                        start_time,
-                                        end_time,
-                                        buffer_time,
-                                        resampled_rate,
-                                        filt_freq,
-                                        filt_type,
-                                        filt_order,
-                                        keep_buffer,
-                                        loop_axis,
-                                        num_mp_procs,
-                                        eoffset,
-                                        eoffset_in_time)
-            if eventdata is None:
-                eventdata = newdat
+        def load(i):
+            # get the timeseries for the events of one source
+            return usources[i].get_event_data(channels,
+                                              events[src_inds[i]][eoffset],
+                                              start_time,
+                                              end_time,
+                                              buffer_time,
+                                              resampled_rate,
+                                              filt_freq,
+                                              filt_type,
+                                              filt_order,
+                                              keep_buffer,
+                                              loop_axis,
+                                              num_mp_procs,
+                                              eoffset,
+                                              eoffset_in_time)
+
+        # the first source determines the shape of the data
+        newdat = load(0)
+        tdim = newdat['time']
+        cdim = newdat['channels']
+        srate = newdat.samplerate
+        if len(usources) == 1:
+            eventdata = np.asarray(newdat)
+        else:
+            # every source writes into its own slot of the output
+            # (which is cast up if a later source needs a larger dtype)
+            out = [np.empty((newdat.shape[0],len(events),
+                             newdat.shape[2]),dtype=newdat.dtype)]
+            out[0][:,src_inds[0]] = newdat
+            lock = Lock()
+
+            def load_into(i):
+                newdat = load(i)
+                if (newdat.shape[0] != out[0].shape[0] or
+                    newdat.shape[2] != out[0].shape[2]):
+                    raise ValueError('The data from '+str(usources[i])+
+                                     ' have shape '+str(newdat.shape)+
+                                     ', which does not match the shape '+
+                                     str(out[0].shape)+' of the other '+
+                                     'sources.')
+                if newdat.samplerate != srate:
+                    raise ValueError('The data from '+str(usources[i])+
+                                     ' have a samplerate of '+
+                                     str(newdat.samplerate)+', which does '+
+                                     'not match the samplerate '+str(srate)+
+                                     ' of the other sources.')
+                with lock:
+                    if not np.can_cast(newdat.dtype,out[0].dtype):
+                        out[0] = out[0].astype(
+                            np.result_type(out[0].dtype,newdat.dtype))
+                    out[0][:,src_inds[i]] = newdat
+
+            if num_threads is None:
+                num_threads = cpu_count()
+            num_threads = min(num_threads,len(usources)-1)
+            if num_threads > 1:
+                # loading mostly waits for disk access and numpy
+                # routines that release the GIL, so threads suffice
+                pool = ThreadPool(num_threads)
+                try:
+                    try:
+                        pool.map(load_into,range(1,len(usources)))
+                    except:
+                        # don't wait for the remaining sources
+                        pool.terminate()
+                        raise
+                    pool.close()
+                finally:
+                    pool.join()
             else:
-                eventdata = eventdata.extend(newdat,axis=1)
-            
-        # concatenate (must eventually check that dims match)
-        tdim = eventdata['time']
-        cdim = eventdata['channels']
-        srate = eventdata.samplerate
-        events = np.concatenate(events).view(self.__class__)
+                for i in range(1,len(usources)):
+                    load_into(i)
+            eventdata = out[0]
+
         eventdata = TimeSeries(eventdata,
                                'time', srate,
                                dims=[cdim,Dim(events,'events'),tdim])
         
         return eventdata
-
-    
-
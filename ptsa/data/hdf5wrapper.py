@@ -8,6 +8,8 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
 # global imports
+import os
+import warnings
 import numpy as np
 import h5py
 
@@ -19,10 +21,13 @@ class HDF5Wrapper(BaseWrapper):
     """
     Interface to data stored in an HDF5 file.
     """
+    _supports_raw = True
+
     def __init__(self, filepath, dataset_name='data',
                  annotations_name='annotations',
                  channel_info_name='channel_info',
                  data=None, file_dtype=None, apply_gain=True, gain_buffer=.005,
+                 gain=None,
                  samplerate=None, nchannels=None, nsamples=None,
                  annotations=None, channel_info=None, **hdf5opts):
         """
@@ -42,6 +47,11 @@ class HDF5Wrapper(BaseWrapper):
         save the data in int16:
 
         HDF5Wrapper('data.hdf5', data=data, file_dtype=np.int16, compression='gzip')
+
+        The gain is calculated from the range of data. If more data
+        will be appended (see append_data), specify a gain that fits
+        the range of all the data; values outside the range of
+        file_dtype are clipped (with a warning).
         
         """
         # set up the basic params of the data
@@ -51,7 +61,7 @@ class HDF5Wrapper(BaseWrapper):
         self.channel_info_name = channel_info_name
         self.apply_gain = apply_gain
         self.gain_buffer = gain_buffer
-        self.gain = None
+        self.gain = gain
         self.hdf5opts = hdf5opts
         
         self.file_dtype = file_dtype
@@ -65,9 +75,12 @@ class HDF5Wrapper(BaseWrapper):
 
             # use the data to create a dataset
             self.data_dtype = data.dtype
+            # allow for appending samples (see append_data)
+            dataopts = hdf5opts.copy()
+            dataopts.setdefault('maxshape',(data.shape[0],None))
             d = f.create_dataset(self.dataset_name,
                                  data=self._data_to_file(data),
-                                 **hdf5opts)
+                                 **dataopts)
             d.attrs['data_dtype'] = data.dtype.char
             d.attrs['gain'] = self.gain
 
@@ -135,9 +148,17 @@ class HDF5Wrapper(BaseWrapper):
                 
         # calc and apply gain if necessary
         if self.apply_gain and self.gain != 1.0:
-            return np.asarray(data/self.gain,dtype=self.file_dtype)
-        else:
-            return np.asarray(data,dtype=self.file_dtype)
+            data = data/self.gain
+        if self.file_dtype.kind in 'iu' and data.dtype.kind == 'f':
+            # clip values that do not fit (instead of wrapping around)
+            info = np.iinfo(self.file_dtype)
+            if data.size > 0 and (data.min() < info.min or
+                                  data.max() > info.max):
+                warnings.warn("Data exceed the range of the file dtype "+
+                              str(self.file_dtype)+" with a gain of "+
+                              str(self.gain)+" and are clipped.")
+                data = np.clip(data,info.min,info.max)
+        return np.asarray(data,dtype=self.file_dtype)
 
     def _data_from_file(self, data):
         # see if apply gain we've already calculated
@@ -146,6 +167,20 @@ class HDF5Wrapper(BaseWrapper):
         else:
             return np.asarray(data, dtype=self.data_dtype)
 
+    def _get_scaling(self, channels):
+        # raw data are in the file dtype and still need the gain
+        if self.apply_gain:
+            gain = self.gain
+        else:
+            gain = 1.0
+        return (np.ones(len(channels))*gain,
+                np.zeros(len(channels)))
+
+    def _get_cache_id(self):
+        return (self.__class__.__name__,os.path.abspath(self.filepath),
+                self.dataset_name,self.apply_gain,
+                os.path.getmtime(self.filepath))
+
     def _get_samplerate(self, channel=None):
         # Same samplerate for all channels.
         # get the samplerate property of the dataset
@@ -199,6 +234,9 @@ class HDF5Wrapper(BaseWrapper):
         else:
             chan_info = None
         f.close()
+        if chan_info is None:
+            # number and name the channels
+            chan_info = BaseWrapper._get_channel_info(self)
         return chan_info
 
     def _set_channel_info(self, channel_info):
@@ -211,7 +249,8 @@ class HDF5Wrapper(BaseWrapper):
                              data=channel_info, **self.hdf5opts)
         f.close()
 
-    def _load_data(self,channels,event_offsets,dur_samp,offset_samp):
+    def _load_data(self,channels,event_offsets,dur_samp,offset_samp,
+                   raw=False):
         """        
         """
         # connect to the file and get the dataset
@@ -219,8 +258,12 @@ class HDF5Wrapper(BaseWrapper):
         data = f[self.dataset_name]
         
         # allocate for data
-	eventdata = np.empty((len(channels),len(event_offsets),dur_samp),
-                             dtype=self.data_dtype)*np.nan
+        if raw:
+            eventdata = np.empty((len(channels),len(event_offsets),dur_samp),
+                                 dtype=data.dtype)
+        else:
+            eventdata = np.empty((len(channels),len(event_offsets),dur_samp),
+                                 dtype=self.data_dtype)*np.nan
 
 	# loop over events
 	for e,evOffset in enumerate(event_offsets):
@@ -232,7 +275,10 @@ class HDF5Wrapper(BaseWrapper):
             if ssamp < 0 or esamp > data.shape[1]:
                 raise IOError('Event with offset '+str(evOffset)+
                               ' is outside the bounds of the data.')
-            eventdata[:,e,:] = self._data_from_file(data[channels,ssamp:esamp])
+            if raw:
+                eventdata[:,e,:] = data[channels,ssamp:esamp]
+            else:
+                eventdata[:,e,:] = self._data_from_file(data[channels,ssamp:esamp])
 
         # close the file
         f.close()
@@ -241,7 +287,14 @@ class HDF5Wrapper(BaseWrapper):
 
     def append_data(self, data):
         """
-        Must be all channels.
+        Append samples to the end of the data. Must be all channels.
+
+        The dataset must be resizable along time, which is the case
+        for datasets created by HDF5Wrapper (unless another maxshape
+        was passed). The gain for an integer file_dtype is calculated
+        from the data that created the dataset (unless it was
+        specified), so appended data that exceed their range are
+        clipped (with a warning).
         """
         # connect to the file and get the dataset
         f = h5py.File(self.filepath,'a')
@@ -257,7 +310,7 @@ class HDF5Wrapper(BaseWrapper):
         # reshape to hold new data
         cursamp = d.shape[1]
         newsamp = data.shape[1]
-        d.shape = (d.shape[0], cursamp+newsamp)
+        d.resize(cursamp+newsamp, axis=1)
 
         # append the data
         d[:,cursamp:cursamp+newsamp] = self._data_to_file(data)
@@ -280,7 +333,7 @@ class HDF5Wrapper(BaseWrapper):
         cursamp = d.shape[1]
         newsamp = len(data)
         if cursamp != newsamp:
-            d.shape = (d.shape[0], newsamp)
+            d.resize(newsamp, axis=1)
 
         # set the data
         d[channel,:] = self._data_to_file(data)
@@ -13,7 +13,6 @@ from basewrapper import BaseWrapper
 # global imports
 import numpy as np
 import string
-import struct
 import os
 from glob import glob
 
@@ -22,6 +21,8 @@ class RawBinWrapper(BaseWrapper):
     Interface to data stored in binary format with a separate file for
     each channel.  
     """
+    _supports_raw = True
+
     def __init__(self,dataroot,samplerate=None,format='int16',gain=1):
         """Initialize the interface to the data.  You must specify the
         dataroot, which is a string that contains the path to and
@@ -55,6 +56,8 @@ class RawBinWrapper(BaseWrapper):
         elif self._format == 'double':
             self._nbytes = 8
             self._fmt_str = 'd'
+        # the data are stored little endian
+        self._dtype = np.dtype('<'+self._fmt_str)
 
         self._chanfiles = glob(self._dataroot+'.*[0-9]')
         # sorting because the order of the output from glob is
@@ -104,6 +107,15 @@ class RawBinWrapper(BaseWrapper):
     def _get_channel_info(self):
         return self._channel_info
     
+    def _get_scaling(self, channels):
+        return (np.ones(len(channels))*self._gain,
+                np.zeros(len(channels)))
+
+    def _get_cache_id(self):
+        return (self.__class__.__name__,os.path.abspath(self._dataroot),
+                self._format,self._gain,self._samplerate,
+                [os.path.getmtime(f) for f in self._chanfiles])
+
     def _get_annotations(self):
         # no annotations for raw data
         annot = None
@@ -138,13 +150,18 @@ class RawBinWrapper(BaseWrapper):
         return params
         
 
-    def _load_data(self,channels,event_offsets,dur_samp,offset_samp):
+    def _load_data(self,channels,event_offsets,dur_samp,offset_samp,
+                   raw=False):
         """
         """
 
-        # allocate for data
+        # allocate for data (in the stored dtype if raw)
+        if raw:
+            dtype = self._dtype
+        else:
+            dtype = np.float64
         eventdata = np.empty((len(channels),len(event_offsets),dur_samp),
-                             dtype=np.float)*np.nan
+                             dtype=dtype)
 
         # loop over channels
         for c, channel in enumerate(channels):
@@ -170,9 +187,7 @@ class RawBinWrapper(BaseWrapper):
 
                 # convert from string to array based on the format
                 # hard codes little endian
-                data = np.array(struct.unpack(
-                    '<' + str(len(data) / self._nbytes) +
-                    self._fmt_str, data))
+                data = np.fromstring(data, dtype=self._dtype)
 
                 # make sure we got some data
                 if len(data) < dur_samp:
@@ -184,8 +199,9 @@ class RawBinWrapper(BaseWrapper):
                 eventdata[c, e, :] = data
 
         # multiply by the gain
-	eventdata *= self._gain
-	
+        if not raw:
+            eventdata *= self._gain
+
         return eventdata
 
     dataroot = property(lambda self: self._get_dataroot())
@@ -0,0 +1,68 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+"""
+Benchmarks for TimeSeries methods (not run by the test suite).
+
+Run with:
+
+python ptsa/data/tests/bench_timeseries.py
+"""
+
+import sys
+import time
+import numpy as np
+
+from ptsa.data import Dim,TimeSeries
+
+
+def make_ts(nchan, nsamples, samplerate):
+    """
+    Return a TimeSeries of noise with nchan channels and nsamples
+    samples.
+    """
+    return TimeSeries(np.random.randn(nchan,nsamples),'time',samplerate,
+                      dims=[Dim(np.arange(nchan),'channels'),
+                            Dim(np.arange(nsamples)/float(samplerate),
+                                'time')])
+
+
+def timeit(func, repeat=3):
+    """
+    Return the best time (in seconds) of repeat calls of func.
+    """
+    best = np.inf
+    for i in range(repeat):
+        start = time.time()
+        func()
+        best = min(best,time.time()-start)
+    return best
+
+
+def bench_resampled(repeat=3):
+    """
+    Compare the FFT and polyphase methods of TimeSeries.resampled on
+    long signals and signals with odd (prime) lengths.
+    """
+    cases = [('long, 2**20 samples',make_ts(16,2**20,1000.),256.),
+             ('long, 10 min',make_ts(16,600*1000,1000.),256.),
+             ('odd, prime length',make_ts(16,10007,1000.),256.),
+             ('odd, rational',make_ts(16,3*10007,500.),200.)]
+    print '%-22s %10s %10s %8s' % ('signal','fft (s)','poly (s)','speedup')
+    for name,ts,rate in cases:
+        t_fft = timeit(lambda: ts.resampled(rate),repeat)
+        t_poly = timeit(lambda: ts.resampled(rate,method='polyphase'),
+                        repeat)
+        print '%-22s %10.3f %10.3f %8.1f' % (name,t_fft,t_poly,
+                                             t_fft/t_poly)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    bench_resampled()
@@ -0,0 +1,116 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import shutil
+import tempfile
+import cPickle as pickle
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal,\
+     assert_array_almost_equal
+
+from ptsa.data.bvwrapper import BVWrapper
+from ptsa.wavelet import phase_pow_multi
+
+
+def write_bv(dirname, data, scales, samplerate=500.):
+    """
+    Write a minimal multiplexed INT_16 BrainVision dataset with data
+    in the form [channels,samples] and return the header filename.
+    """
+    vhdr = os.path.join(dirname, 'test.vhdr')
+    lines = ['Brain Vision Data Exchange Header File Version 1.0',
+             '[Common Infos]',
+             'DataFile=test.eeg',
+             'MarkerFile=test.vmrk',
+             'DataFormat=BINARY',
+             'DataOrientation=MULTIPLEXED',
+             'NumberOfChannels=%d' % len(data),
+             'SamplingInterval=%d' % int(1e6/samplerate),
+             '[Binary Infos]',
+             'BinaryFormat=INT_16',
+             '[Channel Infos]']
+    for i,scale in enumerate(scales):
+        lines.append('Ch%d=E%d,,%s,uV' % (i+1, i+1, repr(scale)))
+    open(vhdr, 'w').write('\n'.join(lines)+'\n')
+    np.asarray(data, dtype='<i2').T.tofile(os.path.join(dirname, 'test.eeg'))
+    return vhdr
+
+
+class test_BVWrapper(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.scales = np.array([0.5, 0.1, 2.0])
+        self.dat = np.arange(3*1000).reshape(3,1000) % 997 - 400
+        self.bw = BVWrapper(write_bv(self.tmpdir, self.dat, self.scales))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_data(self):
+        offsets = np.array([10, 500, 3])
+        ed = self.bw._load_data([0,2], offsets, 20, -2)
+        self.assertEquals(ed.shape, (2,3,20))
+        self.assertEquals(ed.dtype, np.float64)
+        for e,o in enumerate(offsets):
+            assert_array_almost_equal(
+                ed[:,e,:], self.dat[[0,2],o-2:o+18]*self.scales[[0,2],None])
+        # the memmap is only opened once
+        mm = self.bw._mm
+        self.bw._load_data([1], offsets, 20, 0)
+        self.assertTrue(mm is self.bw._mm)
+        # out of bounds
+        self.assertRaises(IOError, self.bw._load_data, [0], [990], 20, 0)
+        self.assertRaises(IOError, self.bw._load_data, [0], [1], 20, -2)
+
+    def test_raw(self):
+        offsets = np.array([100, 200])
+        ed = self.bw._load_data([0,1,2], offsets, 50, 0, raw=True)
+        self.assertEquals(ed.dtype, np.int16)
+        for e,o in enumerate(offsets):
+            assert_array_equal(ed[:,e,:], self.dat[:,o:o+50])
+        ts = self.bw.get_event_data([1], offsets/500., 0, .1, raw=True)
+        self.assertEquals(ts.dtype, np.int16)
+        assert_array_almost_equal(np.asarray(ts.dims[0]['scale']), [0.1])
+        assert_array_almost_equal(np.asarray(ts.dims[0]['gain']), [0.1])
+        assert_array_equal(np.asarray(ts.dims[0]['offset']), [0])
+        ts = self.bw.get_all_data(raw=True)
+        assert_array_equal(ts, self.dat)
+
+    def test_scaled(self):
+        offsets = np.array([100, 200])/500.
+        ts = self.bw.get_event_data([0,2], offsets, 0, .2)
+        rts = self.bw.get_event_data([0,2], offsets, 0, .2, raw=True)
+        self.assertEquals(rts.scaling_dim, 'channels')
+        sts = rts.scaled()
+        self.assertEquals(sts.dtype, np.float64)
+        self.assertFalse(hasattr(sts, 'scaling_dim'))
+        assert_array_almost_equal(sts, ts)
+        self.assertTrue(ts.scaled() is ts)
+        # the scaling follows a selection of channels
+        assert_array_almost_equal(rts[[1]].scaled(), ts[[1]])
+        # filtering and resampling apply the scaling
+        fts = rts.filtered([58,62], filt_type='stop')
+        self.assertFalse(hasattr(fts, 'scaling_dim'))
+        assert_array_almost_equal(fts, ts.filtered([58,62], filt_type='stop'))
+        assert_array_almost_equal(rts.resampled(250), ts.resampled(250))
+        # the gain is fused into the wavelet convolution
+        phase,power = phase_pow_multi([20,40], rts, widths=3)
+        ephase,epower = phase_pow_multi([20,40], ts, widths=3)
+        assert_array_almost_equal(power, epower)
+        assert_array_almost_equal(phase, ephase)
+        # the scaling cannot be applied without the channels dim
+        self.assertRaises(ValueError, rts.mean('channels').scaled)
+
+    def test_pickle(self):
+        self.bw._load_data([0], [0], 10, 0)
+        bw = pickle.loads(pickle.dumps(self.bw))
+        assert_array_equal(bw._load_data([0], [0], 10, 0),
+                           self.bw._load_data([0], [0], 10, 0))
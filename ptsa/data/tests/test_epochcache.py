@@ -0,0 +1,94 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import shutil
+import tempfile
+import cPickle as pickle
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal
+
+from ptsa.data import ArrayWrapper, EpochCache
+
+
+class test_EpochCache(TestCase):
+    def setUp(self):
+        self.dat = np.random.randn(3,2000)
+        self.aw = ArrayWrapper(self.dat,200.)
+        self.offsets = np.array([1.,2.,4.])
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hits(self):
+        ts = self.aw.get_event_data([0,1],self.offsets,0,1.,buffer_time=.5,
+                                    filt_freq=[58.,62.])
+        self.aw.epoch_cache = EpochCache()
+        ts1 = self.aw.get_event_data([0,1],self.offsets,0,1.,buffer_time=.5,
+                                     filt_freq=[58.,62.])
+        self.assertEquals(self.aw.epoch_cache.stats()['misses'],1)
+        # changed events fields are passed through
+        events = np.rec.fromarrays([self.offsets,['a','b','c']],
+                                   names='eoffset,item')
+        ts2 = self.aw.get_event_data([0,1],events,0,1.,buffer_time=.5,
+                                     filt_freq=[58.,62.])
+        stats = self.aw.epoch_cache.stats()
+        self.assertEquals((stats['hits'],stats['misses']),(1,1))
+        assert_array_equal(ts1,ts)
+        assert_array_equal(ts2,ts)
+        self.assertEquals(list(ts2['events']['item']),['a','b','c'])
+        assert_array_equal(np.asarray(ts2.dims[2]),np.asarray(ts.dims[2]))
+        # the cache returns copies
+        ts2[:] = 0
+        assert_array_equal(self.aw.get_event_data(
+                [0,1],self.offsets,0,1.,buffer_time=.5,filt_freq=[58.,62.]),ts)
+        # other settings, channels, or wrappers are different epochs
+        self.aw.get_event_data([0,1],self.offsets,0,1.,buffer_time=.5)
+        self.aw.get_event_data([0],self.offsets,0,1.,buffer_time=.5)
+        aw = ArrayWrapper(self.dat*2,200.)
+        aw.epoch_cache = self.aw.epoch_cache
+        assert_array_equal(aw.get_event_data([0],self.offsets,0,1.),
+                           self.aw.get_event_data([0],self.offsets,0,1.)*2)
+        self.assertEquals(self.aw.epoch_cache.stats()['misses'],5)
+
+    def test_limit(self):
+        cache = EpochCache(max_bytes=2*2*201*8)
+        self.aw.epoch_cache = cache
+        for t in [1.,2.,3.,1.]:
+            self.aw.get_event_data([0,1],[t],0,1.)
+        # only the last two fit
+        self.assertEquals(len(cache),2)
+        self.assertEquals(cache.stats()['misses'],4)
+        self.aw.get_event_data([0,1],[3.],0,1.)
+        self.assertEquals(cache.stats()['hits'],1)
+        self.assertTrue(cache.nbytes <= cache.max_bytes)
+
+    def test_disk(self):
+        cache = EpochCache(max_bytes=2*201*8,cache_dir=self.tmpdir)
+        self.aw.epoch_cache = cache
+        ts = self.aw.get_event_data([0,1],[1.],0,1.)
+        self.aw.get_event_data([0,1],[2.],0,1.)
+        self.assertEquals(len(os.listdir(self.tmpdir)),1)
+        assert_array_equal(self.aw.get_event_data([0,1],[1.],0,1.),ts)
+        self.assertEquals(cache.stats()['disk_hits'],1)
+        # files from an earlier session are reused
+        cache = EpochCache(cache_dir=self.tmpdir)
+        self.assertEquals(cache.stats()['disk_epochs'],2)
+        cache.clear(disk=True)
+        self.assertEquals(os.listdir(self.tmpdir),[])
+
+    def test_pickle(self):
+        cache = EpochCache(max_bytes=1000)
+        self.aw.epoch_cache = cache
+        self.aw.get_event_data([0],[1.],0,1.)
+        cache = pickle.loads(pickle.dumps(cache))
+        self.assertEquals(cache.max_bytes,1000)
+        self.assertEquals(len(cache),0)
@@ -396,3 +396,39 @@ class test_Events(TestCase):
         assert_array_almost_equal(ed[:],ed3[:],decimal=6)
 
 
+    def test_get_data_sources(self):
+        # interleaved events from several sources keep their order
+        aws = [self.aw]+[ArrayWrapper(self.dat*(i+2),200) for i in range(3)]
+        esrc = [aws[i%4] for i in range(8)]
+        eoffsets = np.arange(1.,3.,.25)
+        events = np.rec.fromarrays((esrc,eoffsets,np.arange(8)),
+                                   names='esrc,eoffset,num').view(Events)
+        for num_threads in [1,3]:
+            ed = events.get_data([2,5],0,.5,num_threads=num_threads)
+            self.assertEquals(ed.shape,(2,8,101))
+            assert_array_equal(np.asarray(ed.dims[1]['num']),np.arange(8))
+            for i in range(8):
+                assert_array_equal(
+                    ed[:,i],esrc[i].get_event_data([2,5],[eoffsets[i]],
+                                                   0,.5)[:,0])
+        # mismatching sources are caught
+        events.esrc[1] = ArrayWrapper(self.dat,100)
+        self.assertRaises(ValueError,events.get_data,[2,5],0,.5)
+        # (also with the same number of samples)
+        events.esrc[1] = ArrayWrapper(self.dat,201)
+        self.assertRaises(ValueError,events.get_data,[2,5],0,.5)
+
+        # float data after int data are not truncated
+        int_dat = np.round(self.dat*10).astype(np.int16)
+        aws = [ArrayWrapper(int_dat,200),ArrayWrapper(self.dat+.5,200)]
+        events = np.rec.fromarrays(([aws[0],aws[1]],[1.,1.]),
+                                   names='esrc,eoffset').view(Events)
+        for num_threads in [1,2]:
+            ed = events.get_data([2,5],0,.5,num_threads=num_threads)
+            self.assertEquals(ed.dtype,np.result_type(np.int16,
+                                                      self.dat.dtype))
+            assert_array_equal(ed[:,1],aws[1].get_event_data(
+                    [2,5],[1.],0,.5)[:,0])
+            assert_array_equal(ed[:,0],aws[0].get_event_data(
+                    [2,5],[1.],0,.5)[:,0])
+
@@ -0,0 +1,91 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal, \
+     assert_array_almost_equal
+
+from dimarray.attrarray import HAS_H5PY
+from ptsa.data import ArrayWrapper
+
+if HAS_H5PY:
+    from ptsa.data.hdf5wrapper import HDF5Wrapper
+
+
+class test_HDF5Wrapper(TestCase):
+    def setUp(self):
+        self.dat = np.random.randn(3,5000).cumsum(1)
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir,'data.hdf5')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_append_data(self):
+        if not HAS_H5PY:
+            return
+        w = HDF5Wrapper(self.filepath,data=self.dat[:,:1000],samplerate=200.)
+        w.append_data(self.dat[:,1000:])
+        self.assertEquals(w.nsamples,5000)
+        assert_array_equal(w.get_all_data(),self.dat)
+
+    def test_filtered_to_hdf5(self):
+        if not HAS_H5PY:
+            return
+        aw = ArrayWrapper(self.dat,200.)
+        for zero_phase in [True,False]:
+            filepath = os.path.join(self.tmpdir,'filt%d.hdf5'%zero_phase)
+            w = aw.filtered_to_hdf5(filepath,[1.],'high',block_dur=3.,
+                                    channels=[0,2],zero_phase=zero_phase)
+            self.assertEquals(w.samplerate,200.)
+            assert_array_equal(w.channels['name'],['Ch1','Ch3'])
+            if zero_phase:
+                ref = aw.get_all_data([0,2]).filtered([1.],'high')
+                ref = np.asarray(ref)
+                assert_array_almost_equal(w.get_all_data()/np.abs(ref).max(),
+                                          ref/np.abs(ref).max(),7)
+            else:
+                self.assertEquals(w.nsamples,5000)
+
+    def test_int_gain(self):
+        if not HAS_H5PY:
+            return
+        # later samples exceed the range of the first block
+        dat = self.dat.copy()
+        dat[:,2000:] *= 50
+        aw = ArrayWrapper(dat,200.)
+        w = aw.filtered_to_hdf5(self.filepath,[1.],'high',block_dur=3.,
+                                file_dtype=np.int16)
+        ref = np.asarray(aw.get_all_data().filtered([1.],'high'))
+        scale = np.abs(ref).max()
+        assert_array_almost_equal(w.get_all_data()/scale,ref/scale,4)
+
+        # appending data that do not fit clips them (with a warning)
+        filepath = os.path.join(self.tmpdir,'clip.hdf5')
+        w = HDF5Wrapper(filepath,data=self.dat[:,:1000],samplerate=200.,
+                        file_dtype=np.int16)
+        big = np.ones((3,10))*np.abs(self.dat[:,:1000]).max()*10
+        with warnings.catch_warnings(record=True) as warns:
+            warnings.simplefilter('always')
+            w.append_data(big)
+        self.assertEquals(len(warns),1)
+        self.assertTrue(np.all(np.asarray(w.get_all_data())[:,1000:] > 0))
+
+        # or an explicit gain for the range of all data
+        filepath = os.path.join(self.tmpdir,'gain.hdf5')
+        w = HDF5Wrapper(filepath,data=self.dat[:,:1000],samplerate=200.,
+                        file_dtype=np.int16,gain=big.max()/30000.)
+        w.append_data(big)
+        assert_array_almost_equal(np.asarray(w.get_all_data())[:,1000:]/
+                                  big.max(),1.,4)
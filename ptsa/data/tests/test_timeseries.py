@@ -9,9 +9,14 @@
 
 import numpy as np
 import re
+import os
+import shutil
+import tempfile
 from numpy.testing import TestCase
 
-from ptsa.data import Dim,DimArray,TimeSeries
+from ptsa.data import Dim,DimArray,TimeSeries,ArrayWrapper
+from dimarray import h5load
+from dimarray.attrarray import HAS_H5PY
 from ptsa import filt
 
 # from numpy.testing import NumpyTest, TestCase
@@ -111,6 +116,29 @@ class test_TimeSeries(TestCase):
         self.assertEquals(len(ts_nobuff['time']),numsamp-2*buf)
         # make sure that negative durations throw exception
         self.assertRaises(ValueError,ts.remove_buffer,-1)
+        # the result is a view unless a copy is requested
+        ts_nobuff = ts.remove_buffer((.5,1.))
+        self.assertTrue(np.may_share_memory(ts_nobuff,ts))
+        np.testing.assert_array_equal(ts_nobuff,self.dat200[:,100:600])
+        np.testing.assert_array_equal(np.asarray(ts_nobuff.dims[1]),
+                                      np.asarray(self.dims200[1])[100:600])
+        ts_copy = ts.remove_buffer((.5,1.),copy=True)
+        self.assertFalse(np.may_share_memory(ts_copy,ts))
+        np.testing.assert_array_equal(ts_copy,ts_nobuff)
+        self.assertEquals(ts.remove_buffer(2.5).shape,(2,0))
+
+    def test_time_window(self):
+        ts = TimeSeries(self.dat200,'time',200,dims=self.dims200)
+        tw = ts.time_window(0.,.5)
+        self.assertTrue(np.may_share_memory(tw,ts))
+        np.testing.assert_array_equal(tw,self.dat200[:,200:301])
+        self.assertFalse(np.may_share_memory(ts.time_window(0.,.5,copy=True),
+                                             ts))
+        # unsorted time points
+        dims = [self.dims200[0],Dim(self.dims200[1][::-1],'time')]
+        ts = TimeSeries(self.dat200,'time',200,dims=dims)
+        np.testing.assert_array_equal(ts.time_window(0.,.5),
+                                      self.dat200[:,499:600])
 
     def tst_setattr(self):
         ts = TimeSeries(self.dat200,'time',200,dims=self.dims200)
@@ -140,8 +168,112 @@ class test_TimeSeries(TestCase):
             ts50_200['time']*1000,ts50['time'],decimal=6)
         np.testing.assert_array_almost_equal(ts50_200[:],ts50[:],decimal=6)
 
+    def test_resample_pad(self):
+        ts200 = TimeSeries(self.dat200[:,:-3],'time',200,
+                           dims=[self.dims200[0],
+                                 Dim(self.dims200[1][:-3],'time')])
+        ts = ts200.resampled(50)
+        for pad in [{'pad_to_pow2':True},{'pad_to_fast':True}]:
+            ts_pad = ts200.resampled(50,**pad)
+            self.assertEquals(ts_pad.shape,ts.shape)
+            self.assertEquals(ts_pad['time'][0],ts['time'][0])
+            np.testing.assert_array_almost_equal(
+                np.diff(np.asarray(ts_pad['time'])),.02,10)
+            # the sine waves away from the padding
+            np.testing.assert_array_almost_equal(
+                ts_pad[:,20:-20],self.dat200[:,::4][:,20:ts.shape[1]-20],2)
+
+    def test_resample_poly(self):
+        ts200 = TimeSeries(self.dat200,'time',200,dims=self.dims200)
+        ts50 = ts200.resampled(50,method='polyphase')
+        self.assertEquals(ts50.samplerate,50.)
+        self.assertEquals(ts50.shape,(2,200))
+        np.testing.assert_array_almost_equal(
+            np.asarray(ts50['time']),
+            ts200['time'][0]+np.arange(200)*.02,12)
+        np.testing.assert_array_almost_equal(
+            ts50,filt.resample_poly(self.dat200,1,4),12)
+        # the sine waves are preserved away from the edges
+        fft50 = ts200.resampled(50)
+        np.testing.assert_array_almost_equal(
+            ts50[:,20:-20],fft50[:,20:-20],2)
+        # rational factors
+        ts256 = ts200.resampled(256,method='polyphase')
+        self.assertEquals(ts256.samplerate,256.)
+        self.assertEquals(ts256.shape,(2,1024))
+        np.testing.assert_array_almost_equal(
+            np.diff(np.asarray(ts256['time'])),1/256.,12)
+        self.assertRaises(ValueError,ts200.resampled,50,method='bla')
+        self.assertRaises(ValueError,ts200.resampled,np.pi*100,
+                          method='polyphase',max_denominator=10)
+        # the same samplerate returns a copy
+        ts_same = ts200.resampled(200,method='polyphase')
+        self.assertEquals(ts_same.samplerate,200.)
+        np.testing.assert_array_equal(ts_same,ts200)
+        np.testing.assert_array_almost_equal(np.asarray(ts_same['time']),
+                                             np.asarray(ts200['time']),12)
+        x = np.arange(10)
+        y = filt.resample_poly(x,5,5)
+        np.testing.assert_array_equal(y,x)
+        self.assertFalse(y is x)
+
+    def test_resample_mp(self):
+        ts200 = TimeSeries(self.dat200,'time',200,dims=self.dims200)
+        ts = ts200.resampled(50,loop_axis='channel')
+        ts_mp = ts200.resampled(50,loop_axis='channel',num_mp_procs=2)
+        self.assertTrue(isinstance(ts_mp,TimeSeries))
+        np.testing.assert_array_almost_equal(ts_mp,ts)
+        np.testing.assert_array_almost_equal(np.asarray(ts_mp.dims[1]),
+                                             np.asarray(ts.dims[1]))
+
     def test_remove_tdim(self):
         ts200 = TimeSeries(self.dat200,'time',200,dims=self.dims200)
         self.assertTrue(isinstance(ts200.mean('time'),DimArray))
 
+    def test_baseline_corrected(self):
+        ts = TimeSeries(self.dat200,'time',200,dims=self.dims200,note='x')
+        bc = ts.baseline_corrected((-1.,0.))
+        self.assertTrue(isinstance(bc,TimeSeries))
+        self.assertEquals(bc.dim_names,ts.dim_names)
+        self.assertEquals(bc.note,'x')
+        self.assertEquals(bc.samplerate,200)
+        tms = self.dims200[1]
+        base = self.dat200[:,(tms>=-1.)&(tms<=0.)].mean(1)
+        np.testing.assert_array_almost_equal(bc,self.dat200-base[:,None])
+
+    def test_groupby(self):
+        ts = TimeSeries(self.dat200,'time',200,dims=self.dims200)
+        res = ts.groupby('channel',np.array([1,1]))
+        self.assertTrue(isinstance(res,TimeSeries))
+        np.testing.assert_array_almost_equal(res[0],self.dat200.mean(0))
+        res = ts.groupby('time',np.arange(800)//200,'mean')
+        self.assertFalse(isinstance(res,TimeSeries))
+        self.assertTrue(isinstance(res,DimArray))
+        self.assertEquals(res.shape,(2,4))
 
+    def test_h5save(self):
+        if not HAS_H5PY:
+            return
+        aw = ArrayWrapper(self.dat200,200.)
+        events = np.rec.fromarrays([[aw,aw],[1.,2.]],names='esrc,eoffset')
+        ts = aw.get_event_data([0,1],events,0,1.)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir,'ts.h5')
+            ts.h5save(fname)
+            ts2 = h5load(fname)
+            self.assertTrue(isinstance(ts2,TimeSeries))
+            np.testing.assert_array_equal(ts2,ts)
+            self.assertEquals(ts2.tdim,'time')
+            self.assertEquals(ts2.samplerate,200.)
+            # the events (with wrappers) are pickled
+            np.testing.assert_array_equal(
+                np.asarray(ts2.dims[1]['eoffset']),[1.,2.])
+            lazy = h5load(fname,lazy=True)
+            res = lazy['time<.5']
+            self.assertTrue(isinstance(res,TimeSeries))
+            np.testing.assert_array_equal(res,ts['time<.5'])
+            self.assertEquals(res.samplerate,200.)
+            lazy.close()
+        finally:
+            shutil.rmtree(tmpdir)
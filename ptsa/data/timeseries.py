@@ -7,13 +7,14 @@
 #
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
-from dimarray import Dim,DimArray,AttrArray
+from dimarray import Dim,DimArray,AttrArray,SharedArray
 from ptsa import filt
-from ptsa.helper import next_pow2, pad_to_next_pow2
+from ptsa.helper import next_pow2, pad_to_len, next_fast_len, is_fast_len
 
 from scipy.signal import resample
 import numpy as np
 import sys
+from fractions import Fraction
 
 try:
     import multiprocessing as mp
@@ -24,6 +25,31 @@ except ImportError:
 __docformat__ = 'restructuredtext'
 
 
+def _resample_shared(src, dst, index, num, t, axis, window, pad_len):
+    """
+    Resample the part index of the SharedArray src into the same part
+    of the SharedArray dst (for TimeSeries.resampled in worker
+    processes) and return the new time range.
+    """
+    dat = src.array()[index]
+    if pad_len is not None:
+        dat = pad_to_len(dat, pad_len, axis=axis)
+    ndat,new_t = resample(dat, num, t=t, axis=axis, window=window)
+    dst.array()[index] = ndat
+    return new_t
+
+
+def _fast_resample_len(n, ratio):
+    """
+    Return the smallest length >= n for which the FFT lengths of the
+    data and of the data resampled by ratio are both fast.
+    """
+    length = next_fast_len(n)
+    while not is_fast_len(int(np.round(length*ratio))):
+        length = next_fast_len(length+1)
+    return length
+
+
 class TimeSeries(DimArray):
     """
     TimeSeries(data, tdim, samplerate, *args, **kwargs)
@@ -146,10 +172,87 @@ class TimeSeries(DimArray):
             return ret.view(self.__class__)
     
         
-    def remove_buffer(self, duration):
-	"""
+    def _grouped_class(self, axis):
+        """
+        Return the class of the result of grouping along axis (a
+        DimArray when the time dimension is grouped).
+        """
+        if self.get_axis(axis) == self.taxis:
+            return DimArray
+        return self.__class__
+
+    def _get_scaling(self):
+        """
+        Return the gain and offset of data that were loaded raw (see
+        BaseWrapper.get_event_data), shaped to broadcast against the
+        data, or (None,None) if the data do not need scaling.
+        """
+        scaling_dim = getattr(self,'scaling_dim',None)
+        if scaling_dim is None:
+            return None,None
+        if not scaling_dim in self.dim_names:
+            raise ValueError("The dimension with the gain and offset of "+
+                             "the raw data ('"+str(scaling_dim)+"') has "+
+                             "been removed, so the data cannot be scaled.")
+        axis = self.get_axis(scaling_dim)
+        shape = [1]*self.ndim
+        shape[axis] = self.shape[axis]
+        gain = np.asarray(self.dims[axis]['gain'],
+                          dtype=np.float64).reshape(shape)
+        offset = np.asarray(self.dims[axis]['offset'],
+                            dtype=np.float64).reshape(shape)
+        return gain,offset
+
+    def _scaled_data(self, dtype=np.float64):
+        """
+        Return the data as an ndarray with the scaling of raw data
+        applied. The scaling is done in place on the single copy
+        needed to convert to dtype. Data that do not need scaling are
+        returned as they are (without copying).
+        """
+        gain,offset = self._get_scaling()
+        if gain is None:
+            return np.asarray(self)
+        dat = np.array(self, dtype=dtype)
+        dat *= gain
+        if np.any(offset):
+            dat += offset
+        return dat
+
+    def scaled(self, dtype=np.float64):
+        """
+        Apply the gain and offset of raw data.
+
+        Data loaded with raw=True (see BaseWrapper.get_event_data)
+        keep the dtype in which they are stored and carry the gain
+        and offset of each channel in the channels dim. This method
+        returns a new TimeSeries with the actual values. Filtering
+        and resampling apply the scaling automatically.
+
+        Parameters
+        ----------
+        dtype : {numpy.dtype},optional
+            The float dtype of the scaled data.
+
+        Returns
+        -------
+        ts : {TimeSeries}
+            A TimeSeries instance with the scaled data (or the same
+            instance if no scaling is necessary).
+        """
+        if getattr(self,'scaling_dim',None) is None:
+            return self
+        attrs = self._attrs.copy()
+        for k in self._required_attrs.keys():
+            attrs.pop(k,None)
+        attrs.pop('scaling_dim',None)
+        return TimeSeries(self._scaled_data(dtype),self.tdim,
+                          self.samplerate,dims=self.dims.copy(),**attrs)
+
+    def remove_buffer(self, duration, copy=False):
+        """
         Remove the desired buffer duration (in seconds) and reset the
-	time range.
+        time range.
 
         Parameter
         ---------
@@ -162,6 +265,10 @@ class TimeSeries(DimArray):
             A single number causes the specified duration to be removed from the
             beginning and end. A 2-tuple can be passed in to specify different
             durations to be removed from the beginning and the end respectively.
+        copy : {bool},optional
+            By default, the result is a view of the data (so no data
+            are copied, but changes to the result also change the
+            original). If True, the data are copied.
             
         Returns
         -------
@@ -169,21 +276,64 @@ class TimeSeries(DimArray):
             A TimeSeries instance with the requested durations removed from the
             beginning and/or end.
         """
-	# see if we need to remove anything
+        # see if we need to remove anything
         duration = np.atleast_1d(duration)
         if len(duration) != 2:
             duration = duration.repeat(2)
         num_samp = np.round(self.samplerate * duration)
         # ensure that the number of samples are >= 0:
-	if np.any(num_samp<0):
+        if np.any(num_samp<0):
             raise ValueError('Duration must not be negative!'+
                              'Provided values: '+str(duration))
-        # remove the buffer from the data
-        return self.take(range(int(num_samp[0]),
-                               self.shape[self.taxis]-int(num_samp[1])),
-                         self.taxis)
+        # remove the buffer from the data (and the time dim) by slicing
+        ind = [slice(None)]*self.ndim
+        ind[self.taxis] = slice(int(num_samp[0]),
+                                max(int(num_samp[0]),
+                                    self.shape[self.taxis]-int(num_samp[1])))
+        ret = self[tuple(ind)]
+        if copy:
+            ret = ret.copy()
+        return ret
+
+    def time_window(self, start, stop, copy=False):
+        """
+        Return the data from time start to time stop (inclusive).
 
-    def filtered(self,freq_range,filt_type='stop',order=4):
+        Parameters
+        ----------
+        start : {float}
+            The first time point to include (in the units of the time
+            dimension).
+        stop : {float}
+            The last time point to include.
+        copy : {bool},optional
+            By default, the result is a view of the data if the time
+            points are sorted (so no data are copied, but changes to
+            the result also change the original). If True, the data
+            are copied.
+
+        Returns
+        -------
+        ts : {TimeSeries}
+            A TimeSeries instance with the time points in the window.
+        """
+        tdim = self.dims[self.taxis]
+        if tdim._is_sorted():
+            ind = [slice(None)]*self.ndim
+            ind[self.taxis] = tdim._range_slice([(True,start,True),
+                                                 (False,stop,True)])
+        else:
+            # (a copy)
+            tdat = np.asarray(tdim)
+            return self.take(np.flatnonzero((tdat >= start) & (tdat <= stop)),
+                             self.taxis)
+        ret = self[tuple(ind)]
+        if copy:
+            ret = ret.copy()
+        return ret
+
+    def filtered(self,freq_range,filt_type='stop',order=4,engine=None,
+                 dtype=None):
         """
         Filter the data using a Butterworth filter and return a new
         TimeSeries instance.
@@ -196,6 +346,11 @@ class TimeSeries(DimArray):
             Filter type.
         order = {int}
             The order of the filter.
+        engine = {None,'sos','ba'},optional
+            Filter with second-order sections or (b,a) coefficients
+            (see ptsa.filt.buttfilt).
+        dtype = {None,numpy.float32,numpy.float64},optional
+            Precision of the filtered data (float64 by default).
 
         Returns
         -------
@@ -203,29 +358,42 @@ class TimeSeries(DimArray):
             A TimeSeries instance with the filtered data.
         """
 
-        filtered_array = filt.buttfilt(np.asarray(self),
+        filtered_array = filt.buttfilt(self._scaled_data(),
                                        freq_range,self.samplerate,filt_type,
-                                       order,axis=self.taxis)
+                                       order,axis=self.taxis,engine=engine,
+                                       dtype=dtype)
         attrs = self._attrs.copy()
         for k in self._required_attrs.keys():
             attrs.pop(k,None)
+        attrs.pop('scaling_dim',None)
         return TimeSeries(filtered_array,self.tdim, self.samplerate,
                           dims=self.dims.copy(), **attrs)
 
     def resampled(self, resampled_rate, window=None,
-                  loop_axis=None, num_mp_procs=0, pad_to_pow2=False):
+                  loop_axis=None, num_mp_procs=0, pad_to_pow2=False,
+                  method='fft', max_denominator=1000, pad_to_fast=False):
         """
         Resample the data and reset all the time ranges.
 
         Uses the resample function from scipy.  This method seems to
         be more accurate than the decimate method.
 
+        With method='polyphase', the data are resampled by the
+        rational factor up/down closest to resampled_rate/samplerate
+        with a polyphase FIR filter (see ptsa.filt.resample_poly),
+        in chunks along time. This is much faster than the FFT for
+        long recordings and lengths with large prime factors, and
+        the new samplerate and time range are exactly samplerate*up/down
+        and every down/up-th old sample time.
+
         Parameters
         ----------
         resampled_rate : {float}
             New sample rate to resample to.
         window : {None,str,float,tuple}, optional
-            See scipy.signal.resample for details
+            See scipy.signal.resample for details (or
+            scipy.signal.resample_poly for method='polyphase', where
+            None means a Kaiser window with beta 5).
         loop_axis: {None,str,int}, optional
             Sometimes it might be faster to loop over an axis.
         num_mp_procs: int, optional
@@ -236,6 +404,17 @@ class TimeSeries(DimArray):
         pad_to_pow2: bool, optional
             Pad along the time dimension to the next power of 2 so
             that the resampling is much faster (experimental).
+        method: {'fft','polyphase'}, optional
+            Resample with the FFT (scipy.signal.resample) or with a
+            polyphase filter (loop_axis, num_mp_procs, pad_to_pow2,
+            and pad_to_fast do not apply).
+        max_denominator: int, optional
+            Largest up or down factor for method='polyphase'.
+        pad_to_fast: bool, optional
+            Pad along the time dimension to the next length for which
+            the FFTs of the data and of the resampled data are fast
+            (see ptsa.helper.next_fast_len), which usually needs much
+            less padding than pad_to_pow2 (experimental).
 
         Returns
         -------
@@ -245,28 +424,74 @@ class TimeSeries(DimArray):
         See Also
         --------
         scipy.signal.resample
+        ptsa.filt.resample_poly
         """
+        if method == 'polyphase':
+            return self._resampled_poly(resampled_rate, window,
+                                        max_denominator)
+        elif method != 'fft':
+            raise ValueError("Unknown resampling method: "+str(method))
+
         # resample the data, getting new time range
         time_range = self[self.tdim]
         new_length = int(np.round(len(time_range)*resampled_rate/self.samplerate))
 
+        padded_length = None
         if pad_to_pow2:
             padded_length = 2**next_pow2(len(time_range))
+        elif pad_to_fast:
+            padded_length = _fast_resample_len(
+                len(time_range),resampled_rate/float(self.samplerate))
+        if padded_length is not None:
             padded_new_length = int(np.round(padded_length*resampled_rate/self.samplerate))
             time_range = np.hstack([time_range, 
                                     (np.arange(1,padded_length-len(time_range)+1)*np.diff(time_range[-2:]))+time_range[-1]])
 
         if loop_axis is None:
             # just do standard method on all data at once
-            if pad_to_pow2:
-                newdat,new_time_range = resample(pad_to_next_pow2(np.asarray(self),axis=self.taxis), 
+            if padded_length is not None:
+                newdat,new_time_range = resample(pad_to_len(self._scaled_data(),padded_length,axis=self.taxis), 
                                                  padded_new_length, t=time_range,
                                                  axis=self.taxis, window=window)
             else:
-                newdat,new_time_range = resample(np.asarray(self),
+                newdat,new_time_range = resample(self._scaled_data(),
                                                  new_length, t=time_range,
                                                  axis=self.taxis, window=window)
 
+        elif has_mp and num_mp_procs != 0:
+            # loop over the specified axis in worker processes, which
+            # map the data from shared memory and write their results
+            # into a shared output, so only handles are sent to them
+            loop_axis = self.get_axis(loop_axis)
+            shape = list(self.shape)
+            shape[self.taxis] = padded_new_length if padded_length is not None else new_length
+            src = SharedArray.from_array(self._scaled_data())
+            dst = SharedArray(shape,np.result_type(src.dtype,np.float64))
+            try:
+                po = mp.Pool(num_mp_procs)
+                res = []
+                for i in range(self.shape[loop_axis]):
+                    ind = [slice(None)]*self.ndim
+                    ind[loop_axis] = slice(i,i+1)
+                    res.append(po.apply_async(
+                            _resample_shared,
+                            (src, dst, tuple(ind),
+                             shape[self.taxis], np.asarray(time_range),
+                             self.taxis, window, padded_length)))
+                po.close()
+                for i in range(len(res)):
+                    sys.stdout.write('%d '%i)
+                    sys.stdout.flush()
+                    new_time_range = res[i].get()
+                po.join()
+                newdat = dst.array()
+            finally:
+                src.unlink()
+                dst.unlink()
+
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+
         else:
             # loop over specified axis
             # get the loop axis name and length
@@ -275,49 +500,24 @@ class TimeSeries(DimArray):
             # specify empty boolean index
             ind = np.zeros(loop_dim_len,dtype=np.bool)
             newdat = []
-            if has_mp and num_mp_procs != 0:
-                po = mp.Pool(num_mp_procs)
 
             for i in range(loop_dim_len):
                 ind[i] = True
                 dat = self.select(**{loop_dim:ind})
                 taxis = dat.taxis
-                if has_mp and num_mp_procs != 0:
-                    # start async proc
-                    if pad_to_pow2:
-                        dat = pad_to_next_pow2(np.asarray(dat), axis=dat.taxis)
-                        newdat.append(po.apply_async(resample,
-                                                     (np.asarray(dat), padded_new_length, time_range,
-                                                      taxis, window)))
-                    else:
-                        newdat.append(po.apply_async(resample,
-                                                     (np.asarray(dat), new_length, time_range,
-                                                      taxis, window)))
+                dat = dat._scaled_data()
+                # just call on that dataset
+                sys.stdout.write('%d '%i)
+                sys.stdout.flush()
+                if padded_length is not None:
+                    dat = pad_to_len(dat, padded_length, axis=taxis)
+                    ndat,new_time_range = resample(np.asarray(dat), padded_new_length, t=time_range,
+                                                   axis=taxis, window=window)
                 else:
-                    # just call on that dataset
-                    sys.stdout.write('%d '%i)
-                    sys.stdout.flush()
-                    if pad_to_pow2:
-                        dat = pad_to_next_pow2(np.asarray(dat), axis=dat.taxis)
-                        ndat,new_time_range = resample(np.asarray(dat), padded_new_length, t=time_range,
-                                                       axis=taxis, window=window)
-                    else:
-                        ndat,new_time_range = resample(np.asarray(dat), new_length, t=time_range,
-                                                       axis=taxis, window=window)
-                    newdat.append(ndat)
+                    ndat,new_time_range = resample(np.asarray(dat), new_length, t=time_range,
+                                                   axis=taxis, window=window)
+                newdat.append(ndat)
                 ind[i] = False
-            if has_mp and num_mp_procs != 0:
-                # aggregate mp results
-                po.close()
-                #po.join()
-                out = []
-                for i in range(len(newdat)):
-                    sys.stdout.write('%d '%i)
-                    sys.stdout.flush()
-                    out.append(newdat[i].get())
-                #out = [newdat[i].get() for i in range(len(newdat))]
-                newdat = [out[i][0] for i in range(len(out))]
-                new_time_range = out[i][1]
 
             # concatenate the new data
             newdat = np.concatenate(newdat,axis=self.get_axis(loop_axis))
@@ -326,7 +526,7 @@ class TimeSeries(DimArray):
             sys.stdout.flush()
 
         # remove pad if we padded it
-        if pad_to_pow2:
+        if padded_length is not None:
             newdat = newdat.take(range(new_length),axis=self.taxis)
             new_time_range = new_time_range[:new_length]
 
@@ -342,9 +542,48 @@ class TimeSeries(DimArray):
         attrs = self._attrs.copy()
         for k in self._required_attrs.keys():
             attrs.pop(k,None)
+        attrs.pop('scaling_dim',None)
         return TimeSeries(newdat, self.tdim, resampled_rate,
                           dims=newdims, **attrs)
 
+    def _resampled_poly(self, resampled_rate, window, max_denominator):
+        """
+        Resample with a polyphase filter (see resampled).
+        """
+        ratio = Fraction(resampled_rate/float(self.samplerate))
+        ratio = ratio.limit_denominator(max_denominator)
+        up,down = ratio.numerator,ratio.denominator
+        if up == 0 or up > max_denominator:
+            raise ValueError("Cannot resample from %g to %g with factors "
+                             "of at most %d." % (self.samplerate,
+                                                 resampled_rate,
+                                                 max_denominator))
+        if window is None:
+            window = ('kaiser', 5.0)
+        newdat = filt.resample_poly(self._scaled_data(), up, down,
+                                    axis=self.taxis, window=window)
+
+        # every down/up-th old sample time
+        time_range = np.asarray(self[self.tdim])
+        t0 = time_range[0] if len(time_range) > 0 else 0.
+        new_time_range = (t0 + np.arange(newdat.shape[self.taxis])*down/
+                          (float(up)*self.samplerate))
+
+        newdims = self.dims.copy()
+        attrs = self.dims[self.taxis]._attrs.copy()
+        for k in self.dims[self.taxis]._required_attrs.keys():
+            attrs.pop(k,None)
+        newdims[self.taxis] = Dim(new_time_range,
+                                  self.dims[self.taxis].name,
+                                  **attrs)
+
+        attrs = self._attrs.copy()
+        for k in self._required_attrs.keys():
+            attrs.pop(k,None)
+        attrs.pop('scaling_dim',None)
+        return TimeSeries(newdat, self.tdim, self.samplerate*up/float(down),
+                          dims=newdims, **attrs)
+
     def baseline_corrected(self, base_range):
         """
 
@@ -364,19 +603,13 @@ class TimeSeries(DimArray):
             A TimeSeries instance with the baseline corrected data.
 
         """
+        # the baseline must be computed on the scaled data
+        self = self.scaled()
+
         # get the average of baseline range
         baseline = self['time >= %f'%base_range[0],'time <= %f'%base_range[1]].mean('time')
 
-        # replicate over the time dimension
-        baseline = baseline.add_dim(self['time']).transpose(self.dim_names)
-
-        # subtract the baseline
-        new_dat = self - baseline
-
-        # return a new timeseries
-        attrs = self._attrs.copy()
-        for k in self._required_attrs.keys():
-            attrs.pop(k,None)
-        return TimeSeries(new_dat,self.tdim, self.samplerate,
-                          dims=self.dims.copy(), **attrs)
+        # subtract the baseline, which is broadcast over the time
+        # dimension (matched by name) without being replicated
+        return self - baseline
         
@@ -16,39 +16,287 @@ from scipy.special import sinc
 from helper import reshape_to_2d, reshape_from_2d, repeat_to_match_dims
 
 from filtfilt import filtfilt as filtfilt_future
+from filtfilt import lfilter_zi as lfilter_zi_future
+from filtfilt import sosfiltfilt, HAS_SOS
+from _arraytools import axis_slice
+try:
+    # polyphase filtering is only available in newer SciPy
+    from scipy.signal import upfirdn
+    HAS_UPFIRDN = True
+except ImportError:
+    HAS_UPFIRDN = False
 
 import pdb
 
-def buttfilt(dat,freq_range,sample_rate,filt_type,order,axis=-1):
-    """Wrapper for a Butterworth filter.
+# maximum number of filter designs to keep
+_max_design_cache_size = 100
+_design_cache = {}
 
+def butter_design(order,freq_range,sample_rate,filt_type,output='ba'):
     """
-    
-    # make sure dat is an array
-    dat = asarray(dat)
-
-    # reshape the data to 2D with time on the 2nd dimension
-    #origshape = dat.shape
-    #dat = reshape_to_2d(dat,axis)
-
-    # set up the filter
-    freq_range = asarray(freq_range)
-
-    # Nyquist frequency
-    nyq=sample_rate/2.;
+    Return the coefficients of a Butterworth filter.
+
+    The designs are cached by their parameters, so that filtering
+    many epochs (e.g., in get_event_data) designs each filter only
+    once. The returned arrays are read-only.
+
+    Parameters
+    ----------
+    order : {int}
+        The order of the filter.
+    freq_range : {array_like}
+        The cutoff frequency or frequencies (in Hz).
+    sample_rate : {float}
+        The samplerate of the data.
+    filt_type : {scipy.signal.band_dict.keys()}
+        Filter type.
+    output : {'ba','sos'},optional
+        Return the numerator and denominator (b,a) or second-order
+        sections.
+
+    Returns
+    -------
+    b,a : {ndarray}
+        For output='ba'.
+    sos : {ndarray}
+        For output='sos'.
+    """
+    freq_range = np.atleast_1d(np.asarray(freq_range,dtype=np.float64))
+    key = (order,tuple(freq_range),float(sample_rate),filt_type,output)
+    design = _design_cache.get(key)
+    if design is None:
+        # Nyquist frequency
+        nyq = sample_rate/2.
+        if output == 'sos':
+            design = butter(order,freq_range/nyq,filt_type,output='sos')
+            design.setflags(write=False)
+        else:
+            design = butter(order,freq_range/nyq,filt_type)
+            for coefs in design:
+                coefs.setflags(write=False)
+        if len(_design_cache) >= _max_design_cache_size:
+            _design_cache.clear()
+        _design_cache[key] = design
+    return design
+
+def buttfilt(dat,freq_range,sample_rate,filt_type,order,axis=-1,
+             engine=None,dtype=None):
+    """Wrapper for a Butterworth filter.
 
-    # generate the butterworth filter coefficients
-    [b,a]=butter(order,freq_range/nyq,filt_type)
+    Filters forward and backward (zero phase) along axis, all other
+    dimensions (e.g., channels and events) at once. The filter
+    designs are cached (see butter_design).
+
+    Parameters
+    ----------
+    dat : {array_like}
+        The data to filter.
+    freq_range : {array_like}
+        The range of frequencies to filter.
+    sample_rate : {float}
+        The samplerate of the data.
+    filt_type : {scipy.signal.band_dict.keys()}
+        Filter type.
+    order : {int}
+        The order of the filter.
+    axis : {int},optional
+        The time axis.
+    engine : {None,'sos','ba'},optional
+        Filter with second-order sections (the default if the SciPy
+        version supports them), which is numerically more robust for
+        high orders and low cutoffs, or with the (b,a) coefficients.
+    dtype : {None,numpy.float32,numpy.float64},optional
+        Precision of the filtering (and of the returned data), float64
+        by default. float32 only applies to the 'sos' engine.
+    """
+    if engine is None:
+        engine = 'sos' if HAS_SOS else 'ba'
+    if dtype is None:
+        dtype = np.float64
+
+    # make sure dat is an array of the requested precision
+    dat = asarray(dat,dtype=dtype)
+
+    if engine == 'sos':
+        sos = butter_design(order,freq_range,sample_rate,filt_type,
+                            output='sos')
+        # pad as much as for the (b,a) coefficients
+        ntaps = order*(1+(np.size(freq_range) > 1))+1
+        dat = sosfiltfilt(sos.astype(dat.dtype),dat,axis=axis,
+                          padlen=3*ntaps)
+    elif engine == 'ba':
+        b,a = butter_design(order,freq_range,sample_rate,filt_type)
+        dat = filtfilt_future(b,a,dat,axis=axis)
+    else:
+        raise ValueError("Unknown engine: "+str(engine))
+    return dat
 
-    # loop over final dimension
-    #for i in xrange(dat.shape[0]):
-    #    dat[i] = filtfilt(b,a,dat[i])
-    #dat = filtfilt2(b,a,dat,axis=axis)
-    dat = filtfilt_future(b,a,dat,axis=axis)
+class BlockFilter(object):
+    """
+    BlockFilter(b, a, axis=-1, zero_phase=True, padlen=None,
+                overlap=None, tol=1e-10)
+
+    Filter a continuous signal block by block (e.g., a whole session
+    that does not fit in memory), carrying the state of the filter
+    from one block to the next.
+
+    Without zero_phase, the blocks are filtered with lfilter, starting
+    from the steady state of the step response for the first sample
+    (see lfilter_zi), and every call to filter returns the filtered
+    block.
+
+    With zero_phase, the forward pass is carried over the blocks in
+    the same way (after the odd extension used by filtfilt) and the
+    backward pass is run over each stretch of data together with the
+    next overlap samples, which are dropped. The output is therefore
+    delayed by overlap samples: filter returns whatever is ready
+    (which can be empty) and finish returns the rest. The result
+    matches filtfilt up to a small multiple of tol times the
+    amplitude of the signal.
+
+    Parameters
+    ----------
+    b, a : {array_like}
+        The filter coefficients.
+    axis : {int},optional
+        The time axis of the blocks.
+    zero_phase : {bool},optional
+        Whether to filter forward and backward (like filtfilt).
+    padlen : {int},optional
+        Length of the odd extension at both ends of the signal (as
+        for filtfilt; 3*max(len(a),len(b)) by default).
+    overlap : {int},optional
+        Number of samples for the backward pass to settle. By
+        default it is calculated from the slowest pole of the filter
+        and tol.
+    tol : {float},optional
+        Tolerance used to calculate the overlap.
+
+    Examples
+    --------
+    >>> bf = BlockFilter(b, a)
+    >>> out = [bf.filter(block) for block in blocks]
+    >>> out.append(bf.finish())
+    """
+    def __init__(self, b, a, axis=-1, zero_phase=True, padlen=None,
+                 overlap=None, tol=1e-10):
+        self.b = np.atleast_1d(np.asarray(b, dtype=np.float64))
+        self.a = np.atleast_1d(np.asarray(a, dtype=np.float64))
+        self.axis = axis
+        self.zero_phase = zero_phase
+        ntaps = max(len(self.a), len(self.b))
+        if padlen is None:
+            padlen = 3*ntaps
+        self.padlen = padlen
+        if overlap is None:
+            overlap = self._settle_len(self.a, tol) + ntaps
+        self.overlap = overlap
+        self._zi = lfilter_zi_future(self.b, self.a)
+        self.reset()
+
+    @staticmethod
+    def _settle_len(a, tol):
+        # samples for the slowest pole to decay to tol
+        if len(a) < 2:
+            return 0
+        r = np.abs(np.roots(a)).max()
+        if r >= 1.0:
+            raise ValueError("The filter is not stable.")
+        if r == 0.0:
+            return 0
+        return int(np.ceil(np.log(tol)/np.log(r)))
+
+    def reset(self):
+        """
+        Start a new signal.
+        """
+        # state of the forward pass
+        self._state = None
+        # input that was not filtered yet (until there is enough for
+        # the odd extension)
+        self._pending = []
+        # last input samples (for the odd extension at the end)
+        self._tail = None
+        # forward filtered samples that were not returned yet
+        self._fwd = None
+
+    def _state_for(self, x0):
+        # steady state of the step response scaled by x0
+        return x0[...,np.newaxis]*self._zi
+
+    def _forward(self, x):
+        if self._state is None:
+            self._state = self._state_for(x[...,0])
+        y,self._state = lfilter(self.b, self.a, x, axis=-1, zi=self._state)
+        return y
+
+    def _backward(self, y):
+        # backward pass over y (returned in forward order)
+        rev = y[...,::-1]
+        y,zf = lfilter(self.b, self.a, rev, axis=-1,
+                       zi=self._state_for(rev[...,0]))
+        return y[...,::-1]
+
+    def filter(self, block):
+        """
+        Filter the next block of the signal and return the output
+        that is ready.
+        """
+        x = np.asarray(block, dtype=np.float64).swapaxes(self.axis, -1)
+        if not self.zero_phase:
+            return self._forward(x).swapaxes(self.axis, -1)
+
+        # wait until there is enough data for the odd extension
+        if self._tail is None:
+            self._pending.append(x)
+            n = np.sum([p.shape[-1] for p in self._pending])
+            if n <= self.padlen:
+                return self._empty(x)
+            x = np.concatenate(self._pending, axis=-1)
+            self._pending = []
+            if self.padlen > 0:
+                self._forward(2*x[...,:1] - x[...,self.padlen:0:-1])
+            self._fwd = self._forward(x)
+        else:
+            self._fwd = np.concatenate((self._fwd, self._forward(x)), axis=-1)
+        self._tail = np.concatenate(
+            (self._tail if self._tail is not None else x[...,:0],
+             x), axis=-1)[...,-(self.padlen+1):]
+
+        # return what is far enough from the end of the forward pass
+        nready = self._fwd.shape[-1] - self.overlap
+        if nready <= 0:
+            return self._empty(x)
+        y = self._backward(self._fwd)[...,:nready]
+        self._fwd = self._fwd[...,nready:]
+        return y.swapaxes(self.axis, -1)
+
+    def finish(self):
+        """
+        Return the rest of the output of a zero-phase filter (with the
+        odd extension at the end of the signal) and reset the filter.
+        """
+        if not self.zero_phase:
+            self.reset()
+            return None
+        if self._tail is None:
+            if len(self._pending) == 0:
+                return None
+            # the whole signal was too short, so let filtfilt complain
+            x = np.concatenate(self._pending, axis=-1)
+            self.reset()
+            return filtfilt_future(self.b, self.a, x,
+                                   padlen=self.padlen).swapaxes(self.axis, -1)
+        x = self._tail
+        ext = 2*x[...,-1:] - x[...,-2:-(self.padlen+2):-1]
+        y = np.concatenate((self._fwd, self._forward(ext)), axis=-1)
+        y = self._backward(y)[...,:self._fwd.shape[-1]]
+        self.reset()
+        return y.swapaxes(self.axis, -1)
+
+    def _empty(self, x):
+        return x[...,:0].swapaxes(self.axis, -1)
 
-    # reshape the data back
-    #dat = reshape_from_2d(dat,axis,origshape)
-    return dat
 
 ######
 # Code for decimate modified from http://www.bigbold.com/snippets/posts/show/1209
@@ -57,6 +305,64 @@ def buttfilt(dat,freq_range,sample_rate,filt_type,order,axis=-1):
 # from scipy.signal import cheby1, firwin, lfilter
 # this import is now at the top of the file 
 
+# largest downsampling factor of a single stage (the IIR filter
+# becomes unstable for larger factors)
+_max_stage_q = 13
+
+def _decimate_stages(q):
+    """
+    Split the downsampling factor q into factors of at most
+    _max_stage_q (as few as possible, largest first). Prime factors
+    larger than that are kept as they are.
+    """
+    primes = []
+    d = 2
+    while d*d <= q:
+        while q % d == 0:
+            primes.append(d)
+            q //= d
+        d += 1
+    if q > 1:
+        primes.append(q)
+    stages = []
+    for p in sorted(primes, reverse=True):
+        # put the factor into the first stage it fits into
+        for i in xrange(len(stages)):
+            if stages[i]*p <= _max_stage_q:
+                stages[i] *= p
+                break
+        else:
+            stages.append(p)
+    return sorted(stages, reverse=True)
+
+def _polyphase_fir(b, x, q, axis=-1):
+    """
+    Return lfilter(b, 1., x, axis=axis) downsampled by q (i.e., every
+    q-th output sample), computing only the samples that are kept.
+
+    The filter is split into q phases b[p::q], each of which filters
+    the matching phase of x at the low rate.
+    """
+    x = np.asarray(x)
+    nout = (x.shape[axis]+q-1)//q
+    y = None
+    for p in xrange(min(q, len(b))):
+        # x[n*q-p] for n >= 0 (zero before the start)
+        if p == 0:
+            xp = axis_slice(x, step=q, axis=axis)
+        else:
+            xp = axis_slice(x, start=q-p, step=q, axis=axis)
+            shape = list(x.shape)
+            shape[axis] = 1
+            xp = concatenate((zeros(shape, dtype=x.dtype), xp), axis=axis)
+        xp = axis_slice(xp, stop=nout, axis=axis)
+        yp = lfilter(b[p::q], 1., xp, axis=axis)
+        if y is None:
+            y = yp
+        else:
+            y += yp
+    return y
+
 def decimate(x, q, n=None, ftype='iir', axis=-1):
     """Downsample the signal x by an integer factor q, using an order n filter
     
@@ -65,6 +371,13 @@ def decimate(x, q, n=None, ftype='iir', axis=-1):
 
     (port to python of the GNU Octave function decimate.)
 
+    All 1-d slices of x along axis (e.g., channels and events) are
+    filtered at once. Factors larger than 13 are split into several
+    stages (e.g., 20 into 10 and 2), each with its own filter. The
+    IIR filter is applied forward and backward (zero phase); the FIR
+    filter is applied forward only, computing just the samples that
+    are kept.
+
     Inputs:
         x -- the signal to be downsampled (N-dimensional array)
         q -- the downsampling factor
@@ -78,7 +391,7 @@ def decimate(x, q, n=None, ftype='iir', axis=-1):
 
     """
 
-    if type(q) != type(1):
+    if not isinstance(q, (int, long, np.integer)):
         raise TypeError, "q should be an integer"
 
     if n is None:
@@ -86,29 +399,130 @@ def decimate(x, q, n=None, ftype='iir', axis=-1):
             n = 30
         else:
             n = 8
-    if ftype == 'fir':
-        # PBS - This method must be verified
-        b = firwin(n+1, 1./q, window='hamming')
-        y = lfilter(b, 1., x, axis=axis)
-    else:
-        (b, a) = cheby1(n, 0.05, 0.8/q)
-
-        # reshape the data to 2D with time on the 2nd dimension
-        origshape = x.shape
-        y = reshape_to_2d(x,axis)
+    if ftype not in ['iir', 'fir']:
+        raise ValueError, "ftype must be 'iir' or 'fir'"
 
-        # loop over final dimension
-        for i in xrange(y.shape[0]):
-            y[i] = filtfilt(b,a,y[i])
-        #y = filtfilt2(b,a,y)
+    y = np.asarray(x)
+    for stage_q in _decimate_stages(q):
+        if ftype == 'fir':
+            # PBS - This method must be verified
+            b = firwin(n+1, 1./stage_q, window='hamming')
+            y = _polyphase_fir(b, y, stage_q, axis=axis)
+        else:
+            (b, a) = cheby1(n, 0.05, 0.8/stage_q)
+            y = filtfilt_future(b, a, y, axis=axis)
+            y = axis_slice(y, step=stage_q, axis=axis)
 
-        # reshape the data back
-        y = reshape_from_2d(y,axis,origshape)
+    return y
 
-        # This needs to be filtfilt eventually
-        #y = lfilter(b, a, x, axis=axis)
 
-    return y.swapaxes(0,axis)[::q].swapaxes(0,axis)
+def resample_poly(x, up, down, axis=-1, window=('kaiser', 5.0),
+                  chunk_bytes=64*1024**2):
+    """
+    Resample x along axis by the rational factor up/down with a
+    polyphase FIR filter (as scipy.signal.resample_poly).
+
+    The output is computed in chunks along axis, each from just the
+    part of the input it depends on, so the memory used on top of the
+    output does not grow with the length of x. Unlike the FFT method
+    (scipy.signal.resample), the speed does not depend on the length
+    of x having small prime factors.
+
+    Parameters
+    ----------
+    x : {array_like}
+        The data to resample.
+    up, down : {int}
+        The upsampling and downsampling factors.
+    axis : {int},optional
+        The axis to resample along.
+    window : {str,tuple,array_like},optional
+        Window for the FIR low-pass filter (see
+        scipy.signal.firwin), or the filter coefficients.
+    chunk_bytes : {int},optional
+        Approximate size of the chunks of the output.
+
+    Returns
+    -------
+    y : {ndarray}
+        The resampled data with ceil(x.shape[axis]*up/down) samples
+        along axis.
+    """
+    if not HAS_UPFIRDN:
+        raise ImportError("resample_poly needs scipy.signal.upfirdn "
+                          "(SciPy >= 0.18).")
+    x = np.asarray(x)
+    up = int(up)
+    down = int(down)
+    if up < 1 or down < 1:
+        raise ValueError("up and down must be positive integers.")
+    if axis < 0:
+        axis = axis + x.ndim
+    g = _gcd(up, down)
+    up //= g
+    down //= g
+    if up == down == 1:
+        # nothing to resample (as in scipy.signal.resample_poly)
+        return x.copy()
+    if not x.dtype.kind in 'fc':
+        x = x.astype(np.float64)
+    nx = x.shape[axis]
+    nout = nx*up//down + bool(nx*up % down)
+
+    # the filter (as in scipy.signal.resample_poly)
+    max_rate = max(up, down)
+    if isinstance(window, (list, np.ndarray)):
+        h = np.asarray(window)*up
+        half_len = (len(h)-1)//2
+    else:
+        half_len = 10*max_rate
+        h = firwin(2*half_len+1, 1./max_rate, window=window)*up
+    h = h.astype(np.result_type(h.dtype, x.dtype))
+    # pad so that the output starts at the first input sample
+    n_pre_pad = down - half_len % down
+    n_post_pad = 0
+    n_pre_remove = (half_len + n_pre_pad)//down
+    while (_upfirdn_len(len(h)+n_pre_pad+n_post_pad, nx, up, down) <
+           nout + n_pre_remove):
+        n_post_pad += 1
+    h = np.concatenate((np.zeros(n_pre_pad, dtype=h.dtype), h,
+                        np.zeros(n_post_pad, dtype=h.dtype)))
+
+    shape = list(x.shape)
+    shape[axis] = nout
+    y = np.empty(shape, dtype=np.result_type(h.dtype, x.dtype))
+    if nout == 0:
+        return y
+    # output samples per chunk
+    other = max(y.size//nout, 1)*y.itemsize
+    chunk_out = max(int(chunk_bytes//(other*max(1., float(down)/up))),
+                    len(h)//down+1)
+
+    for k0 in xrange(0, nout, chunk_out):
+        k1 = min(k0+chunk_out, nout)
+        # samples of the full upfirdn output
+        m0 = k0+n_pre_remove
+        m1 = k1+n_pre_remove
+        # input samples that contribute to them (starting at a
+        # multiple of down, so that the phases line up)
+        n_lo = max(0, -(-(m0*down-len(h)+1)//up))
+        n_lo = (n_lo//down)*down
+        n_hi = min(nx, (m1*down)//up+1)
+        z = upfirdn(h, axis_slice(x, start=n_lo, stop=n_hi, axis=axis),
+                    up, down, axis=axis)
+        off = n_lo*up//down
+        y[(slice(None),)*axis+(slice(k0, k1),)] = axis_slice(
+            z, start=m0-off, stop=m1-off, axis=axis)
+    return y
+
+def _upfirdn_len(len_h, len_x, up, down):
+    # length of the output of upfirdn
+    return ((len_x-1)*up+len_h-1)//down+1
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
 
 
 ############
@@ -217,11 +631,15 @@ def filtfilt2(b,a,x,axis=-1):
     # perform filter in reverse direction
     sEnd = y.take([-1],axis).repeat(len(zi),axis)
     ziEnd = repeat_to_match_dims(zi,sEnd,axis) * sEnd
-    (y,zf)=lfilter(b,a,y.take(range(y.shape[axis]-1,-1,-1),axis),axis,ziEnd)
-
-    # flip it back
-    y = y.take(range(y.shape[axis]-1,-1,-1),axis)
-    return y.take(range(edge-1,y.shape[axis]-edge+1),axis)
+    # (flip with slicing, which does not copy)
+    if axis < 0:
+        axis = axis + y.ndim
+    rev = (slice(None),)*axis+(slice(None,None,-1),)
+    (y,zf)=lfilter(b,a,y[rev],axis,ziEnd)
+
+    # flip it back and remove the edges
+    y = y[rev]
+    return y[(slice(None),)*axis+(slice(edge-1,y.shape[axis]-edge+1),)]
     
 
 # if __name__=='__main__':
@@ -12,6 +12,12 @@
 from scipy import linalg
 from scipy.signal import lfilter
 import numpy as np
+try:
+    # second-order sections are only available in newer SciPy
+    from scipy.signal import sosfilt, sosfilt_zi
+    HAS_SOS = True
+except ImportError:
+    HAS_SOS = False
 from _arraytools import axis_slice, axis_reverse, odd_ext, even_ext, const_ext
 
 
@@ -269,12 +275,111 @@ unavoidable.
     x0 = axis_slice(ext, stop=1, axis=axis)
 
     # Forward filter.
-    (y, zf) = lfilter(b, a, ext, zi=zi * x0)
+    (y, zf) = lfilter(b, a, ext, axis=axis, zi=zi * x0)
 
     # Backward filter.
     # Create y0 so zi*y0 broadcasts appropriately.
     y0 = axis_slice(y, start=-1, axis=axis)
-    (y, zf) = lfilter(b, a, axis_reverse(y, axis=axis), zi=zi * y0)
+    (y, zf) = lfilter(b, a, axis_reverse(y, axis=axis), axis=axis,
+                      zi=zi * y0)
+
+    # Reverse y.
+    y = axis_reverse(y, axis=axis)
+
+    if edge > 0:
+        # Slice the actual signal from the extended signal.
+        y = axis_slice(y, start=edge, stop=-edge, axis=axis)
+
+    return y
+
+
+def sosfiltfilt(sos, x, axis=-1, padtype='odd', padlen=None):
+    """A forward-backward filter using cascaded second-order sections.
+
+Works like filtfilt, but the filter is given as second-order sections
+(e.g., butter(..., output='sos')), which is numerically more robust for
+high orders and low cutoffs. All 1-d slices of x along axis are
+filtered at once.
+
+Parameters
+----------
+sos : array_like, 2-D
+Array of second-order filter coefficients with shape (n_sections, 6).
+x : array_like
+The array of data to be filtered.
+axis : int, optional
+The axis of `x` to which the filter is applied.
+Default is -1.
+padtype : str or None, optional
+Must be 'odd', 'even', 'constant', or None (see filtfilt).
+padlen : int or None, optional
+The number of elements by which to extend `x` at both ends of
+`axis` before applying the filter. The default value is
+3*(2*n_sections+1), which matches filtfilt for the same filter of an
+even order in (b, a) form.
+
+Returns
+-------
+y : ndarray
+The filtered output with the same shape as `x`. The dtype is the
+common type of `sos` and `x` (so float32 data and sections stay
+float32).
+
+See Also
+--------
+filtfilt
+scipy.signal.sosfilt
+"""
+    if not HAS_SOS:
+        raise ImportError("sosfiltfilt needs scipy.signal.sosfilt "
+                          "(SciPy >= 0.16).")
+    if padtype not in ['even', 'odd', 'constant', None]:
+        raise ValueError(("Unknown value '%s' given to padtype. padtype must "
+                         "be 'even', 'odd', 'constant', or None.") %
+                            padtype)
+
+    sos = np.atleast_2d(sos)
+    x = np.asarray(x)
+    if axis < 0:
+        axis = axis + x.ndim
+
+    if padtype is None:
+        padlen = 0
+    if padlen is None:
+        edge = 3 * (2 * len(sos) + 1)
+    else:
+        edge = padlen
+
+    # x's 'axis' dimension must be bigger than edge.
+    if x.shape[axis] <= edge:
+        raise ValueError("The length of the input vector x must be at least "
+                         "padlen, which is %d." % edge)
+
+    if padtype is not None and edge > 0:
+        if padtype == 'even':
+            ext = even_ext(x, edge, axis=axis)
+        elif padtype == 'odd':
+            ext = odd_ext(x, edge, axis=axis)
+        else:
+            ext = const_ext(x, edge, axis=axis)
+    else:
+        ext = x
+
+    # Steady state of each section, shaped (n_sections, ..., 2) so
+    # that it broadcasts over all the other axes of x.
+    zi = sosfilt_zi(sos).astype(np.result_type(sos, x))
+    zi_shape = [1] * x.ndim
+    zi_shape[axis] = 2
+    zi = np.reshape(zi, [len(sos)] + zi_shape)
+
+    # Forward filter.
+    x0 = axis_slice(ext, stop=1, axis=axis)
+    (y, zf) = sosfilt(sos, ext, axis=axis, zi=zi * x0)
+
+    # Backward filter.
+    y0 = axis_slice(y, start=-1, axis=axis)
+    (y, zf) = sosfilt(sos, axis_reverse(y, axis=axis), axis=axis,
+                      zi=zi * y0)
 
     # Reverse y.
     y = axis_reverse(y, axis=axis)
@@ -59,6 +59,11 @@ def reshape_from_2d(data,axis,dshape):
     return ret
 
 def repeat_to_match_dims(x,y,axis=-1):
+    """
+    Return the 1-D array x repeated along all dimensions of y except
+    axis (along which x lies). The result is a read-only view of x
+    (the repeats are broadcast rather than copied).
+    """
     
     rnk = len(y.shape)
     
@@ -66,13 +71,12 @@ def repeat_to_match_dims(x,y,axis=-1):
     if axis < 0: 
         axis = axis + rnk
 
-    for d in range(axis)+range(axis+1,rnk):
-        # add the dimension
-        x = np.expand_dims(x,d)
-        # repeat to fill that dim
-        x = x.repeat(y.shape[d],d)
-
-    return x
+    shape = [1]*rnk
+    shape[axis] = len(x)
+    x = np.reshape(x,shape)
+    shape = list(y.shape)
+    shape[axis] = len(x.flat)
+    return np.broadcast_to(x,shape)
 
 
 def deg2rad(degrees):
@@ -163,8 +167,70 @@ def pad_to_next_pow2(x, axis=0):
     Note: This is much easier with numpy version 1.7.0, which has a
     new pad method.
     """
+    return pad_to_len(x, 2 ** next_pow2(x.shape[axis]), axis=axis)
+
+# fast FFT lengths by (signal length, kernel length)
+_max_fft_len_cache_size = 10000
+_fft_len_cache = {}
+
+def is_fast_len(n):
+    """
+    Returns whether n is 5-smooth (has no prime factors larger than
+    5), so that FFTs of length n are fast.
+    """
+    if n < 1:
+        return False
+    for p in (2,3,5):
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+def next_fast_len(n):
+    """
+    Returns the smallest 5-smooth number >= n (see is_fast_len),
+    which is usually much closer to n than the next power of 2
+    (e.g., 2160 instead of 4096 for 2049).
+    """
+    if n <= 1:
+        return 1
+    best = 2 ** next_pow2(n)
+    # try all 3**i * 5**j below best and fill up with powers of 2
+    p35 = 1
+    while p35 < best:
+        p = p35
+        while p < n:
+            p *= 2
+        best = min(best, p)
+        p5 = p35
+        while p5 < best:
+            p5 *= 5
+            p = p5
+            while p < n:
+                p *= 2
+            best = min(best, p)
+        p35 *= 3
+    return best
+
+def fft_len(signal_len, kernel_len=1):
+    """
+    Returns a fast FFT length (see next_fast_len) for the linear
+    convolution of a signal with a kernel (i.e., at least
+    signal_len+kernel_len-1). The lengths are cached.
+    """
+    key = (signal_len,kernel_len)
+    size = _fft_len_cache.get(key)
+    if size is None:
+        size = next_fast_len(signal_len+kernel_len-1)
+        if len(_fft_len_cache) >= _max_fft_len_cache_size:
+            _fft_len_cache.clear()
+        _fft_len_cache[key] = size
+    return size
+
+def pad_to_len(x, new_len, axis=0):
+    """
+    Pad an array with zeros to new_len along the specified axis.
+    """
     cur_len = x.shape[axis]
-    new_len = 2 ** next_pow2(cur_len)
     to_pad = new_len - cur_len
     if to_pad > 0:
         shape = list(x.shape)
@@ -9,10 +9,13 @@
 
 import sys
 import numpy as np
-from scipy.signal import hilbert
+from scipy.signal import hilbert, freqz
 
 from ptsa.data.timeseries import TimeSeries,Dim
-from ptsa.helper import next_pow2
+from ptsa.helper import next_pow2, fft_len
+from ptsa.filt import butter_design
+from ptsa.filtfilt import HAS_SOS
+from ptsa._arraytools import axis_slice
 
 freq_bands = [('delta', [2.0,4.0]),
               ('theta', [4.0,8.0]),
@@ -20,8 +23,43 @@ freq_bands = [('delta', [2.0,4.0]),
               ('beta', [16.0,26.0]),
               ('gamma_1', [28.0,42.0]),
               ('gamma_2', [44.0,100.0])]
-def hilbert_pow(dat_ts, bands=None, pad_to_pow2=False, verbose=True):
+def hilbert_pow(dat_ts, bands=None, pad_to_pow2=False, verbose=True,
+                method='fft', order=4, dtype=np.float64):
     """
+    Calculate the power (the envelope of the analytic signal) of a
+    TimeSeries in several frequency bands.
+
+    Parameters
+    ----------
+    dat_ts : {TimeSeries}
+        The data.
+    bands : {list},optional
+        List of (name, [low, high]) tuples (freq_bands by default).
+    pad_to_pow2 : {bool},optional
+        Pad the time dimension to the next power of 2 for the FFTs
+        (otherwise method 'fft' pads to the next fast length, see
+        ptsa.helper.fft_len).
+    verbose : {bool},optional
+        Print the name of each band.
+    method : {'fft','filter'},optional
+        With 'fft', the data are transformed once and each band is
+        extracted in the frequency domain by multiplying with the
+        analytic-signal mask and the squared magnitude response of a
+        Butterworth band-pass filter (the response of the forward and
+        backward filtering of TimeSeries.filtered), so only one
+        inverse FFT per band is needed. With 'filter', each band is
+        filtered with TimeSeries.filtered before the Hilbert
+        transform. The two agree away from the edges of the data.
+    order : {int},optional
+        Order of the Butterworth filters.
+    dtype : {numpy.dtype},optional
+        dtype of the returned power (e.g., np.float32 to halve the
+        memory).
+
+    Returns
+    -------
+    pow : {TimeSeries}
+        The power with a new freqs dimension (the band names) first.
     """
     # set default freq bands
     if bands is None:
@@ -32,30 +70,104 @@ def hilbert_pow(dat_ts, bands=None, pad_to_pow2=False, verbose=True):
     npts_orig = dat_ts.shape[taxis]
     if pad_to_pow2:
         npts = 2**next_pow2(npts_orig)
+    elif method == 'fft':
+        npts = fft_len(npts_orig)
     else:
         npts = npts_orig
 
+    if method == 'fft':
+        newdat = _hilbert_pow_fft(dat_ts, bands, npts, order, dtype, verbose)
+    elif method == 'filter':
+        newdat = _hilbert_pow_filter(dat_ts, bands, npts, order, dtype,
+                                     verbose)
+    else:
+        raise ValueError("Unknown method: "+str(method))
+
+    dims = [Dim([band[0] for band in bands],'freqs')]+list(dat_ts.dims)
+    return TimeSeries(newdat, tdim=dat_ts.tdim,
+                      samplerate=dat_ts.samplerate, dims=dims)
+
+
+def _hilbert_pow_filter(dat_ts, bands, npts, order, dtype, verbose):
+    """
+    Filter each band separately and take the Hilbert transform.
+    """
+    taxis = dat_ts.get_axis(dat_ts.tdim)
+    npts_orig = dat_ts.shape[taxis]
+    pow = np.empty((len(bands),)+dat_ts.shape, dtype=dtype)
+
     # calc the hilbert power
     if verbose:
         sys.stdout.write('Hilbert Bands: ')
         sys.stdout.flush()
-    pow = None
-    for band in bands:
+    for i,band in enumerate(bands):
         if verbose:
             sys.stdout.write('%s '%band[0])
             sys.stdout.flush()
-        p = TimeSeries(np.abs(hilbert(dat_ts.filtered(band[1], 
-                                                      filt_type='pass'),
-                                      N=npts, axis=taxis).take(np.arange(npts_orig),
-                                                               axis=taxis)), 
-                       tdim=dat_ts.tdim, samplerate=dat_ts.samplerate, 
-                       dims=dat_ts.dims.copy()).add_dim(Dim([band[0]],'freqs'))
-        if pow is None:
-            pow = p
-        else:
-            pow = pow.extend(p, 'freqs')
+        filtered = dat_ts.filtered(band[1], filt_type='pass', order=order)
+        pow[i] = np.abs(axis_slice(hilbert(np.asarray(filtered), N=npts,
+                                           axis=taxis),
+                                   stop=npts_orig, axis=taxis))
+    if verbose:
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+    return pow
 
+
+def _hilbert_pow_fft(dat_ts, bands, npts, order, dtype, verbose):
+    """
+    Filter bank in the frequency domain (one forward FFT for all
+    bands).
+    """
+    taxis = dat_ts.get_axis(dat_ts.tdim)
+    npts_orig = dat_ts.shape[taxis]
+    samplerate = float(dat_ts.samplerate)
+    pow = np.empty((len(bands),)+dat_ts.shape, dtype=dtype)
+
+    # spectrum up to the Nyquist frequency (the analytic signal has no
+    # negative frequencies)
+    spec = np.fft.rfft(np.asarray(dat_ts._scaled_data()), n=npts, axis=taxis)
+    nfreqs = spec.shape[taxis]
+    w = np.pi*np.arange(nfreqs)/(npts/2.)
+    # analytic-signal mask: double the positive frequencies
+    analytic = np.ones(nfreqs)*2.
+    analytic[0] = 1.
+    if npts % 2 == 0:
+        analytic[-1] = 1.
+    shape = [1]*spec.ndim
+    shape[taxis] = nfreqs
+
+    if verbose:
+        sys.stdout.write('Hilbert Bands: ')
+        sys.stdout.flush()
+    for i,band in enumerate(bands):
+        if verbose:
+            sys.stdout.write('%s '%band[0])
+            sys.stdout.flush()
+        # squared magnitude response of the band-pass filter (forward
+        # and backward)
+        gain = _butter_gain2(order, band[1], samplerate, w)*analytic
+        # zero-padding the spectrum to npts leaves the negative
+        # frequencies empty
+        z = np.fft.ifft(spec*gain.reshape(shape), n=npts, axis=taxis)
+        pow[i] = np.abs(axis_slice(z, stop=npts_orig, axis=taxis))
     if verbose:
         sys.stdout.write('\n')
         sys.stdout.flush()
     return pow
+
+
+def _butter_gain2(order, freq_range, samplerate, w):
+    """
+    Return the squared magnitude response of a Butterworth band-pass
+    filter at the normalized frequencies w (in radians per sample).
+    """
+    if HAS_SOS:
+        gain = np.ones(len(w))
+        for sect in butter_design(order, freq_range, samplerate, 'pass',
+                                  output='sos'):
+            gain *= np.abs(freqz(sect[:3], sect[3:], worN=w)[1])**2
+    else:
+        b,a = butter_design(order, freq_range, samplerate, 'pass')
+        gain = np.abs(freqz(b, a, worN=w)[1])**2
+    return gain
@@ -0,0 +1,356 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+"""
+Power spectral density estimates (Welch and DPSS multitaper) for
+all channels and events at once.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.linalg import eig_banded
+from scipy.signal import get_window, detrend as detrend_func
+
+from ptsa.helper import reshape_to_2d, reshape_from_2d
+from ptsa.data import TimeSeries, Dim, DimArray
+
+try:
+    from scipy.signal.windows import dpss as _scipy_dpss
+    HAS_DPSS = True
+except ImportError:
+    HAS_DPSS = False
+
+# maximum number of windows and taper sets to keep
+_max_window_cache_size = 100
+_window_cache = {}
+
+
+def _dpss(n, nw, n_tapers):
+    """
+    Return the first n_tapers discrete prolate spheroidal sequences
+    of length n and time-halfbandwidth product nw (normalized to unit
+    energy, with the sign convention of scipy.signal.windows.dpss).
+    """
+    t = np.arange(n)
+    # tridiagonal matrix that commutes with the time and frequency
+    # limiting operator (Slepian, 1978):
+    diag = ((n-1-2*t)/2.)**2*np.cos(2*np.pi*nw/float(n))
+    off = t[1:]*(n-t[1:])/2.
+    evals,evecs = eig_banded(np.vstack((diag,np.r_[off,0])),lower=True,
+                             select='i',select_range=(n-n_tapers,n-1))
+    tapers = evecs[:,::-1].T.copy()
+    # symmetric tapers have a positive mean, antisymmetric tapers
+    # start with a positive lobe:
+    tapers[::2][tapers[::2].sum(axis=1) < 0] *= -1
+    thresh = max(1e-7,1./n)
+    for taper in tapers[1::2]:
+        if taper[taper*taper > thresh][0] < 0:
+            taper *= -1
+    return tapers
+
+
+def dpss_tapers(n, nw, n_tapers=None):
+    """
+    Return DPSS (Slepian) tapers.
+
+    The tapers are cached by their parameters, so that estimating
+    many spectra designs each set only once. The returned array is
+    read-only.
+
+    Parameters
+    ----------
+    n : {int}
+        Length of the tapers in samples.
+    nw : {float}
+        Time-halfbandwidth product.
+    n_tapers : {int},optional
+        Number of tapers (2*nw-1 by default).
+
+    Returns
+    -------
+    tapers : {ndarray}
+        Array of shape (n_tapers,n) with unit energy tapers.
+    """
+    if n_tapers is None:
+        n_tapers = max(int(2*nw)-1,1)
+    key = ('dpss',int(n),float(nw),int(n_tapers))
+    tapers = _window_cache.get(key)
+    if tapers is None:
+        if HAS_DPSS:
+            tapers = _scipy_dpss(n,nw,n_tapers)
+        else:
+            tapers = _dpss(n,nw,n_tapers)
+        tapers = np.atleast_2d(tapers)
+        tapers.setflags(write=False)
+        _cache_window(key,tapers)
+    return tapers
+
+
+def _get_window(window, n):
+    """
+    Return the (cached, read-only) window of length n for Welch's
+    method (see scipy.signal.get_window).
+    """
+    if isinstance(window,np.ndarray):
+        if len(window) != n:
+            raise ValueError("The window must have nperseg samples: "+
+                             str(len(window)))
+        return window
+    key = ('window',window,int(n))
+    win = _window_cache.get(key)
+    if win is None:
+        win = get_window(window,n)
+        win.setflags(write=False)
+        _cache_window(key,win)
+    return win
+
+
+def _cache_window(key, win):
+    if len(_window_cache) >= _max_window_cache_size:
+        _window_cache.clear()
+    _window_cache[key] = win
+
+
+def _prepare(dat, samplerate, time_axis):
+    """
+    Return the samplerate and (positive) time axis of dat.
+    """
+    if isinstance(dat,TimeSeries):
+        samplerate = dat.samplerate
+        time_axis = dat.get_axis(dat.tdim)
+    elif samplerate is None:
+        raise ValueError('Samplerate must be specified unless you provide a TimeSeries!')
+    if time_axis < 0:
+        time_axis += len(dat.shape)
+    return float(samplerate),time_axis
+
+
+def _rows(dat, time_axis):
+    """
+    Return dat reshaped to 2D with time on the 2nd dimension and the
+    gain and offset of each row (None if the data do not need
+    scaling, see TimeSeries.scaled).
+    """
+    gain = offset = None
+    if isinstance(dat,TimeSeries):
+        gain,offset = dat._get_scaling()
+    if gain is not None:
+        gshape = list(dat.shape)
+        gshape[time_axis] = 1
+        gain = reshape_to_2d(gain*np.ones(gshape),time_axis)
+        offset = reshape_to_2d(offset*np.ones(gshape),time_axis)
+    return reshape_to_2d(np.asarray(dat),time_axis),gain,offset
+
+
+def _chunk(eegdat, gain, offset, r0, r1):
+    """
+    Return rows r0 to r1 of eegdat as float64 with the scaling
+    applied.
+    """
+    x = np.array(eegdat[r0:r1],dtype=np.float64)
+    if gain is not None:
+        x *= gain[r0:r1]
+        x += offset[r0:r1]
+    return x
+
+
+def _onesided(psd, nfft):
+    """
+    Double the power of the frequencies that also have a negative
+    counterpart (all but 0 and the Nyquist frequency).
+    """
+    if nfft % 2:
+        psd[:,1:] *= 2
+    else:
+        psd[:,1:-1] *= 2
+    return psd
+
+
+def _detrend(x, detrend):
+    if detrend == 'constant':
+        return x-x.mean(axis=-1)[...,np.newaxis]
+    elif detrend == 'linear':
+        return detrend_func(x,axis=-1,type='linear')
+    elif not detrend:
+        return x
+    raise ValueError("detrend must be 'constant', 'linear', or False: "+
+                     str(detrend))
+
+
+def _wrap_result(dat, psd, freqs, time_axis, freq_name):
+    """
+    Reshape the 2D psd (rows x freqs) back to the shape of dat with
+    the frequencies on the time axis.
+    """
+    newshape = list(dat.shape)
+    newshape[time_axis] = len(freqs)
+    psd = reshape_from_2d(psd,time_axis,tuple(newshape))
+    if isinstance(dat,TimeSeries):
+        dims = np.empty(len(dat.dims),dat.dims.dtype)
+        dims[:] = dat.dims[:]
+        dims[time_axis] = Dim(freqs,freq_name)
+        return DimArray(psd,dims=dims)
+    return freqs,psd
+
+
+def _chunk_rows(nrows, row_bytes, chunk_bytes):
+    step = int(max(1,chunk_bytes//max(row_bytes,1)))
+    for r0 in range(0,nrows,step):
+        yield r0,min(r0+step,nrows)
+
+
+def welch_psd(dat, samplerate=None, nperseg=256, noverlap=None,
+              window='hann', nfft=None, detrend='constant',
+              scaling='density', time_axis=-1, freq_name='freqs',
+              chunk_bytes=64*1024**2):
+    """
+    Estimate the power spectral density with Welch's method.
+
+    The segments of all channels and events are windowed and
+    transformed at once (in chunks of rows of about chunk_bytes), so
+    the estimates for many epochs take a few large FFTs. The results
+    match those of scipy.signal.welch.
+
+    Parameters
+    ----------
+    dat : {array_like}
+        The data. Sample rate and time dimension must be specified as
+        attributes of dat or in the key word arguments.
+    samplerate : {float},optional
+        The sample rate of the signal. Must be specified if dat is
+        not a TimeSeries instance.
+    nperseg : {int},optional
+        Number of samples per segment (at most the number of samples
+        in dat).
+    noverlap : {int},optional
+        Number of samples the segments overlap (nperseg//2 by
+        default).
+    window : {string, tuple, ndarray},optional
+        Window for each segment (see scipy.signal.get_window).
+    nfft : {int},optional
+        Length of the FFT (nperseg by default).
+    detrend : {'constant','linear',False},optional
+        How to detrend each segment.
+    scaling : {'density','spectrum'},optional
+        Return the power spectral density (V**2/Hz) or the power
+        spectrum (V**2).
+    time_axis : {int},optional
+        Index of the time dimension in dat (only used if dat is not
+        a TimeSeries instance).
+    freq_name : {string},optional
+        Name of the frequency dimension of the returned DimArray.
+    chunk_bytes : {int},optional
+        Approximate size (in bytes) of the segment spectra held at
+        once.
+
+    Returns
+    -------
+    A DimArray with the time dimension replaced by a frequency
+    dimension if dat is a TimeSeries, (freqs,psd) otherwise.
+    """
+    samplerate,time_axis = _prepare(dat,samplerate,time_axis)
+    nsamp = dat.shape[time_axis]
+    nperseg = min(int(nperseg),nsamp)
+    if noverlap is None:
+        noverlap = nperseg//2
+    if noverlap >= nperseg:
+        raise ValueError("noverlap must be less than nperseg.")
+    if nfft is None:
+        nfft = nperseg
+    elif nfft < nperseg:
+        raise ValueError("nfft must be at least nperseg.")
+    if scaling not in ('density','spectrum'):
+        raise ValueError("scaling must be 'density' or 'spectrum': "+
+                         str(scaling))
+    win = _get_window(window,nperseg)
+    if scaling == 'density':
+        scale = 1./(samplerate*(win*win).sum())
+    else:
+        scale = 1./win.sum()**2
+
+    step = nperseg-noverlap
+    nseg = (nsamp-noverlap)//step
+    freqs = np.fft.rfftfreq(nfft,1./samplerate)
+    eegdat,gain,offset = _rows(dat,time_axis)
+    psd = np.empty((len(eegdat),len(freqs)))
+    for r0,r1 in _chunk_rows(len(eegdat),nseg*len(freqs)*16,chunk_bytes):
+        x = _chunk(eegdat,gain,offset,r0,r1)
+        # all segments of all rows as a view:
+        segs = as_strided(x,(r1-r0,nseg,nperseg),
+                          (x.strides[0],step*x.strides[1],x.strides[1]))
+        spec = np.fft.rfft(_detrend(segs,detrend)*win,nfft)
+        psd[r0:r1] = (spec.real**2+spec.imag**2).mean(axis=1)
+    psd *= scale
+    _onesided(psd,nfft)
+    return _wrap_result(dat,psd,freqs,time_axis,freq_name)
+
+
+def multitaper_psd(dat, samplerate=None, nw=4., n_tapers=None, nfft=None,
+                   detrend='constant', time_axis=-1, freq_name='freqs',
+                   chunk_bytes=64*1024**2):
+    """
+    Estimate the power spectral density with DPSS multitapers.
+
+    The spectra of all tapers for all channels and events are
+    computed at once (in chunks of rows of about chunk_bytes) and
+    averaged with equal weights. The tapers are cached by their
+    length and time-halfbandwidth product (see dpss_tapers).
+
+    Parameters
+    ----------
+    dat : {array_like}
+        The data. Sample rate and time dimension must be specified as
+        attributes of dat or in the key word arguments.
+    samplerate : {float},optional
+        The sample rate of the signal. Must be specified if dat is
+        not a TimeSeries instance.
+    nw : {float},optional
+        Time-halfbandwidth product; the frequency resolution is
+        2*nw*samplerate/samples.
+    n_tapers : {int},optional
+        Number of tapers (2*nw-1 by default).
+    nfft : {int},optional
+        Length of the FFT (the number of samples by default).
+    detrend : {'constant','linear',False},optional
+        How to detrend the data before tapering.
+    time_axis : {int},optional
+        Index of the time dimension in dat (only used if dat is not
+        a TimeSeries instance).
+    freq_name : {string},optional
+        Name of the frequency dimension of the returned DimArray.
+    chunk_bytes : {int},optional
+        Approximate size (in bytes) of the tapered spectra held at
+        once.
+
+    Returns
+    -------
+    A DimArray with the time dimension replaced by a frequency
+    dimension if dat is a TimeSeries, (freqs,psd) otherwise.
+    """
+    samplerate,time_axis = _prepare(dat,samplerate,time_axis)
+    nsamp = dat.shape[time_axis]
+    if nfft is None:
+        nfft = nsamp
+    elif nfft < nsamp:
+        raise ValueError("nfft must be at least the number of samples.")
+    tapers = dpss_tapers(nsamp,nw,n_tapers)
+    # the tapers have unit energy:
+    scale = 1./samplerate
+
+    freqs = np.fft.rfftfreq(nfft,1./samplerate)
+    eegdat,gain,offset = _rows(dat,time_axis)
+    psd = np.empty((len(eegdat),len(freqs)))
+    for r0,r1 in _chunk_rows(len(eegdat),len(tapers)*len(freqs)*16,
+                             chunk_bytes):
+        x = _detrend(_chunk(eegdat,gain,offset,r0,r1),detrend)
+        spec = np.fft.rfft(x[:,np.newaxis,:]*tapers,nfft)
+        psd[r0:r1] = (spec.real**2+spec.imag**2).mean(axis=1)
+    psd *= scale
+    _onesided(psd,nfft)
+    return _wrap_result(dat,psd,freqs,time_axis,freq_name)
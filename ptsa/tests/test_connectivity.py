@@ -0,0 +1,79 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_almost_equal, \
+     assert_array_equal
+
+from ptsa.data import TimeSeries,Dim,DimArray
+from ptsa.connectivity import connectivity
+
+
+class test_connectivity(TestCase):
+    def setUp(self):
+        # freqs x channels x events x time
+        shape = (2,4,30,5)
+        phase = np.random.uniform(-np.pi,np.pi,shape)
+        # the second channel follows the first with a fixed lag
+        phase[:,1] = phase[:,0]+.5
+        power = np.random.uniform(.5,2,shape)
+        dims = [Dim([4.,8.],'freqs'),Dim(['a','b','c','d'],'channels'),
+                Dim(np.arange(30),'events'),Dim(np.arange(5)/10.,'time')]
+        self.phase = TimeSeries(phase,'time',10.,dims=dims)
+        self.power = TimeSeries(power,'time',10.,dims=dims)
+
+    def _loops(self, over_axis):
+        # direct estimates for each pair of channels
+        z = np.asarray(self.power)**.5*np.exp(1j*np.asarray(self.phase))
+        nchan = z.shape[1]
+        plv = [[None]*nchan for i in range(nchan)]
+        coh = [[None]*nchan for i in range(nchan)]
+        for i in range(nchan):
+            for j in range(nchan):
+                zi = np.take(z,i,axis=1)
+                zj = np.take(z,j,axis=1)
+                ui,uj = zi/np.abs(zi),zj/np.abs(zj)
+                plv[i][j] = np.abs((ui*uj.conj()).mean(over_axis))
+                coh[i][j] = ((zi*zj.conj()).mean(over_axis)/
+                             np.sqrt((np.abs(zi)**2).mean(over_axis)*
+                                     (np.abs(zj)**2).mean(over_axis)))
+        return np.array(plv),np.array(coh)
+
+    def test_connectivity(self):
+        plv,coh = self._loops(1)
+        # small chunks give the same result as one chunk:
+        for chunk_bytes in [1,64*1024**2]:
+            res = connectivity(self.phase,self.power,
+                               ['plv','coherence','imag_coherence'],
+                               chunk_bytes=chunk_bytes)
+            self.assertTrue(isinstance(res['plv'],TimeSeries))
+            self.assertEquals(list(res['plv'].dim_names),
+                              ['channel_i','channel_j','freqs','time'])
+            assert_array_equal(res['plv'].dims[0],['a','b','c','d'])
+            assert_array_almost_equal(np.asarray(res['plv']),plv)
+            assert_array_almost_equal(np.asarray(res['coherence']),
+                                      np.abs(coh))
+            assert_array_almost_equal(np.asarray(res['imag_coherence']),
+                                      coh.imag)
+        # the lagged channels are locked:
+        assert_array_almost_equal(np.asarray(res['plv'][0,1]),1.)
+        assert_array_almost_equal(np.asarray(res['plv'][2,2]),1.)
+
+        # over time (the result is no TimeSeries):
+        plv,coh = self._loops(-1)
+        res = connectivity(self.phase,measures='plv',over_dim='time')
+        self.assertTrue(isinstance(res,DimArray))
+        self.assertFalse(isinstance(res,TimeSeries))
+        self.assertEquals(list(res.dim_names),
+                          ['channel_i','channel_j','freqs','events'])
+        assert_array_almost_equal(np.asarray(res),plv)
+
+        self.assertRaises(ValueError,connectivity,self.phase,
+                          measures='pli')
+        self.assertRaises(ValueError,connectivity,np.asarray(self.phase))
@@ -0,0 +1,109 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_almost_equal
+from scipy.signal import butter, cheby1, firwin, lfilter
+
+from ptsa.filt import BlockFilter, buttfilt, butter_design, decimate, \
+     _decimate_stages
+from ptsa.filtfilt import filtfilt, lfilter_zi
+
+
+class test_BlockFilter(TestCase):
+    def setUp(self):
+        self.dat = np.random.randn(2,6000).cumsum(1)
+        self.b,self.a = butter(4,[1./128],'high')
+
+    def test_causal(self):
+        bf = BlockFilter(self.b,self.a,axis=0,zero_phase=False)
+        y = np.concatenate([bf.filter(self.dat[:,i:i+777].T)
+                            for i in range(0,6000,777)],0).T
+        zi = lfilter_zi(self.b,self.a)[np.newaxis]*self.dat[:,:1]
+        assert_array_almost_equal(
+            y,lfilter(self.b,self.a,self.dat,zi=zi)[0],10)
+
+    def test_zero_phase(self):
+        bf = BlockFilter(self.b,self.a)
+        out = [bf.filter(self.dat[:,i:i+500]) for i in range(0,6000,500)]
+        # the output is delayed by the overlap
+        self.assertEquals(out[0].shape,(2,0))
+        out.append(bf.finish())
+        y = np.concatenate(out,1)
+        ref = filtfilt(self.b,self.a,self.dat)
+        self.assertEquals(y.shape,ref.shape)
+        assert_array_almost_equal(y/np.abs(ref).max(),
+                                  ref/np.abs(ref).max(),7)
+        # too short for the extension
+        bf = BlockFilter(self.b,self.a)
+        self.assertEquals(bf.filter(self.dat[:,:10]).shape,(2,0))
+        self.assertRaises(ValueError,bf.finish)
+
+
+class test_buttfilt(TestCase):
+    def setUp(self):
+        self.dat = np.random.randn(4,3,1000)
+
+    def test_design_cache(self):
+        sos = butter_design(4,[58.,62.],200.,'stop',output='sos')
+        self.assertTrue(butter_design(4,np.array([58.,62.]),200,'stop',
+                                      output='sos') is sos)
+        self.assertFalse(sos.flags.writeable)
+        b,a = butter_design(4,[58.,62.],200.,'stop')
+        self.assertEquals(len(b),9)
+
+    def test_engines(self):
+        ba = buttfilt(self.dat,[58.,62.],200.,'stop',4,engine='ba')
+        sos = buttfilt(self.dat,[58.,62.],200.,'stop',4,engine='sos')
+        assert_array_almost_equal(sos,ba,8)
+        # all channels and events at once
+        assert_array_almost_equal(
+            buttfilt(self.dat[1],[58.,62.],200.,'stop',4,axis=-1),sos[1],12)
+        sos = buttfilt(self.dat.swapaxes(0,2),[1.],200.,'high',4,axis=0)
+        assert_array_almost_equal(
+            sos.swapaxes(0,2),buttfilt(self.dat,[1.],200.,'high',4),12)
+        self.assertRaises(ValueError,buttfilt,self.dat,[1.],200.,'high',4,
+                          engine='bla')
+
+    def test_float32(self):
+        ref = buttfilt(self.dat,[1.,10.],200.,'band',4)
+        y = buttfilt(self.dat,[1.,10.],200.,'band',4,dtype=np.float32)
+        self.assertEquals(y.dtype,np.float32)
+        assert_array_almost_equal(y,ref,4)
+
+
+class test_decimate(TestCase):
+    def setUp(self):
+        self.dat = np.random.randn(3,4,1200)
+
+    def test_iir(self):
+        y = decimate(self.dat,4)
+        self.assertEquals(y.shape,(3,4,300))
+        assert_array_almost_equal(
+            decimate(self.dat.swapaxes(1,2),4,axis=1).swapaxes(1,2),y,12)
+        b,a = cheby1(8,0.05,0.8/4)
+        assert_array_almost_equal(
+            y[1,2],filtfilt(b,a,self.dat[1,2])[::4],12)
+        # large factors are split into stages
+        self.assertEquals(_decimate_stages(20),[10,2])
+        self.assertEquals(_decimate_stages(64),[8,8])
+        y = decimate(self.dat,20)
+        self.assertEquals(y.shape,(3,4,60))
+        b,a = cheby1(8,0.05,0.8/2)
+        assert_array_almost_equal(
+            y,filtfilt(b,a,decimate(self.dat,10))[...,::2],12)
+        self.assertRaises(TypeError,decimate,self.dat,2.)
+
+    def test_fir(self):
+        b = firwin(31,1./5,window='hamming')
+        for axis in [1,2]:
+            y = decimate(self.dat,5,ftype='fir',axis=axis)
+            ref = lfilter(b,1.,self.dat,axis=axis)
+            ref = ref[:,::5] if axis == 1 else ref[...,::5]
+            assert_array_almost_equal(y,ref,12)
@@ -0,0 +1,38 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_equal
+
+from ptsa.helper import next_fast_len, is_fast_len, fft_len, pad_to_len, \
+     pad_to_next_pow2
+
+
+class test_fft_len(TestCase):
+    def test_next_fast_len(self):
+        fast = [n for n in range(1,3000) if is_fast_len(n)]
+        self.assertEquals(fast[:12],[1,2,3,4,5,6,8,9,10,12,15,16])
+        for n in range(1,2800):
+            self.assertEquals(next_fast_len(n),
+                              fast[np.searchsorted(fast,n)])
+        self.assertEquals(next_fast_len(2049),2160)
+        self.assertFalse(is_fast_len(0))
+
+    def test_fft_len(self):
+        # signal and kernel length
+        self.assertEquals(fft_len(2049,1000),3072)
+        self.assertEquals(fft_len(2049),2160)
+        self.assertTrue(fft_len(2049,1000) is fft_len(2049,1000))
+
+    def test_pad(self):
+        x = np.arange(10).reshape(2,5)
+        assert_array_equal(pad_to_len(x,7,axis=1)[:,5:],0)
+        assert_array_equal(pad_to_len(x,7,axis=1)[:,:5],x)
+        self.assertEquals(pad_to_next_pow2(x,axis=1).shape,(2,8))
+        self.assertTrue(pad_to_len(x,5,axis=1) is x)
@@ -0,0 +1,49 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_almost_equal, \
+     assert_array_equal
+
+from ptsa.data import TimeSeries,Dim
+from ptsa.hilbert import hilbert_pow
+
+
+class test_hilbert_pow(TestCase):
+    def setUp(self):
+        # 10 Hz and 30 Hz sine waves
+        t = np.arange(2000)/200.
+        dat = np.array([[np.sin(2*np.pi*10*t)],[2*np.sin(2*np.pi*30*t)]])
+        self.ts = TimeSeries(dat,'time',200.,
+                             dims=[Dim(['a','b'],'channels'),
+                                   Dim([0],'events'),Dim(t,'time')])
+        self.bands = [('alpha',[8.,12.]),('beta',[16.,26.]),
+                      ('gamma',[27.,33.])]
+
+    def test_methods(self):
+        for method in ['fft','filter']:
+            pow = hilbert_pow(self.ts,self.bands,verbose=False,
+                              method=method)
+            self.assertTrue(isinstance(pow,TimeSeries))
+            self.assertEquals(pow.dims[0].name,'freqs')
+            assert_array_equal(pow.dims[0],['alpha','beta','gamma'])
+            self.assertEquals(pow.shape,(3,)+self.ts.shape)
+            self.assertEquals(pow.taxis,3)
+            # the envelopes of the sine waves away from the edges
+            mid = pow[...,500:-500]
+            assert_array_almost_equal(mid[0,0],1.,2)
+            assert_array_almost_equal(mid[2,1],2.,2)
+            self.assertTrue(np.all(mid[1] < .05))
+        self.assertRaises(ValueError,hilbert_pow,self.ts,method='bla')
+
+    def test_float32(self):
+        pow = hilbert_pow(self.ts,self.bands,verbose=False,dtype=np.float32)
+        self.assertEquals(pow.dtype,np.float32)
+        assert_array_almost_equal(
+            pow,hilbert_pow(self.ts,self.bands,verbose=False),5)
@@ -0,0 +1,107 @@
+#emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+#ex: set sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the PTSA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import numpy as np
+from numpy.testing import TestCase, assert_array_almost_equal, \
+     assert_array_equal
+from scipy.signal import welch
+
+from ptsa.data import TimeSeries,Dim,DimArray
+from ptsa.psd import welch_psd, multitaper_psd, dpss_tapers, _dpss
+
+
+class test_psd(TestCase):
+    def setUp(self):
+        self.samplerate = 200.
+        t = np.arange(1000)/self.samplerate
+        dat = np.random.randn(2,3,1000)
+        # 10 Hz sine wave in the first channel
+        dat[0] += 2*np.sin(2*np.pi*10*t)
+        self.dat = dat
+        self.ts = TimeSeries(dat,'time',self.samplerate,
+                             dims=[Dim(['a','b'],'channels'),
+                                   Dim(np.arange(3),'events'),
+                                   Dim(t,'time')])
+
+    def test_welch_psd(self):
+        for kwargs in [{},dict(nperseg=100,noverlap=25,window='hamming'),
+                       dict(nperseg=128,nfft=256,detrend='linear'),
+                       dict(nperseg=101,scaling='spectrum')]:
+            freqs,psd = welch(self.dat,self.samplerate,**kwargs)
+            # small chunks give the same result as one chunk:
+            for chunk_bytes in [1,64*1024**2]:
+                f2,p2 = welch_psd(self.dat,self.samplerate,
+                                  chunk_bytes=chunk_bytes,**kwargs)
+                assert_array_almost_equal(f2,freqs)
+                assert_array_almost_equal(p2,psd)
+
+        # TimeSeries and time on another axis:
+        psd = welch_psd(self.ts.swapaxes(1,2),nperseg=100)
+        self.assertTrue(isinstance(psd,DimArray))
+        self.assertEquals(list(psd.dim_names),['channels','freqs','events'])
+        assert_array_almost_equal(
+            np.asarray(psd),
+            welch(self.dat,self.samplerate,nperseg=100)[1].swapaxes(1,2))
+        # the peak at 10 Hz:
+        assert_array_equal(
+            np.asarray(psd['freqs'])[np.argmax(psd[0],axis=0)],10.)
+
+        self.assertRaises(ValueError,welch_psd,self.dat)
+        self.assertRaises(ValueError,welch_psd,self.ts,nperseg=100,
+                          noverlap=100)
+
+    def test_multitaper_psd(self):
+        psd = multitaper_psd(self.ts,nw=2)
+        self.assertTrue(isinstance(psd,DimArray))
+        self.assertEquals(psd.shape,(2,3,501))
+        freqs = np.asarray(psd['freqs'])
+        assert_array_almost_equal(freqs,np.arange(501)*.2)
+        # the peak at 10 Hz (within the bandwidth of the tapers):
+        peaks = freqs[np.argmax(psd[0],axis=1)]
+        self.assertTrue(np.all(np.abs(peaks-10.) <= .4))
+        # the power of the noise (variance 1) is spread over the
+        # frequencies:
+        assert_array_almost_equal(
+            np.asarray(psd[1]).mean(axis=1)*self.samplerate/2.,1.,1)
+
+        # the same as a direct estimate for each row:
+        tapers = dpss_tapers(1000,2)
+        self.assertEquals(tapers.shape,(3,1000))
+        x = self.dat[1,2]-self.dat[1,2].mean()
+        direct = (np.abs(np.fft.rfft(x*tapers))**2).mean(axis=0)
+        direct[1:-1] *= 2
+        assert_array_almost_equal(np.asarray(psd[1,2]),
+                                  direct/self.samplerate)
+        freqs,p2 = multitaper_psd(self.dat,self.samplerate,nw=2,
+                                  chunk_bytes=1)
+        assert_array_almost_equal(p2,np.asarray(psd))
+
+    def test_dpss_tapers(self):
+        tapers = dpss_tapers(500,3,5)
+        # cached and read-only:
+        self.assertTrue(dpss_tapers(500,3,5) is tapers)
+        self.assertFalse(tapers.flags.writeable)
+        # orthonormal:
+        assert_array_almost_equal(np.dot(tapers,tapers.T),np.eye(5))
+        # the fallback gives the same tapers
+        assert_array_almost_equal(_dpss(500,3,5),tapers)
+
+    def test_scaled(self):
+        # raw data with the gain and offset of each channel
+        chans = np.rec.fromarrays([['a','b'],[2.,.5],[1.,0.]],
+                                  names='name,gain,offset')
+        ts = TimeSeries(self.dat,'time',self.samplerate,
+                        dims=[Dim(chans,'channels'),
+                              Dim(np.arange(3),'events'),
+                              Dim(np.arange(1000)/self.samplerate,'time')])
+        ts.scaling_dim = 'channels'
+        scaled = ts.scaled()
+        for func in [welch_psd,multitaper_psd]:
+            assert_array_almost_equal(np.asarray(func(ts)),
+                                      np.asarray(func(scaled)))
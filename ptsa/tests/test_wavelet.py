@@ -7,12 +7,18 @@
 #
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
+import os
+import tempfile
 import numpy as np
 import re
 from numpy.testing import * #NumpyTest, NumpyTestCase
 
 from ptsa.wavelet import *
 from ptsa.data import TimeSeries,Dim
+from dimarray.attrarray import HAS_H5PY
+
+if HAS_H5PY:
+    import h5py
 
 
 
@@ -110,6 +116,21 @@ class test_morlet_multi(TestCase):
         self.assertTrue(len(x[6])<len(x[8]))
         self.assertTrue(len(x[8])<len(x[9]))
 
+    def test_fconv_multi(self):
+        dat = np.random.randn(2,2049)
+        kernels = [np.random.randn(3,1000),
+                   np.random.randn(3,1000)+1j*np.random.randn(3,1000)]
+        for kern in kernels:
+            for mode in ['full','same','valid']:
+                x = fconv_multi(kern,dat,mode)
+                self.assertEqual(x.shape[0],6)
+                self.assertEqual(np.iscomplexobj(x),np.iscomplexobj(kern))
+                # all pairs of rows
+                assert_array_almost_equal(
+                    x[5],np.convolve(dat[1],kern[2],mode),10)
+                assert_array_almost_equal(
+                    x[2],np.convolve(dat[0],kern[1],mode),10)
+
     def test_phase_pow_multi(self):
         dat = np.vstack((np.arange(0,1000),np.arange(0,1000)))
         # make sure errors are raised when not called with enough or
@@ -373,3 +394,110 @@ class test_morlet_multi(TestCase):
         # ensure valid output values:
         powerTest = z_ts >= 0
         self.assertTrue(powerTest.all())
+
+    def test_phase_pow_multi_fused(self):
+        samplerate = 200.
+        dat = np.random.randn(3,4,800)
+        dat_ts = TimeSeries(dat,'time',samplerate,
+                            dims=[Dim(np.arange(3),'events'),
+                                  Dim(np.arange(4),'channels'),
+                                  Dim(np.arange(800)/samplerate-1.,'time')])
+        freqs = [4,10,30]
+        power = phase_pow_multi(freqs,dat_ts,to_return='both')[1]
+        buf = 100
+
+        # small chunks give the same result as one chunk:
+        z = phase_pow_multi(freqs,dat_ts,to_return='power',chunk_bytes=1)
+        assert_array_equal(np.asarray(z),np.asarray(power))
+
+        z = phase_pow_multi(freqs,dat_ts,to_return='power',log_power=True,
+                            buffer_time=.5,bin_samples=20,chunk_bytes=1)
+        self.assertEqual(z.shape,(3,3,4,30))
+        self.assertEqual(z.samplerate,10.)
+        expected = np.log10(np.asarray(power)[...,buf:-buf])
+        expected = expected.reshape(3,3,4,30,20).mean(-1)
+        assert_array_almost_equal(np.asarray(z),expected,5)
+        assert_array_almost_equal(
+            np.asarray(z['time']),
+            (np.arange(buf,800-buf)/samplerate-1.).reshape(30,20).mean(-1))
+
+        z = phase_pow_multi(freqs,dat_ts,to_return='power',
+                            buffer_time=.5,decimate_q=4)
+        self.assertEqual(z.shape,(3,3,4,150))
+        self.assertEqual(z.samplerate,50.)
+        assert_array_almost_equal(
+            np.asarray(z),
+            decimate(np.asarray(power)[...,buf:-buf],4),3)
+        assert_array_almost_equal(np.asarray(z['time']),
+                                  np.arange(-.5,2.5,.02))
+
+        # plain arrays with the time dimension first:
+        z = phase_pow_multi(freqs,dat.T,samplerate,time_axis=0,
+                            to_return='power',buffer_time=.5)
+        self.assertEqual(z.shape,(3,600,4,3))
+        assert_array_almost_equal(
+            z,np.asarray(power)[...,buf:-buf].transpose(0,3,2,1),5)
+
+        self.assertRaises(ValueError,phase_pow_multi,freqs,dat_ts,
+                          to_return='both',log_power=True)
+        self.assertRaises(ValueError,phase_pow_multi,freqs,dat_ts,
+                          to_return='power',bin_samples=2,decimate_q=2)
+
+    def test_phase_pow_continuous(self):
+        samplerate = 100.
+        dat = np.random.randn(2,3000)
+        freqs = [2,10,30]
+        phase,power = phase_pow_multi(freqs,dat,samplerate,
+                                      conv_dtype=np.complex128)
+        # small blocks, so that many blocks are needed:
+        for block_samples in [100,3000]:
+            ph2,p2 = phase_pow_continuous(freqs,dat,samplerate,
+                                          to_return='both',
+                                          block_samples=block_samples,
+                                          conv_dtype=np.complex128)
+            assert_array_almost_equal(p2,power,10)
+            # compare the phase on the unit circle:
+            assert_array_almost_equal(np.exp(1j*ph2),np.exp(1j*phase),8)
+        p2 = phase_pow_continuous(freqs,dat[1],samplerate,block_samples=100)
+        self.assertEqual(p2.shape,(3,3000))
+        assert_allclose(p2,power[:,1],rtol=1e-3)
+
+        # memory mapped output:
+        mm = np.memmap(tempfile.TemporaryFile(),dtype=np.float32,
+                       mode='w+',shape=(3,2,3000))
+        p2 = phase_pow_continuous(freqs,dat,samplerate,out=mm,
+                                  block_samples=500)
+        self.assertTrue(p2 is mm)
+        assert_allclose(mm,power,rtol=1e-3)
+
+        # TimeSeries:
+        dat_ts = TimeSeries(dat,'time',samplerate,
+                            dims=[Dim(np.arange(2),'channels'),
+                                  Dim(np.arange(3000)/samplerate,'time')])
+        p2 = phase_pow_continuous(freqs,dat_ts,to_return='phase')
+        self.assertEqual(list(p2.dim_names),['freqs','channels','time'])
+        assert_array_almost_equal(np.exp(1j*np.asarray(p2)),
+                                  np.exp(1j*phase),3)
+
+        self.assertRaises(ValueError,phase_pow_continuous,freqs,dat,
+                          samplerate,out=np.empty((3,2,10)))
+        self.assertRaises(ValueError,phase_pow_continuous,freqs,dat)
+
+    def test_phase_pow_continuous_hdf5(self):
+        if not HAS_H5PY:
+            return
+        samplerate = 100.
+        dat = np.random.randn(2,3000)
+        freqs = [2,10]
+        power = phase_pow_multi(freqs,dat,samplerate,to_return='power')
+        fd,filename = tempfile.mkstemp(suffix='.hdf5')
+        os.close(fd)
+        try:
+            f = h5py.File(filename,'w')
+            dset = f.create_dataset('power',(2,2,3000),'f4')
+            phase_pow_continuous(freqs,dat,samplerate,out=dset,
+                                 block_samples=400)
+            assert_allclose(dset[:],power,rtol=1e-3)
+            f.close()
+        finally:
+            os.remove(filename)
@@ -14,8 +14,9 @@ import numpy as np
 from scipy.fftpack import fft,ifft
 # import scipy.signal
 # import scipy.ndimage
-# from ptsa.filt import decimate
-from ptsa.helper import reshape_to_2d,reshape_from_2d,centered,next_pow2
+from ptsa.filt import decimate
+from ptsa.helper import reshape_to_2d,reshape_from_2d,centered,next_pow2,\
+     fft_len
 from ptsa.data import TimeSeries,Dim
 from ptsa.fixed_scipy import morlet as morlet_wavelet
 
@@ -270,7 +271,9 @@ def fconv_multi(in1, in2, mode='full'):
     returns an inverse fft (by calling scipy.signal.ifft) of the
     result. Therefore the output array has as many rows as the product
     of the number of rows in in1 and in2 (the number of colums depend
-    on the mode).
+    on the mode). The FFTs are padded to a fast length (see
+    ptsa.helper.fft_len), and real-input FFTs are used if both inputs
+    are real.
     
     Parameters
     ----------
@@ -301,26 +304,23 @@ def fconv_multi(in1, in2, mode='full'):
     complex_result = (np.issubdtype(in1.dtype, np.complex) or
                       np.issubdtype(in2.dtype, np.complex))
 
-    # determine the size based on the next power of 2
+    # determine the size based on the next fast length
     actual_size = s1+s2-1
-    size = np.power(2,next_pow2(actual_size))
-
-    # perform the fft of each row of in1 and in2:
-    #in1_fft = np.empty((num1,size),dtype=np.complex128)
-    in1_fft = np.empty((num1,size),dtype=np.complex)
-    for i in xrange(num1):
-        in1_fft[i] = fft(in1[i],size)
-    #in2_fft = np.empty((num2,size),dtype=np.complex128)
-    in2_fft = np.empty((num2,size),dtype=np.complex)
-    for i in xrange(num2):
-        in2_fft[i] = fft(in2[i],size)
-    
-    # duplicate the signals and multiply before taking the inverse
-    in1_fft = in1_fft.repeat(num2,axis=0)
-    in1_fft *= np.vstack([in2_fft]*num1)
-    ret = ifft(in1_fft)
-#     ret = ifft(in1_fft.repeat(num2,axis=0) * \
-#                np.vstack([in2_fft]*num1))
+    size = fft_len(s1,s2)
+
+    # perform the fft of all rows of in1 and in2 and multiply every
+    # pair before taking the inverse
+    if complex_result:
+        in1_fft = fft(in1,size,axis=1)
+        in2_fft = fft(in2,size,axis=1)
+        ret = ifft((in1_fft[:,np.newaxis]*in2_fft[np.newaxis]).reshape(
+                num1*num2,size),axis=1)
+    else:
+        in1_fft = np.fft.rfft(in1,size,axis=1)
+        in2_fft = np.fft.rfft(in2,size,axis=1)
+        ret = np.fft.irfft((in1_fft[:,np.newaxis]*
+                            in2_fft[np.newaxis]).reshape(num1*num2,-1),
+                           size,axis=1)
     
     # delete to save memory
     del in1_fft, in2_fft
@@ -328,10 +328,6 @@ def fconv_multi(in1, in2, mode='full'):
     # strip of extra space if necessary
     ret = ret[:,:actual_size]
     
-    # determine if complex, keeping only real if not
-    if not complex_result:
-        ret = ret.real
-    
     # now only keep the requested portion
     if mode == "full":
         return ret
@@ -346,10 +342,78 @@ def fconv_multi(in1, in2, mode='full'):
 
 
 
+def _full_spectrum(dat, size):
+    """
+    Return the FFT of length size of each row of dat, using a
+    real-input FFT for real data.
+    """
+    if np.iscomplexobj(dat):
+        return fft(dat,size,axis=1)
+    half = np.fft.rfft(dat,size,axis=1)
+    spec = np.empty((dat.shape[0],size),dtype=half.dtype)
+    spec[:,:half.shape[1]] = half
+    # the negative frequencies are the conjugates of the positive ones
+    spec[:,half.shape[1]:] = half[:,(size+1)//2-1:0:-1].conj()
+    return spec
+
+
+def _power_fused(wavelets, eegdat, size, row_gain, conv_dtype, buf,
+                 log_power, bin_samples, decimate_q, chunk_bytes):
+    """
+    Return the wavelet power of the rows of eegdat (2D with time on
+    the 2nd dimension) for phase_pow_multi with to_return='power'.
+
+    The rows are processed in chunks of about chunk_bytes of complex
+    convolution results. The power of each chunk is computed right
+    after the inverse FFT and the buffer is removed, the log taken,
+    and the bins averaged or the power decimated before it is written
+    to the output. The output has the rows of all wavelets stacked
+    like the wav_coef array of phase_pow_multi.
+    """
+    nrows,nsamp = eegdat.shape
+    npow = nsamp-2*buf
+    if bin_samples is not None:
+        nout = npow//bin_samples
+    elif decimate_q is not None:
+        nout = int(np.ceil(npow/float(decimate_q)))
+    else:
+        nout = npow
+    # the float type that goes with conv_dtype:
+    pow_dtype = np.abs(np.zeros(1,conv_dtype)).dtype
+    power = np.empty((nrows*len(wavelets),nout),dtype=pow_dtype)
+
+    wav_ffts = [fft(wav,size) for wav in wavelets]
+    starts = [(len(wav)-1)//2+buf for wav in wavelets]
+    # the inverse FFT and its product with the data take about 2
+    # complex128 arrays of size samples per row:
+    step = int(max(1,chunk_bytes//(2*16*size)))
+    for r0 in range(0,nrows,step):
+        r1 = min(r0+step,nrows)
+        dat_fft = _full_spectrum(eegdat[r0:r1],size)
+        for w,wav_fft in enumerate(wav_ffts):
+            start = starts[w]
+            wc = ifft(dat_fft*wav_fft,axis=1)[:,start:start+npow]
+            wc = wc.astype(conv_dtype)
+            if row_gain is not None:
+                wc *= row_gain[r0:r1]
+            pw = np.abs(wc)**2
+            del wc
+            if log_power:
+                pw = np.log10(pw)
+            if bin_samples is not None:
+                pw = pw[:,:nout*bin_samples].reshape(
+                    r1-r0,nout,bin_samples).mean(2)
+            elif decimate_q is not None:
+                pw = decimate(pw,decimate_q,axis=1)
+            power[w*nrows+r0:w*nrows+r1] = pw
+    return power
+
+
 def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
                     to_return='both', time_axis=-1,
                     conv_dtype=np.complex64, freq_name='freqs',
-                    **kwargs):
+                    log_power=False, buffer_time=0., bin_samples=None,
+                    decimate_q=None, chunk_bytes=64*1024**2, **kwargs):
     """
     Calculate phase and power with wavelets across multiple events.
 
@@ -392,6 +456,23 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
     freq_name : {string},optional
         Name of frequency dimension of the returned TimeSeries object
         (only used if dat is a TimeSeries instance).
+    log_power : {bool},optional
+        Return log10 of the power (only with to_return='power').
+    buffer_time : {float},optional
+        Duration of the buffer (in seconds) to remove from both ends
+        of the time dimension (only with to_return='power').
+    bin_samples : {int},optional
+        Average the power in consecutive bins of this many samples
+        (after taking the log if log_power is True). Samples that do
+        not fill a whole bin at the end are dropped (only with
+        to_return='power').
+    decimate_q : {int},optional
+        Decimate the power by this factor with ptsa.filt.decimate
+        (only with to_return='power'; cannot be combined with
+        bin_samples).
+    chunk_bytes : {int},optional
+        Approximate size (in bytes) of the complex convolution results
+        held at once by the power-only path.
     **kwargs : {**kwargs},optional
         Additional key word arguments to be passed on to morlet_multi().
     
@@ -401,6 +482,15 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
     returned array(s) has/have one more dimension than dat. The added
     dimension is for the frequencies and is inserted as the first
     dimension.
+
+    Notes
+    -----
+    With to_return='power' the data are processed in chunks of rows
+    and the power is computed right after each inverse FFT, so the
+    complex wavelet coefficients are never held for all the data.
+    The log, buffer removal, and binning or decimation are applied to
+    each chunk before it is written to the output. Z-scoring needs
+    the statistics across events and has to be done on the result.
     """
 
     dat_is_ts = False # is dat a TimeSeries instance?
@@ -428,6 +518,15 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
         raise ValueError("conv_dtype must be a complex data type!\n"+
                          "Invalid value: "+str(conv_dtype))
 
+    if to_return != 'power' and (log_power or buffer_time or
+                                 bin_samples is not None or
+                                 decimate_q is not None):
+        raise ValueError("log_power, buffer_time, bin_samples, and "+
+                         "decimate_q are only supported with "+
+                         "to_return='power'.")
+    if bin_samples is not None and decimate_q is not None:
+        raise ValueError("bin_samples and decimate_q cannot be combined.")
+
     # generate list of wavelets:
     wavelets = morlet_multi(freqs,widths,samplerates,**kwargs)
         
@@ -439,25 +538,63 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
                          "samples: "+str(dat.shape[time_axis])+"\nmax wavelet "+
                          "samples: "+str(np.max([len(i) for i in wavelets])))
     
+    # data loaded raw still need their gain applied. The convolution
+    # is linear, so a gain without offset is applied to its result
+    # instead of to a float copy of the data:
+    row_gain = None
+    if dat_is_ts:
+        gain,offset = dat._get_scaling()
+        if gain is not None:
+            if np.any(offset):
+                dat = dat.scaled()
+            else:
+                gshape = list(dat.shape)
+                gshape[time_axis] = 1
+                row_gain = reshape_to_2d(gain*np.ones(gshape), time_axis)
+
     # reshape the data to 2D with time on the 2nd dimension
     origshape = dat.shape
     eegdat = reshape_to_2d(dat, time_axis) #.view(np.ndarray)
 
-    # for efficiency pre-generate empty array for convolution:
-    wav_coef = np.empty((eegdat.shape[0]*len(freqs),
-                         eegdat.shape[1]),dtype=conv_dtype)
-    
-    # populate this array with the convolutions:
-    i=0
-    step = len(eegdat)
-    for wav in wavelets:
-        wc = fconv_multi(wav,eegdat,'same')
-        wav_coef[i:i+step] = wc
-        i+=step
-        # for ev_dat in eegdat:
-        #     wav_coef[i]=np.convolve(wav,ev_dat,'same')
-        #     #wav_coef[i]=scipy.signal.fftconvolve(ev_dat,wav,'same')
-        #     i+=1
+    nsamp = eegdat.shape[1]
+    size = fft_len(nsamp,np.max([len(wav) for wav in wavelets]))
+
+    if to_return == 'power':
+        # samples of buffer to remove from each end:
+        buf = 0
+        if buffer_time:
+            rates = np.unique(np.atleast_1d(samplerates))
+            if len(rates) > 1:
+                raise ValueError("buffer_time requires a single samplerate.")
+            buf = int(np.round(rates[0]*buffer_time))
+            if 2*buf >= nsamp:
+                raise ValueError("The buffer must be shorter than half of "+
+                                 "the data: "+str(buffer_time))
+        power = _power_fused(wavelets,eegdat,size,row_gain,conv_dtype,
+                             buf,log_power,bin_samples,decimate_q,
+                             chunk_bytes)
+    else:
+        # for efficiency pre-generate empty array for convolution:
+        wav_coef = np.empty((eegdat.shape[0]*len(freqs),
+                             eegdat.shape[1]),dtype=conv_dtype)
+
+        # populate this array with the convolutions (as fconv_multi
+        # with mode 'same'), transforming the data only once with an
+        # FFT length that fits the longest wavelet:
+        dat_fft = _full_spectrum(eegdat,size)
+        i=0
+        step = len(eegdat)
+        for wav in wavelets:
+            start = (len(wav)-1)//2
+            wc = ifft(dat_fft*fft(wav,size),axis=1)
+            wav_coef[i:i+step] = wc[:,start:start+nsamp]
+            if row_gain is not None:
+                wav_coef[i:i+step] *= row_gain
+            i+=step
+            # for ev_dat in eegdat:
+            #     wav_coef[i]=np.convolve(wav,ev_dat,'same')
+            #     #wav_coef[i]=scipy.signal.fftconvolve(ev_dat,wav,'same')
+            #     i+=1
     
     # Determine shape for ouput arrays with added frequency dimension:
     newshape = list(origshape)
@@ -473,15 +610,35 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
         dims_with_freq[1:] = dat.dims[:]
         
     if to_return == 'power' or to_return == 'both':
-        # calculate power (wav_coef values are complex, so taking the
-        # absolute value is necessary before taking the power):
-        power = np.abs(wav_coef)**2
-        # reshape to new shape:
-        power = reshape_from_2d(power,time_axis,newshape)
+        if to_return == 'both':
+            # calculate power (wav_coef values are complex, so taking
+            # the absolute value is necessary before taking the power):
+            power = np.abs(wav_coef)**2
+        # reshape to new shape (the power-only path may have changed
+        # the number of samples):
+        pshape = list(newshape)
+        pshape[time_axis] = power.shape[1]
+        power = reshape_from_2d(power,time_axis,tuple(pshape))
         if dat_is_ts:
+            samplerate = dat.samplerate
+            pdims = dims_with_freq
+            if power.shape[time_axis] != nsamp:
+                # adjust the time dimension to the removed buffer and
+                # bins or decimation:
+                times = np.asarray(dat[dat.tdim])[buf:nsamp-buf]
+                if bin_samples is not None:
+                    nbins = len(times)//bin_samples
+                    times = times[:nbins*bin_samples].reshape(
+                        nbins,bin_samples).mean(1)
+                    samplerate = samplerate/float(bin_samples)
+                elif decimate_q is not None:
+                    times = times[::decimate_q]
+                    samplerate = samplerate/float(decimate_q)
+                pdims = dims_with_freq.copy()
+                pdims[time_axis] = Dim(times,dat.tdim)
             power = TimeSeries(power, tdim=dat.tdim,
-                               samplerate=dat.samplerate,
-                               dims=dims_with_freq)
+                               samplerate=samplerate,
+                               dims=pdims)
             
     
     if to_return == 'phase' or to_return == 'both':
@@ -512,6 +669,177 @@ def phase_pow_multi(freqs, dat,  samplerates=None, widths=5,
         return phase,power
 
 
+def phase_pow_continuous(freqs, dat, samplerate=None, widths=5,
+                         to_return='power', out=None, block_samples=None,
+                         conv_dtype=np.complex64, freq_name='freqs',
+                         **kwargs):
+    """
+    Calculate phase and power with wavelets for continuous recordings.
+
+    Convolves dat with Morlet wavelets (like phase_pow_multi) using
+    overlap-save: the signal is processed in blocks sized to the
+    longest wavelet, so the FFTs stay short and only one block of the
+    data and of the complex wavelet coefficients is held at a time.
+    The results are written block by block into the output arrays,
+    which can be memory mapped files or HDF5 datasets. This way the
+    power and phase of a whole session can be computed once and then
+    sliced by events.
+
+    Parameters
+    ----------
+    freqs : {int, float, array_like of ints or floats}
+        The frequencies of the Morlet wavelets.
+    dat : {array_like}
+        The data with samples on the last dimension (1D or 2D with
+        channels first). Besides arrays, anything that can be sliced
+        like one (e.g., numpy.memmap or h5py.Dataset) can be used,
+        so the data do not need to fit into memory.
+    samplerate : {float},optional
+        The sample rate of the signal. Must be specified if dat is not
+        a TimeSeries instance.
+    widths : {float, array_like of floats},optional
+        The width(s) of the wavelets in cycles. See docstring of
+        morlet_multi() for details.
+    to_return : {'power','phase','both'},optional
+        Specify whether to return power, phase, or both.
+    out : {array_like, tuple of array_likes},optional
+        Array(s) to write the power and/or phase into (e.g., a
+        numpy.memmap or h5py.Dataset), with the shape
+        (len(freqs),channels,samples). With to_return='both', a
+        tuple of (phase,power) arrays. New arrays are allocated in
+        memory if not specified.
+    block_samples : {int},optional
+        Number of output samples per block (the FFT length also
+        includes the length of the longest wavelet). Defaults to at
+        least 8 times the length of the longest wavelet.
+    conv_dtype : {numpy.complex*},optional
+        Data type of the wavelet coefficients (see phase_pow_multi).
+    freq_name : {string},optional
+        Name of frequency dimension of the returned TimeSeries object
+        (only used if dat is a TimeSeries instance and out is not
+        specified).
+    **kwargs : {**kwargs},optional
+        Additional key word arguments to be passed on to morlet_multi().
+
+    Returns
+    -------
+    The power and/or phase as specified in to_return (out if it was
+    specified). The results match those of phase_pow_multi() for the
+    whole signal: the data are taken to be zero before the first and
+    after the last sample.
+
+    Examples
+    --------
+    >>> f = h5py.File('session_power.hdf5','w')
+    >>> pow = f.create_dataset('power',(len(freqs),)+dat.shape,'f4')
+    >>> phase_pow_continuous(freqs,dat,samplerate,out=pow)
+    >>> ev_pow = pow[:,:,offset-buf:offset+dur+buf]
+    """
+    dat_is_ts = isinstance(dat,TimeSeries)
+    gain = offset = None
+    if dat_is_ts:
+        samplerate = dat.samplerate
+        if dat.get_axis(dat.tdim) != dat.ndim-1:
+            raise ValueError('The time dimension must be the last '+
+                             'dimension of dat.')
+        # data loaded raw are scaled block by block:
+        gain,offset = dat._get_scaling()
+        src = dat.view(np.ndarray)
+    elif samplerate is None:
+        raise ValueError('Samplerate must be specified unless you provide a TimeSeries!')
+    else:
+        src = dat
+
+    if len(src.shape) == 1:
+        get_block = lambda start,stop: np.atleast_2d(src[start:stop])
+        nrows = 1
+    elif len(src.shape) == 2:
+        get_block = lambda start,stop: src[:,start:stop]
+        nrows = src.shape[0]
+    else:
+        raise ValueError('dat must be 1D or 2D (channels x samples).')
+    nsamp = src.shape[-1]
+
+    freqs = np.atleast_1d(freqs)
+    if to_return != 'both' and to_return != 'power' and to_return != 'phase':
+        raise ValueError("to_return must be \'power\', \'phase\', or \'both\' to "+
+                         "specify whether power, phase, or both are to be "+
+                         "returned. Invalid value: %s " % to_return)
+    if not np.issubdtype(conv_dtype,np.complex):
+        raise ValueError("conv_dtype must be a complex data type!\n"+
+                         "Invalid value: "+str(conv_dtype))
+
+    wavelets = morlet_multi(freqs,widths,samplerate,**kwargs)
+    lens = [len(wav) for wav in wavelets]
+    # offsets of the 'same' output in the full convolutions and the
+    # samples needed before and after each output block:
+    starts = [(l-1)//2 for l in lens]
+    before = np.max([l-1-s for l,s in zip(lens,starts)])
+    after = np.max(starts)
+    if block_samples is None:
+        block_samples = max(8*np.max(lens),2**14)
+    size = fft_len(block_samples+before+after)
+    step = size-before-after
+    wav_ffts = [fft(wav,size) for wav in wavelets]
+
+    # the output arrays:
+    shape = (len(freqs),)+((nrows,nsamp) if len(src.shape) == 2
+                           else (nsamp,))
+    pow_dtype = np.abs(np.zeros(1,conv_dtype)).dtype
+    if out is None:
+        outs = [np.empty(shape,pow_dtype)
+                for i in range(2 if to_return == 'both' else 1)]
+    else:
+        outs = list(out) if to_return == 'both' else [out]
+        if len(outs) != (2 if to_return == 'both' else 1):
+            raise ValueError("out must be a tuple of (phase,power) arrays "+
+                             "with to_return='both'.")
+        for o in outs:
+            if tuple(o.shape) != shape:
+                raise ValueError("The shape of out must be "+str(shape)+
+                                 ": "+str(tuple(o.shape)))
+
+    seg = np.zeros((nrows,size))
+    for n0 in range(0,nsamp,step):
+        n1 = min(n0+step,nsamp)
+        # the segment of the data with the samples before and after
+        # the block (zeros beyond the ends of the data):
+        seg_start = n0-before
+        lo = max(seg_start,0)
+        hi = min(seg_start+size,nsamp)
+        block = np.asarray(get_block(lo,hi))
+        if gain is not None:
+            block = block*gain
+            if np.any(offset):
+                block += offset
+        seg[:] = 0
+        seg[:,lo-seg_start:hi-seg_start] = block
+        seg_fft = _full_spectrum(seg,size)
+        for w,wav_fft in enumerate(wav_ffts):
+            start = starts[w]+before
+            wc = ifft(seg_fft*wav_fft,axis=1)[:,start:start+n1-n0]
+            wc = wc.astype(conv_dtype)
+            if len(src.shape) == 1:
+                wc = wc[0]
+            if to_return != 'power':
+                outs[0][w,...,n0:n1] = np.angle(wc)
+            if to_return != 'phase':
+                outs[-1][w,...,n0:n1] = np.abs(wc)**2
+
+    if out is None and dat_is_ts:
+        dims_with_freq = np.empty(len(dat.dims)+1,dat.dims.dtype)
+        dims_with_freq[0] = Dim(freqs,freq_name)
+        dims_with_freq[1:] = dat.dims[:]
+        outs = [TimeSeries(o,tdim=dat.tdim,samplerate=dat.samplerate,
+                           dims=dims_with_freq) for o in outs]
+
+    if to_return == 'both':
+        return tuple(outs)
+    elif out is not None:
+        return out
+    return outs[0]
+
+
 
 ##################
 # Old wavelet code
@@ -14,6 +14,7 @@ import sys
 from ptsa.pca import pca
 from ptsa.iwasobi import iwasobi
 from ptsa.wavelet import iswt,swt
+from dimarray import SharedArray
 
 try:
     import multiprocessing as mp
@@ -246,6 +247,15 @@ def _clean_comp(comp, Kthr, L, thld=None):
 
     return comp, thld
 
+
+def _clean_comp_shared(shared, row, Kthr, L, thld=None):
+    """
+    Clean row of the SharedArray shared in place (for worker
+    processes) and return the threshold.
+    """
+    comp,thld = _clean_comp(shared.array()[row], Kthr, L, thld=thld)
+    return thld
+
     
 def remove_strong_artifacts(data, A, icaEEG, Comp, Kthr=1.25, F=256,
                             Cthr=None, num_mp_procs=0):
@@ -316,6 +326,9 @@ def remove_strong_artifacts(data, A, icaEEG, Comp, Kthr=1.25, F=256,
 
 
     if has_mp and num_mp_procs != 0:
+        # the workers clean the components in shared memory, so they
+        # are not sent back and forth
+        shared = SharedArray.from_array(icaEEG[Comp])
         po = mp.Pool(num_mp_procs)
         mp_res = []
         
@@ -327,8 +340,8 @@ def remove_strong_artifacts(data, A, icaEEG, Comp, Kthr=1.25, F=256,
             thld = opt[c]
         if has_mp and num_mp_procs != 0:
             # call with mp
-            mp_res.append(po.apply_async(_clean_comp,
-                                         (icaEEG[Comp[c]], Kthr,
+            mp_res.append(po.apply_async(_clean_comp_shared,
+                                         (shared, c, Kthr,
                                           L, thld)))
         else:
             sys.stdout.write("Component #%d: "%(Comp[c]))
@@ -347,22 +360,25 @@ def remove_strong_artifacts(data, A, icaEEG, Comp, Kthr=1.25, F=256,
 
     if has_mp and num_mp_procs != 0:
         # collect results
-        po.close()
-        po.join()
-        for c in xrange(len(Comp)):
-            sys.stdout.write("Component #%d: "%(Comp[c]))
-            sys.stdout.flush()
-            comp,thld = mp_res[c].get()
-            icaEEG[Comp[c]] = comp
-            if find_thresh:
-                opt[c] = thld
-            if opt[c] > 0.0:
-                # disp(['The component #' num2str(Comp(c)) ' has been filtered']);
-                sys.stdout.write("was filtered at %f\n"%(opt[c]))
-                sys.stdout.flush()
-            else:
-                sys.stdout.write("passed unchanged\n")
+        try:
+            po.close()
+            po.join()
+            for c in xrange(len(Comp)):
+                sys.stdout.write("Component #%d: "%(Comp[c]))
                 sys.stdout.flush()
+                thld = mp_res[c].get()
+                icaEEG[Comp[c]] = shared.array()[c]
+                if find_thresh:
+                    opt[c] = thld
+                if opt[c] > 0.0:
+                    # disp(['The component #' num2str(Comp(c)) ' has been filtered']);
+                    sys.stdout.write("was filtered at %f\n"%(opt[c]))
+                    sys.stdout.flush()
+                else:
+                    sys.stdout.write("passed unchanged\n")
+                    sys.stdout.flush()
+        finally:
+            shared.unlink()
 
     # end
     return opt